@@ -1,142 +1,147 @@
 import os
+import sys
+import signal
+import threading
 import time
-import requests
-import time
-import datetime
 import traceback
-import re
-import json
-import base64
+import contextlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
-from openai import OpenAI
-from dotenv import load_dotenv
-from supabase import create_client, Client
-from io import BytesIO
-load_dotenv()
-
-# --------- SLACK ENVS ------------
-SLACK_BOT_TOKEN= os.getenv("SLACK_BOT_TOKEN")
-SLACK_APP_TOKEN= os.getenv("SLACK_APP_TOKEN")
-# --------- AI CONFIG ------------
-AI_KEY = os.getenv("AI_KEY")
-AI_BASE_URL = os.getenv("AI_BASE_URL")
-DEFAULT_MODEL = os.getenv("DEFAULT_MODEL")
-ALLOWED_MODELS = ["google/gemini-2.5-flash-lite-preview-09-2025", "qwen/qwen3-235b-a22b", "z-ai/glm-4.7", "openai/gpt-oss-120b", "moonshotai/kimi-k2.5", "minimax/minimax-m2.1", "x-ai/grok-4.1-fast"]
-# ---------- MODERATION CONFIG ----------
-MODERATION_URL = os.getenv("MODERATION_URL")
-MODERATION_KEY = os.getenv("MODERATION_KEY")
-# --------- TOOLS ------------
-SEARCH_API_URL= os.getenv("SEARCH_API_URL")
-SEARCH_API_KEY= os.getenv("SEARCH_API_KEY")
-IMGGEN_MODEL = os.getenv("IMGGEN_MODEL")
-LINKUP_API_KEY = os.getenv("LINKUP_API_KEY")
-# --------- MEMORY CONFIG ---------
-SUPABASE_URL= os.getenv("SUPABASE_URL")
-SUPABASE_KEY= os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-# ----------- MISC ----------
-ALLOWED_CHANNEL_ID = os.getenv("ALLOWED_CHANNEL_ID")
-
-
-default_client = OpenAI(
-    api_key=AI_KEY,
-   base_url=AI_BASE_URL
+from slack_sdk import WebClient
+from tool_engine import ToolEngine
+from scheduler import Scheduler
+from router import ModelRouter
+from http_client import HttpLayer, CircuitOpenError, unavailable_message
+from tool_cache import ToolResultCache
+from vision import VisionPipeline
+from prompt_builder import PromptBuilder
+from reducer import ToolOutputReducer
+from slack_stream import SlackStreamer, stream_completion
+from cache import TTLCache
+from history import create_memory
+from store import create_conversation_store
+from summaries import ThreadSummaries
+from recall import create_recall
+from retention import create_retention, DAY
+from coordination import create_coordinator
+from jobs import JobRunner, create_job_store
+from metrics import registry, span, bind, start_trace, record_usage, start_exporters, serve, TracedWebClient
+from slack_client import SlackRateLimiter, RateLimitedWebClient
+from profiler import Profiler, MODES
+from startup import Lazy, Health, touch
+from config import *
+from media import extract_images
+from prompts import tools, SYSTEM_INSTRUCTIONS, turn_context, tool_status_text, moderation_refusal, reply_blocks, HELP_BLOCKS, BUSY_TEXT, summary_request, summary_context, recall_context, job_started_text, image_ready_text, job_result_context, PROFILE_USAGE
+from turn import memory_row, build_prompt, completion, read_response, tool_status, tool_jobs, needs_long_lane, tool_messages, reply_footer, error_text, image_uploads, images_uploaded_text, job_failure_text, research_footer, gauges, SUPABASE_TABLES
+
+# openai and supabase take a good second to import and the clients can fail on bad settings,
+# so they are built the first time they're used (or during warm-up), see startup.py
+def connect_supabase():
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def openai_client(base_url, api_key):
+    from openai import OpenAI
+    return OpenAI(base_url=base_url, api_key=api_key)
+
+# --------- MEMORY ---------
+supabase = Lazy("supabase", connect_supabase)
+conversation_store = create_conversation_store(
+    CONVERSATION_STORE,
+    supabase,
+    path=CONVERSATION_DB,
+    archive_horizon=CHAT_ARCHIVE_AFTER_DAYS * DAY or None,
+    partitioned=CHAT_MEM_PARTITIONED
+)
+chat_memory = create_memory(conversation_store, window=HISTORY_WINDOW, journal_path=CHAT_MEM_JOURNAL, flush_interval=CHAT_MEM_FLUSH_INTERVAL)
+
+default_client = Lazy("llm", lambda: openai_client(AI_BASE_URL, AI_KEY))
+moderation_client = Lazy("moderation", lambda: openai_client(MODERATION_URL, MODERATION_KEY))
+embeddings_client = Lazy("embeddings", lambda: openai_client(EMBEDDINGS_BASE_URL, EMBEDDINGS_KEY))
+
+# the token is checked by the slack health check instead of a blocking auth.test at import
+if SLACK_API_URL:
+    app=App(client=WebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL), token_verification_enabled=False)
+else:
+    app=App(token=SLACK_BOT_TOKEN, token_verification_enabled=False)
+
+# one set of Slack rate limit buckets for every client in the process (see slack_client.py)
+slack_limiter = SlackRateLimiter(
+    SLACK_RATE_LIMITS,
+    burst_seconds=SLACK_RATE_BURST,
+    max_retries=SLACK_MAX_RETRIES,
+    max_retry_wait=SLACK_MAX_RETRY_WAIT,
+    enabled=SLACK_RATE_LIMITING
 )
 
-moderation_client = OpenAI(
-    base_url=MODERATION_URL,
-    api_key=MODERATION_KEY
+tool_engine = ToolEngine(max_workers=TOOL_WORKERS, long_tools=LONG_TOOLS, long_workers=LONG_TOOL_WORKERS)
+prompt_builder = PromptBuilder(SYSTEM_INSTRUCTIONS, tools, turn_context, summary=summary_context, recall=recall_context)
+router = ModelRouter(
+    fallbacks=MODEL_FALLBACKS,
+    hedge_after=HEDGE_AFTER,
+    slo_seconds=MODEL_SLO_SECONDS,
+    max_error_rate=MODEL_MAX_ERROR_RATE,
+    min_samples=MODEL_MIN_SAMPLES,
+    window=MODEL_STATS_WINDOW,
+    cooldown=MODEL_COOLDOWN
+)
+scheduler = Scheduler(
+    chat_slots=CHAT_SLOTS,
+    long_slots=LONG_SLOTS,
+    max_queue=TURN_QUEUE_MAX,
+    per_user=PER_USER_CONCURRENCY,
+    per_channel=PER_CHANNEL_CONCURRENCY
+)
+image_slots = threading.BoundedSemaphore(IMAGE_GEN_CONCURRENCY)
+prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="symphony-prefetch")
+
+http = HttpLayer(HTTP_ENDPOINTS, pool_size=TOOL_WORKERS * 2, breaker_threshold=BREAKER_THRESHOLD, breaker_reset=BREAKER_RESET)
+tool_cache = ToolResultCache(TOOL_CACHE_TTLS, path=TOOL_CACHE_PATH)
+reducer = ToolOutputReducer(TOOL_OUTPUT_BUDGETS, default_budget=0)
+# download_slack_img is defined further down, hence the lambda
+vision = VisionPipeline(
+    lambda url: download_slack_img(url),
+    max_dim=VISION_MAX_DIM,
+    max_bytes=VISION_MAX_BYTES,
+    quality=VISION_JPEG_QUALITY,
+    max_images=VISION_MAX_IMAGES
 )
 
-app=App(token=SLACK_BOT_TOKEN)
+profiler = Profiler(
+    PROFILE_DIR,
+    mode=PROFILE_MODE,
+    memory=PROFILE_MEMORY,
+    interval=PROFILE_INTERVAL_MS / 1000,
+    stack_after=PROFILE_STACK_AFTER
+)
+profiler.arm(PROFILE_NEXT)
 
+user_name_cache = TTLCache("user_names", maxsize=5000, ttl=USER_CACHE_TTL)
+channel_model_cache = TTLCache("channel_models", maxsize=1000, ttl=MODEL_CACHE_TTL)
 
 
-tools = [
-    {
-        "type": "function",
-        "function" : {
-            "name": "web_search",
-            "description": "Search the world wide web for information.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                            "description": "The search query.",
-                },
-            },
-            "required": ["query"],
-           }
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "image_generate",
-            "description": "Generates an image with Nano Banana based on a detailed text description.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "prompt": {
-                        "type": "string",
-                        "description": "A prompt for the image.",
-                    },
-                },
-                "required": ["prompt"],
-            }
-            
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "deep_research",
-            "description": "Perform a deep, comprehensive research on a topic. Use this for complex queries, report generation, or when a simple web search is insufficient.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "prompt": {
-                        "type": "string",
-                        "description": "A query to search deeply.",
-                    },
-                },
-                "required": ["prompt"],
-            }
-            
-        },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "url_scrape",
-            "description": "Scrape content from a specific URL using Linkup. Use this when a user provides a specific link they want you to read.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "url": {
-                        "type": "string",
-                        "description": "The URL to scrape.",
-                    }
-                },
-                "required": ["url"],
-            }
-        },
-    }
-]
 
-def search_the_web(query):
+def search_the_web(query, fresh=False):
     print(f"currently searching for {query} :3")
-    try: 
-        response = requests.get(
-         f"{SEARCH_API_URL}?q={query}",
+
+    def fetch():
+        response = http.get(
+         "search",
+         SEARCH_API_URL,
+         params={"q": query},
          headers={'Authorization': f'Bearer {SEARCH_API_KEY}'}
         )
 
         response.raise_for_status()
         
         return response.text
+
+    try: 
+        return tool_cache.get_or_compute("web_search", {"query": query}, fetch, fresh=fresh)
+    except CircuitOpenError as e:
+        return unavailable_message("web_search", e)
     except Exception as e:
         print(f"*cries* unable to search for {query}. {e}")
         return f"Unable to search."
@@ -144,61 +149,44 @@ def search_the_web(query):
 def generate_img(prompt):
     print(f"calling nano banana to generate {prompt} :3")
     try:
-        image_response = default_client.chat.completions.create(
-            model=IMGGEN_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            extra_body={
-                "modalities": ["image"],
-                "response_format": "b64_json" 
-            },
-            timeout=60
-        )
-
-        msg_obj = image_response.choices[0].message
-        content_text = ""
-        
-        if msg_obj.content:
-            content_text = str(msg_obj.content)
-
-        if len(content_text) < 10: 
-            try:
-                content_text = str(msg_obj.model_dump())
-            except:
-                content_text = str(msg_obj)
+        with span("llm", model=IMGGEN_MODEL, round="image"):
+            image_response = default_client.chat.completions.create(
+                model=IMGGEN_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                extra_body={
+                    "modalities": ["image"],
+                    "response_format": "b64_json" 
+                },
+                timeout=60
+            )
+        record_usage(IMGGEN_MODEL, getattr(image_response, "usage", None))
 
-        b64_pattern = r'(data:image\/[^;]+;base64,[a-zA-Z0-9+/=]+)'
-        b64_match = re.search(b64_pattern, content_text)
-
-        if b64_match:
-            print("Found Base64 string via Regex!")
-            full_b64_url = b64_match.group(1)
-            b64_string = full_b64_url.split('base64,')[1]
-            try:
-                return base64.b64decode(b64_string)
-            except Exception as e:
-                print(f"Regex found base64 but failed to decode: {e}")
-                return None
+        images = extract_images(image_response.choices[0].message)
+        # drop the response (and its base64 text) before the decoded bytes get uploaded
+        del image_response
+        return images
 
     except Exception as e:
         print(f"waahhh! cannot generate image! {e}")
         traceback.print_exc()
-        return None
+        return []
 
-def download_slack_img(file_url, token):
+def download_slack_img(file_url, token=SLACK_BOT_TOKEN):
     try: 
-        res = requests.get(file_url, headers={"Authorization": f"Bearer {token}"})
+        res = http.get("slack_files", file_url, headers={"Authorization": f"Bearer {token}"})
         if res.status_code == 200:
-            return base64.b64encode(res.content).decode('utf-8')
+            return res.content
         return None
     except Exception as e:
         print("Failed to download IMG")
         return None
 
-def do_deep_research(query):
-    print (f"deeply researching {query} via linkup :3")
-    try:
-        response = requests.post(
-            f"https://api.linkup.so/v1/fetch",
+def deep_research(query, fresh=False):
+    # raises when it fails; background jobs retry instead of answering with the error
+    def fetch():
+        response = http.post(
+            "linkup_research",
+            LINKUP_API_URL,
             headers={
                 'Authorization': f'Bearer {LINKUP_API_KEY}',
                 'Content-Type': 'application/json',
@@ -215,15 +203,26 @@ def do_deep_research(query):
         data = response.json()
 
         return data.get("markdown", "No content")
+
+    return tool_cache.get_or_compute("deep_research", {"prompt": query}, fetch, fresh=fresh)
+
+def do_deep_research(query, fresh=False):
+    print (f"deeply researching {query} via linkup :3")
+    try:
+        return deep_research(query, fresh=fresh)
+    except CircuitOpenError as e:
+        return unavailable_message("deep_research", e)
     except Exception as e:
         print(f"*waah* unable to deep search. {e}")
         return(f"Unable to deep research {query}")
 
-def scrape_url_with_linkup(url):
+def scrape_url_with_linkup(url, fresh=False):
     print (f"scraping {url} via linkup :3")
-    try:
-        response = requests.post(
-            f"https://api.linkup.so/v1/fetch",
+
+    def fetch():
+        response = http.post(
+            "linkup_scrape",
+            LINKUP_API_URL,
             headers={
                 'Authorization': f'Bearer {LINKUP_API_KEY}',
                 'Content-Type': 'application/json',
@@ -238,13 +237,331 @@ def scrape_url_with_linkup(url):
         data = response.json()
 
         return data.get("markdown", "No content")
+
+    try:
+        return tool_cache.get_or_compute("url_scrape", {"url": url}, fetch, fresh=fresh)
+    except CircuitOpenError as e:
+        return unavailable_message("url_scrape", e)
     except Exception as e:
         print(f"*waah* unable scrape URL. {e}")
         return(f"Unable to scrape {url}")
 
 
+def call_tool(function_name, arguments, client, channel_id, thread_ts, cancel, user_name=None, model=None):
+    # runs on a tool engine worker, so several of these can be in flight for one reply.
+    # what's running shows in the reply message (see answer), tools don't post status of their own
+    if not tool_status_text(function_name):
+        return f"Unknown tool {function_name}."
 
+    if BACKGROUND_JOBS and function_name in LONG_TOOLS:
+        started = start_job(function_name, arguments, client, channel_id, thread_ts, user_name, model)
+        if started:
+            return started
 
+    if function_name == "web_search":
+        return search_the_web(arguments.get("query"), fresh=bool(arguments.get("fresh")))
+
+    elif function_name == "url_scrape":
+        return scrape_url_with_linkup(arguments.get("url"), fresh=bool(arguments.get("fresh")))
+
+    elif function_name == "deep_research":
+        return do_deep_research(arguments.get("prompt"), fresh=bool(arguments.get("fresh")))
+
+    elif function_name == "image_generate":
+        prompt = arguments.get("prompt")
+        # only a few generations at once; each one holds whole images in memory until uploaded
+        with image_slots:
+            images = generate_img(prompt)
+
+            if cancel.is_set():
+                return "Image generation timed out."
+            if not images:
+                return "Failed to generate image!"
+            try:
+                client.files_upload_v2(
+                    channel=channel_id,
+                    thread_ts=thread_ts,
+                    file_uploads=image_uploads(images, prompt)
+                )
+                return images_uploaded_text(images)
+            except Exception as e:
+                print(f"Failed to upload image. {e}")
+                return f"Image genereated but failed to upload to Slack. {e}"
+
+
+# --------- BACKGROUND JOBS ---------
+# slow tools run through job_runner (see jobs.py); these post their results back by themselves.
+# each job gets one status message, updated with its progress and finally edited into its result,
+# and its slow part takes a long lane slot like a turn running the tool inline would
+job_slack = RateLimitedWebClient(TracedWebClient(app.client), slack_limiter)
+
+def start_job(kind, arguments, client, channel_id, thread_ts, user_name, model):
+    # returns the tool result for the model, or None to run the tool inline after all
+    status_ts = None
+    try:
+        status_ts = client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, text=tool_status_text(kind))["ts"]
+    except Exception as e:
+        print(f"Unable to post tool status. {e}")
+    try:
+        job = job_runner.submit(kind, arguments, channel_id, thread_ts, user_name=user_name, model=model, status_ts=status_ts)
+    except Exception as e:
+        print(f"unable to queue {kind} job, running it right away instead. {e}")
+        clear_job_status({"channel_id": channel_id, "status_ts": status_ts})
+        return None
+    print(f"queued {kind} job {job['id']} :3")
+    return job_started_text(kind, job["id"])
+
+def clear_job_status(job):
+    if not job.get("status_ts"):
+        return
+    try:
+        job_slack.chat_delete(channel=job["channel_id"], ts=job["status_ts"])
+    except Exception as e:
+        print(f"Unable to delete job status. {e}")
+
+def show_job_progress(job, text):
+    if not job.get("status_ts"):
+        return
+    try:
+        job_slack.chat_update(channel=job["channel_id"], ts=job["status_ts"], text=text)
+    except Exception as e:
+        print(f"Unable to update job status. {e}")
+
+def replace_job_status(job, text, blocks=None):
+    # the job's status message becomes its result; a new message only when there's no status to edit
+    if job.get("status_ts"):
+        try:
+            job_slack.chat_update(channel=job["channel_id"], ts=job["status_ts"], text=text, blocks=blocks)
+            return
+        except Exception as e:
+            print(f"Unable to update job status, posting instead. {e}")
+            clear_job_status(job)
+    job_slack.chat_postMessage(channel=job["channel_id"], thread_ts=job["thread_ts"], text=text, blocks=blocks)
+
+def report_job_failure(job, error):
+    try:
+        replace_job_status(job, job_failure_text(job, error))
+    except Exception as e:
+        print(f"Unable to report failed job. {e}")
+
+def finish_job(job, text, footer=None, shown=None):
+    # posts the job's result into its thread and remembers it, one turn at a time like replies;
+    # shown is what the status message says instead of text (which is what goes into history)
+    thread_ts = job["thread_ts"]
+    with coordinator.thread_lock(thread_ts):
+        replace_job_status(job, shown or text, blocks=reply_blocks(text, footer) if footer else None)
+        chat_memory.append(memory_row(job["channel_id"], thread_ts, "assistant", text))
+        if coordinator.shared:
+            chat_memory.writer.flush()
+
+def research_job(job, progress):
+    query = job["args"].get("prompt")
+    print(f"deeply researching {query} via linkup in job {job['id']} :3")
+    with scheduler.background_lane():
+        findings = deep_research(query, fresh=bool(job["args"].get("fresh")))
+    progress("Done researching, writing up what I found...")
+
+    model = job["model"] or DEFAULT_MODEL
+    thread_ts = job["thread_ts"]
+    if coordinator.shared:
+        chat_memory.invalidate(thread_ts)
+        summaries.cache.invalidate(thread_ts)
+    summary, history = summaries.prepare(thread_ts, chat_memory.recent(thread_ts), model)
+    prompt = build_prompt(
+        prompt_builder,
+        model,
+        history,
+        job["user_name"] or "User",
+        summary=summary,
+        result=job_result_context(job["kind"], job["args"], reducer.reduce(job["kind"], findings, query))
+    )
+    response, model = router.call(
+        model,
+        completion(default_client.chat.completions.create, prompt.messages, prompt.tools, "none"),
+        round="job"
+    )
+    text, _ = read_response(model, response)
+    finish_job(job, text or "", footer=research_footer(model, job))
+    prefetch_pool.submit(summaries.fold, thread_ts, chat_memory.recent(thread_ts), model)
+
+def image_job(job, progress):
+    prompt = job["args"].get("prompt")
+    if not job["args"].get("uploaded"):
+        with scheduler.background_lane(), image_slots:
+            images = generate_img(prompt)
+            if not images:
+                raise RuntimeError("the image model didn't return an image")
+            progress("Uploading your image...")
+            job_slack.files_upload_v2(
+                channel=job["channel_id"],
+                thread_ts=job["thread_ts"],
+                file_uploads=image_uploads(images, prompt)
+            )
+        # the image is in the thread now: a retry (say finish_job failed) only finishes up
+        job_runner.checkpoint(job, uploaded=len(images))
+    count = job["args"]["uploaded"]
+    finish_job(job, f"(generated and uploaded {count} image(s) for: {prompt})", shown=image_ready_text(count, prompt))
+
+
+def get_user_name(client, user_id):
+    user_name = user_name_cache.get(user_id)
+    if user_name:
+        return user_name
+    try:
+        user_info = client.users_info(user=user_id)
+        profile = user_info['user']['profile']
+        user_name = profile.get('display_name') or profile.get('real_name') or "User"
+        user_name_cache.set(user_id, user_name)
+        return user_name
+    except Exception as e:
+        print(f"Cannot fetch user info. {e}")
+        return "User"
+
+def get_channel_model(channel_id):
+    target_model = channel_model_cache.get(channel_id)
+    if target_model:
+        return target_model
+    try:
+        target_model = conversation_store.get_model(channel_id) or DEFAULT_MODEL
+        channel_model_cache.set(channel_id, target_model)
+        return target_model
+    except Exception as e:
+        print(f"Failed to fetch custom model, defaulting: {e}")
+        return DEFAULT_MODEL
+
+def check_moderation(user_message):
+    # returns the refusal text when the message is flagged; fails open like it always has
+    try:
+        with span("moderation"):
+            moderation = moderation_client.moderations.create(input=user_message)
+        return moderation_refusal(moderation.results[0])
+    except Exception as e:
+        print(f"unable to call moderation API. {e}")
+        return None
+
+def summarize_turns(previous, turns):
+    with span("llm", model=SUMMARY_MODEL, round="summary"):
+        response = default_client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=summary_request(previous, turns),
+        )
+    record_usage(SUMMARY_MODEL, response.usage)
+    return (response.choices[0].message.content or "").strip()
+
+summaries = ThreadSummaries(
+    conversation_store,
+    summarize_turns,
+    budget=HISTORY_TOKEN_BUDGET,
+    budgets=HISTORY_TOKEN_BUDGETS,
+    keep_recent=SUMMARY_KEEP_RECENT,
+    window=HISTORY_WINDOW
+)
+
+def embed_texts(texts):
+    extra = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+    response = embeddings_client.embeddings.create(model=EMBEDDING_MODEL, input=texts, **extra)
+    record_usage(EMBEDDING_MODEL, getattr(response, "usage", None))
+    return [item.embedding for item in response.data]
+
+recall = create_recall(
+    RECALL_ENABLED,
+    conversation_store,
+    embed_texts,
+    EMBEDDING_MODEL,
+    path=RECALL_PATH,
+    top_k=RECALL_TOP_K,
+    min_score=RECALL_MIN_SCORE,
+    max_tokens=RECALL_MAX_TOKENS,
+    backfill=RECALL_BACKFILL,
+    max_rows=RECALL_MAX_ROWS
+)
+if recall:
+    chat_memory.on_append = recall.add
+
+def forget_expired(expired):
+    # retention deleted these threads; nothing else should remember them either
+    thread_ids = {thread_ts for _, thread_ts in expired}
+    for thread_ts in thread_ids:
+        chat_memory.invalidate(thread_ts)
+    summaries.forget(thread_ids)
+    if recall:
+        recall.forget(expired)
+
+retention = create_retention(
+    conversation_store,
+    archive_after_days=CHAT_ARCHIVE_AFTER_DAYS,
+    ttl_days=CHAT_MEM_TTL_DAYS,
+    ttls_days=CHAT_MEM_TTLS,
+    interval=RETENTION_INTERVAL,
+    batch=RETENTION_BATCH,
+    on_expired=forget_expired
+)
+coordinator = create_coordinator(
+    COORDINATION_STORE,
+    supabase,
+    event_ttl=EVENT_DEDUPE_TTL,
+    lease_ttl=THREAD_LEASE_TTL,
+    wait=THREAD_LOCK_WAIT
+)
+job_runner = JobRunner(
+    create_job_store(JOB_STORE, supabase, path=JOBS_PATH),
+    {"deep_research": research_job, "image_generate": image_job},
+    coordinator,
+    workers=JOB_WORKERS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_delay=JOB_RETRY_DELAY,
+    lease_ttl=JOB_LEASE_TTL,
+    rescan_interval=JOB_RESCAN_INTERVAL,
+    on_progress=show_job_progress,
+    on_failed=report_job_failure
+)
+
+def prepare_images(thread_ts, files):
+    with span("vision"):
+        return vision.prepare(thread_ts, files, False)
+
+def metrics_gauges():
+    return gauges([user_name_cache, channel_model_cache, tool_cache.memory], chat_memory, http)
+
+registry.add_collector(metrics_gauges)
+
+# --------- STARTUP ---------
+# each check opens (and keeps in its client's pool) a connection to that backend; see startup.py
+health = Health(timeout=HEALTH_CHECK_TIMEOUT, recheck=HEALTH_RECHECK)
+
+def probe_slack():
+    return f"signed in as {app.client.auth_test()['user']}"
+
+def probe_openai(client):
+    # no retries: a check that takes three attempts to answer is a failing check
+    return touch(lambda: client.with_options(max_retries=0, timeout=HEALTH_CHECK_TIMEOUT).models.list())
+
+def probe_supabase():
+    for table, column in SUPABASE_TABLES:
+        supabase.table(table).select(column).limit(1).execute()
+
+def probe_search():
+    return touch(lambda: http.session.head(SEARCH_API_URL, timeout=HEALTH_CHECK_TIMEOUT))
+
+health.add("slack", probe_slack)
+health.add("llm", lambda: probe_openai(default_client))
+if SUPABASE_TABLES:
+    health.add("supabase", probe_supabase)
+# the bot works without these, just worse (moderation fails open, tools say they're unavailable)
+if MODERATION_URL:
+    health.add("moderation", lambda: probe_openai(moderation_client), required=False)
+if RECALL_ENABLED:
+    health.add("embeddings", lambda: probe_openai(embeddings_client), required=False)
+if SEARCH_API_URL:
+    health.add("search", probe_search, required=False)
+
+
+# every Slack Web API call a listener makes shows up as a slack stage, per method,
+# and waits for its rate limit bucket instead of running into 429s
+@app.middleware
+def trace_slack_calls(context, next):
+    context["client"] = RateLimitedWebClient(TracedWebClient(context.client), slack_limiter)
+    next()
 
 
 @app.event("member_joined_channel")
@@ -264,7 +581,8 @@ def channel_join_handler(event, say, logger, ack, context, client):
 
      
 
-@app.event("message")
+# bolt only runs the first listener that matches, so DMs have to fall through to ai_msg
+@app.event("message", matchers=[lambda event: event.get("channel_type") != "im"])
 def handle_msg_event(body, logger):
     logger.info(body)
 
@@ -284,10 +602,8 @@ def switch_model(ack, body, respond, logger, command):
         return
 
     try:
-        supabase.table("bot_settings").upsert({
-            "channel_id": channel_id,
-            "selected_model": requested_model
-        }).execute()
+        conversation_store.set_model(channel_id, requested_model)
+        channel_model_cache.invalidate(channel_id)
         respond(f"Success! I have switched the model to {requested_model} for this channel.")
     except Exception as e:
         print(f"Unable to switch model! {e}")
@@ -299,57 +615,39 @@ def help_msg(ack, respond, logger, body):
     ack()
     logger.info(body)
 
-    blocks = [
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "Hi! My name is Symphony! Here is some things I can assist you with! :agahi:",
-				"emoji": True
-			}
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "1. Chat: Just mention me to talk.",
-				"emoji": True
-			}
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "2. Search and Deep Research: I can search the web and do deep research for more information",
-				"emoji": True
-			}
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "3. Generate Images: I can generate images you request with ",
-				"emoji": True
-			}
-		},
-        {
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "4. URL Scraping: I can search specific URLs for more information. ",
-				"emoji": True
-			}
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": "5. Vision: I can see images. Upload an image and ask me about it.",
-				"emoji": True
-			}
-		}
-	]
-    respond(blocks=blocks)
+    respond(blocks=HELP_BLOCKS)
+
+
+@app.command("/symphony-profile")
+def profile_replies(ack, respond, logger, body, command):
+    ack()
+    logger.info(body)
+    if command["user_id"] not in ADMIN_USER_IDS:
+        respond("Sorry, only admins can profile replies.")
+        return
+
+    args = command["text"].split()
+    if not args:
+        status = profiler.status()
+        if status["remaining"]:
+            respond(f"Profiling the next {status['remaining']} replies ({status['mode']}).")
+        else:
+            respond(f"Not profiling anything right now. {PROFILE_USAGE}")
+        return
+    if args[0].lower() == "off":
+        profiler.arm(0)
+        respond("Profiling is off.")
+        return
+
+    count = int(args[0]) if args[0].isdigit() else 0
+    options = {arg.lower() for arg in args[1:]}
+    modes = options & set(MODES)
+    if not 1 <= count <= 20 or len(modes) > 1 or options - modes - {"memory", "nomemory"}:
+        respond(PROFILE_USAGE)
+        return
+    memory = True if "memory" in options else False if "nomemory" in options else None
+    profiler.arm(count, modes.pop() if modes else None, memory, channel_id=command["channel_id"])
+    respond(f"Profiling the next {count} replies in this channel ({profiler.describe()}). Each reply gets its hotspots in the thread, the full report goes to `{PROFILE_DIR}`.")
 
 @app.message("Ping")
 def hello_back(ack, say, client, body, event):
@@ -370,276 +668,171 @@ def ai_msg(event, say, body, client, ack, respond):
 
     if event.get("type") == "message" and event.get("channel_type") != "im":
         return
-    
+    ack()
 
-    user_id = event['user']
+    # redeliveries and the same message seen by another replica stop here, before any real work
+    if not coordinator.first_delivery(event):
+        print(f"already got message {event['ts']}, skipping it")
+        return
 
+    # the reply itself runs once the scheduler admits it; this listener thread is done right away
+    trace = start_trace()
+    thread_ts = event.get("thread_ts", event["ts"])
+    ticket = scheduler.submit(event["user"], event["channel"], lambda ticket: answer_in_order(ticket, event, say, client), key=thread_ts)
+    if ticket is None:
+        print(f"turn queue is full, shedding message from {event['user']}")
+        try:
+            say(text=BUSY_TEXT, thread_ts=event.get("thread_ts", event["ts"]))
+        except Exception as e:
+            print(f"Unable to send busy reply. {e}")
+        registry.observe("symphony_request_seconds", time.monotonic() - trace.started, outcome="shed")
+
+
+def answer_in_order(ticket, event, say, client):
+    thread_ts = event.get("thread_ts", event["ts"])
+    # /symphony-profile: None unless this turn is one of the ones to profile
+    profile = profiler.begin(thread_ts, event["channel"])
     try:
-        user_info = client.users_info(user=user_id)
-        profile = user_info['user']['profile']
-        user_name = profile.get('display_name') or profile.get('real_name')
+        # the scheduler already keeps this process to one turn per thread; the lease does the same across replicas
+        with coordinator.thread_lock(thread_ts):
+            if coordinator.shared:
+                # another replica may have answered in this thread since we cached it
+                chat_memory.invalidate(thread_ts)
+                summaries.cache.invalidate(thread_ts)
+            answer(ticket, event, say, client)
+            if coordinator.shared:
+                # the next replica to take this thread reads history from the store, so it has to be there first
+                chat_memory.writer.flush()
+    finally:
+        if profile:
+            profiler.end(profile)
+    if profile:
+        post_profile(client, event["channel"], thread_ts, profile)
+
+
+def post_profile(client, channel_id, thread_ts, profile):
+    try:
+        client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, text=profiler.report(profile))
     except Exception as e:
-        print(f"Cannot fetch user info. {e}")
-        user_name = "User"
+        print(f"Unable to post profile summary. {e}")
+
 
+def answer(ticket, event, say, client):
+    user_id = event['user']
     user_message=event['text']
     thread_ts=event.get("thread_ts", event["ts"])
     channel_id=event["channel"]
-    msg_ts=event["ts"]
     files = event.get("files", [])
-    ack()
+    trace = ticket.trace
+
+    # everything the reply needs is fetched at once; nothing visible or persisted
+    # happens until moderation has said yes
+    user_name_f = prefetch_pool.submit(bind(get_user_name), client, user_id)
+    moderation_f = prefetch_pool.submit(bind(check_moderation), user_message)
+    # (with several replicas the cached window was just dropped; appending below then writes
+    # the turn and reads the fresh window in one round trip instead)
+    history_f = prefetch_pool.submit(bind(chat_memory.recent), thread_ts) if not coordinator.shared else None
+    summary_f = prefetch_pool.submit(bind(summaries.get), thread_ts)
+    model_f = prefetch_pool.submit(bind(get_channel_model), channel_id)
+    images_f = prefetch_pool.submit(bind(prepare_images), thread_ts, files)
+    recall_f = prefetch_pool.submit(bind(recall.query), channel_id, user_message) if recall else None
+
+    refusal = moderation_f.result()
+    if refusal:
+        say(text=refusal, thread_ts=thread_ts)
+        registry.observe("symphony_request_seconds", time.monotonic() - trace.started, outcome="refused")
+        return
 
+    user_name = user_name_f.result()
+    # the turn's one message: what the tools are doing, then the answer. when streaming it
+    # starts out as "Thinking...", posted while the prompt is put together
+    reply = SlackStreamer(client, channel_id, thread_ts, min_interval=STREAM_UPDATE_INTERVAL)
+    reply_f = None
     try:
-        moderation = moderation_client.moderations.create(input=user_message)
-        result = moderation.results[0]
-
-        if result.flagged:
-             categories = result.categories
-
-             if categories.self_harm or categories.self_harm_instructions or categories.self_harm_intent:
-              say(
-                  text=f"I am unable to fufill your request. It looks like you're going through a hard time. Please check out this resource. https://hackclub.enterprise.slack.com/docs/T0266FRGM/F08HU1DD1AP. Remember, you are not alone. :ohneheart:",
-                  thread_ts=thread_ts
-              )
-              return
-        if result.flagged:     
-            say(
-                text=f"I cannot fulfill this request because it violates my content moderation policies.",
-                thread_ts=thread_ts
+        reply_f = prefetch_pool.submit(bind(reply.start)) if STREAM_RESPONSES else None
+        vision.remember(thread_ts, files)
+
+        # the prefetched window doesn't have this message yet; appending updates the
+        # cached window in place, so this is a memory hit when the prefetch ran
+        if history_f:
+            history_f.result()
+        turns = chat_memory.append_recent(memory_row(channel_id, thread_ts, "user", user_message, user_name))
+        target_model = model_f.result()
+        summary_f.result()
+        summary, history = summaries.prepare(thread_ts, turns, target_model)
+        # snippets from other threads in this channel; whatever is already in the history is skipped
+        recalled = recall.search(channel_id, recall_f.result(), history, thread_ts) if recall_f else None
+
+        prompt = build_prompt(prompt_builder, target_model, history, user_name, summary=summary, images=images_f.result(), recalled=recalled)
+        msgs = prompt.messages
+
+        start_time = time.time()
+
+        if reply_f:
+            reply_f.result()
+        streamer = reply if STREAM_RESPONSES else None
+        # the router may answer with a fallback model; whichever answers keeps the rest of the turn
+        if streamer:
+            (content, tool_caller), target_model = router.call(
+                target_model,
+                completion(functools.partial(stream_completion, default_client, streamer), msgs, prompt.tools, "auto"),
+                hedge=False,
+                on_failover=lambda model: streamer.reset(streamer.placeholder)
             )
-            return
-    
-    except Exception as e:
-                    print(f"unable to call moderation API. {e}")
-
-    supabase.table("chat_mem").insert({
-        "channel_id": channel_id,
-        "thread_ts": thread_ts,
-        "user_name": user_name,
-        "role": "user",
-        "content": user_message
-    }).execute()
-
-
-    mem_get = supabase.table("chat_mem") \
-     .select("role, content") \
-     .eq("thread_ts", thread_ts) \
-     .order("created_at", desc=False) \
-     .limit(10) \
-     .execute()
-    
-
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    msgs = [{"role": "system", 
-    "content": f"""You are Symphony, a helpful and harmless AI assistant engaging with {user_name}.
-Current time: {current_time}
-
-You have access to: `web_search`, `deep_research`, `image_generate`, and `url_scrape`.
-
-### Tool Usage & Routing
-1. **web_search**: Use for current events, facts, or quick info.
-   - **Crucial:** If a query appears strange, vague, or ambiguous, you must NOT refuse or ask for clarification. Execute the search immediately using the user's input to find the most likely intent.
-2. **deep_research**: Use for complex topics, market analysis, or when the user explicitly asks for a "deep dive."
-3. **url_scrape**: Use ONLY when the user provides a specific URL to read or summarize.
-4. **image_generate**: Use when the user asks to create visual content.
-
-### Operational Constraints
-- **Deep Research Limit**: When using `deep_research`, your final output **MUST be under 3000 characters**. This is a strict Slack platform requirement. Prioritize concise, high-density information over length.
-- **Vague Inputs**: Never hallucinate an answer for a vague query; use `web_search` to ground your response in reality.
-
-### Image Generation Protocols
-When using `image_generate`, you must act as a prompt engineer. Never pass a short user prompt directly to the tool.
-- **Rewrite**: Expand vague requests (e.g., "a dog") into high-fidelity descriptions.
-- **Include**: Artistic medium (e.g., "oil painting," "Unreal Engine 5 render"), lighting (e.g., "cinematic," "golden hour"), composition, and mood.
-- **Example**: "draw a car" → "A sleek matte black sports car drifting on a neon-lit cyber city street, heavy rain reflections, 8k resolution, photorealistic, cinematic lighting."""
-}]
-    for row in mem_get.data:
-        msgs.append({"role": row["role"], "content": row ["content"]})
-
-        current_img_data = None
-        if files:
-            for file in files:
-                if file.get("mimetype", "").startswith("image/"):
-                    print(f"Got img :3 {file.get('name')}")
-                    prv_url = file.get("url_private")
-                    if prv_url:
-                        b64_img = download_slack_img(prv_url, SLACK_BOT_TOKEN)
-                        if b64_img:
-                            current_img_data = b64_img
-                            break
-        if current_img_data:
-            last_msg = msgs[-1]
-            text_content = last_msg["content"]
-
-            vision_content = [
-                {"type": "text", "text": text_content},
-                {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{current_img_data}"
-                }
-            }
-            ]
-            msgs[-1]["content"] = vision_content
-        
-
-    try:
-        client.reactions_add(
-            name="typingresponse",
-            channel=channel_id,
-            timestamp=msg_ts
-        )
-    except Exception as e:
-        print(f"Unable to add reaction. {e}")
-
-    target_model = DEFAULT_MODEL
-    try:
-        settings_res = supabase.table("bot_settings") \
-            .select("selected_model") \
-            .eq("channel_id", channel_id) \
-            .execute()
-        if settings_res.data and len(settings_res.data) > 0:
-            target_model = settings_res.data[0]["selected_model"]
-    except Exception as e:
-        print(f"Failed to fetch custom model, defaulting: {e}")
-
-    start_time = time.time()
-    
-    try:
-        response=default_client.chat.completions.create(
-            model=target_model,
-            messages=msgs,
-            tools=tools,
-            tool_choice="auto"
-        )
-        ai_rspnd = response.choices[0].message
-        tool_caller = ai_rspnd.tool_calls
+        else:
+            response, target_model = router.call(
+                target_model,
+                completion(default_client.chat.completions.create, msgs, prompt.tools, "auto")
+            )
+            content, tool_caller = read_response(target_model, response)
 
         if tool_caller:
-            msgs.append(ai_rspnd)
-
-            for tool_call in tool_caller:
-                function_name = tool_call.function.name
-                arguments = json.loads(tool_call.function.arguments)
-                if function_name == "web_search":
-                    status_msg = client.chat_postMessage(
-                        channel=channel_id,
-                        thread_ts=thread_ts,
-                        text=f"I am currently searching the web for your query. Please wait!"
-                    )
-                    the_result = search_the_web(arguments.get("query"))
-
-                    client.chat_delete(channel=channel_id, ts=status_msg["ts"])
-                
-                elif function_name == "url_scrape":
-                 status_msg = client.chat_postMessage(
-                     channel=channel_id,
-                     thread_ts=thread_ts,
-                     text=f"I'm currently scraping and searching the URL."
-                 )
-                 url = arguments.get("url")
-                 the_result = scrape_url_with_linkup(url)
-                 client.chat_delete(channel=channel_id, ts=status_msg["ts"])
-
-                
-                elif function_name == "deep_research":
-                 status_msg = client.chat_postMessage(
-                     channel=channel_id,
-                     thread_ts=thread_ts,
-                     text=f"I'm currenly deep researching on the topic you requested. This might take a few minutes."
-                 )
-                 query = arguments.get("prompt")
-                 the_result = do_deep_research(query)
-                 client.chat_delete(channel=channel_id, ts=status_msg["ts"])
-
-                elif function_name == "image_generate":
-                    status_msg = client.chat_postMessage(
-                        channel=channel_id,
-                        thread_ts=thread_ts,
-                        text=f"I am currently using {IMGGEN_MODEL} to generate your image. Please wait!"
-                    )
-                    prompt = arguments.get("prompt")
-                    image_bytes = generate_img(prompt)
-
-                    client.chat_delete(channel=channel_id, ts=status_msg["ts"])
-
-                    if image_bytes:
-                        try:
-
-                            file_obj = BytesIO(image_bytes)
-
-                            client.files_upload_v2(
-                                channel=channel_id,
-                                thread_ts=thread_ts,
-                                title=prompt,
-                                file=file_obj,
-                                filename="GenAIGeneratedIMG.png"
-                            )
-                            the_result = "Image generated and uploaded to Slack."
-                        except Exception as e:
-                            print(f"Failed to upload image. {e}")
-                            the_result = f"Image genereated but failed to upload to Slack. {e}"
-                    else:
-                                the_result = "Failed to generate image!"
-
-                msgs.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": function_name,
-                    "content": the_result
-                })
-
-            final_ai_rspnd = default_client.chat.completions.create(
-                model=DEFAULT_MODEL,
-                messages=msgs,
+            msgs.append({"role": "assistant", "content": content, "tool_calls": tool_caller})
+            reply.show(tool_status(tool_caller))
+
+            jobs, queries = tool_jobs(
+                tool_caller,
+                user_message,
+                lambda name, args, model=target_model: bind(lambda cancel: call_tool(name, args, client, channel_id, thread_ts, cancel, user_name, model))
             )
-            ai_rspnd = final_ai_rspnd.choices[0].message.content
+            with ticket.long_lane() if needs_long_lane(jobs) else contextlib.nullcontext():
+                msgs.extend(tool_messages(tool_engine.run_all(jobs), queries, reducer))
+
+            if streamer:
+                (ai_rspnd, _), target_model = router.call(
+                    target_model,
+                    completion(functools.partial(stream_completion, default_client, streamer), msgs, prompt.tools, "none"),
+                    round="followup",
+                    hedge=False,
+                    on_failover=lambda model: streamer.reset(streamer.placeholder)
+                )
+            else:
+                response, target_model = router.call(
+                    target_model,
+                    completion(default_client.chat.completions.create, msgs, prompt.tools, "none"),
+                    round="followup"
+                )
+                ai_rspnd, _ = read_response(target_model, response)
         else:
-            ai_rspnd = ai_rspnd.content
-
-        supabase.table("chat_mem").insert({
-            "channel_id": channel_id,
-        "thread_ts": thread_ts,
-        "role": "assistant",
-        "content": ai_rspnd
-        }).execute()
-
-        end_time = time.time()
-        latency = round(end_time - start_time, 2)
-
-        blocks = [
-		{
-			"type": "section",
-			"text": {
-				"type": "mrkdwn",
-				"text": f"{ai_rspnd}"
-			}
-		},
-		{
-			"type": "divider"
-		},
-		{
-			"type": "section",
-			"text": {
-				"type": "plain_text",
-				"text": f"Model: {target_model} | Latency: {latency}",
-				"emoji": True
-			}
-		}
-	]
-
-
-        say(blocks=blocks, thread_ts=thread_ts)
-
-        client.reactions_remove(
-            name="typingresponse",
-            channel=channel_id,
-            timestamp=msg_ts
-        )
+            ai_rspnd = content
+        ai_rspnd = ai_rspnd or ""
+
+        chat_memory.append(memory_row(channel_id, thread_ts, "assistant", ai_rspnd))
+        # fold whatever no longer fits into the thread summary, off the reply path
+        prefetch_pool.submit(bind(summaries.fold), thread_ts, chat_memory.recent(thread_ts), target_model)
+
+        blocks = reply_blocks(ai_rspnd, reply_footer(target_model, start_time, streamer, trace))
+        if not reply.finish(text=ai_rspnd, blocks=blocks):
+            say(blocks=blocks, thread_ts=thread_ts)
+        registry.observe("symphony_request_seconds", time.monotonic() - trace.started, outcome="ok")
     except Exception as e:
+        registry.observe("symphony_request_seconds", time.monotonic() - trace.started, outcome="error")
         print(f"failed to get response {e}")
-        say(text=f"Unable to call AI service. : {e}", thread_ts=thread_ts)
+        # the placeholder may still be on its way; edit it rather than leave it behind
+        if reply_f:
+            reply_f.result()
+        if not reply.finish(text=error_text(e)):
+            say(text=error_text(e), thread_ts=thread_ts)
 
 
 
@@ -687,4 +880,20 @@ When using `image_generate`, you must act as a prompt engineer. Never pass a sho
 
 
 if __name__ == "__main__":
-    SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
\ No newline at end of file
+    # turn SIGTERM into a normal exit so the chat_mem writer gets to flush
+    # and stop reporting ready, so a rolling restart doesn't count on this replica any more
+    signal.signal(signal.SIGTERM, lambda signum, frame: (health.drain(), sys.exit(0)))
+    start_exporters(METRICS_PORT, METRICS_FILE, METRICS_FILE_INTERVAL)
+    health.expose()
+    if HEALTH_PORT and HEALTH_PORT != METRICS_PORT:
+        serve(HEALTH_PORT, path="/readyz")
+    if WARM_UP:
+        health.warm_up()
+    if BACKGROUND_JOBS:
+        job_runner.start()
+    retention.start()
+    handler = SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
+    handler.connect()
+    health.serving = True
+    print("connected to Slack, ready :3")
+    threading.Event().wait()
\ No newline at end of file
@@ -0,0 +1,876 @@
+import sys
+import time
+import signal
+import asyncio
+import traceback
+import contextlib
+import functools
+import httpx
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_sdk.web.async_client import AsyncWebClient
+from tool_engine import AsyncToolEngine
+from scheduler import AsyncScheduler
+from router import AsyncModelRouter
+from http_client import AsyncHttpLayer, CircuitOpenError, unavailable_message
+from tool_cache import ToolResultCache
+from vision import VisionPipeline
+from prompt_builder import PromptBuilder
+from reducer import ToolOutputReducer
+from slack_stream import AsyncSlackStreamer, astream_completion
+from cache import TTLCache
+from history import create_async_memory
+from store import create_conversation_store, create_async_conversation_store
+from summaries import AsyncThreadSummaries
+from recall import create_async_recall
+from retention import create_retention, DAY
+from coordination import create_async_coordinator
+from jobs import AsyncJobRunner, create_job_store
+from metrics import registry, aspan, start_trace, record_usage, start_exporters, serve, AsyncTracedWebClient
+from slack_client import SlackRateLimiter, AsyncRateLimitedWebClient
+from profiler import Profiler, MODES
+from startup import Lazy, Health, atouch
+from media import extract_images
+from config import *
+from prompts import tools, SYSTEM_INSTRUCTIONS, turn_context, tool_status_text, moderation_refusal, reply_blocks, HELP_BLOCKS, BUSY_TEXT, summary_request, summary_context, recall_context, job_started_text, image_ready_text, job_result_context, PROFILE_USAGE
+from turn import memory_row, build_prompt, completion, read_response, tool_status, tool_jobs, needs_long_lane, tool_messages, reply_footer, error_text, image_uploads, images_uploaded_text, job_failure_text, research_footer, gauges, SUPABASE_TABLES
+
+# asyncio runtime: same bot as app.py, but every in-flight mention is a coroutine
+# instead of an OS thread, so slow LLM calls and deep research don't pin workers.
+# run with `python async_app.py`; `python app.py` is still the threaded runtime.
+
+# openai and supabase are imported when first used (or during warm-up), see startup.py
+def openai_client(base_url, api_key, sync=False):
+    from openai import OpenAI, AsyncOpenAI
+    return (OpenAI if sync else AsyncOpenAI)(base_url=base_url, api_key=api_key)
+
+default_client = Lazy("llm", lambda: openai_client(AI_BASE_URL, AI_KEY))
+moderation_client = Lazy("moderation", lambda: openai_client(MODERATION_URL, MODERATION_KEY))
+# the message is embedded on the loop; the recall indexer thread embeds stored turns with the sync client
+embeddings_client = Lazy("embeddings", lambda: openai_client(EMBEDDINGS_BASE_URL, EMBEDDINGS_KEY))
+indexer_embeddings_client = Lazy("indexer_embeddings", lambda: openai_client(EMBEDDINGS_BASE_URL, EMBEDDINGS_KEY, sync=True))
+
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+    follow_redirects=True
+)
+http = AsyncHttpLayer(http_client, HTTP_ENDPOINTS, breaker_threshold=BREAKER_THRESHOLD, breaker_reset=BREAKER_RESET)
+tool_cache = ToolResultCache(TOOL_CACHE_TTLS, path=TOOL_CACHE_PATH)
+reducer = ToolOutputReducer(TOOL_OUTPUT_BUDGETS, default_budget=0)
+vision = VisionPipeline(
+    None,
+    max_dim=VISION_MAX_DIM,
+    max_bytes=VISION_MAX_BYTES,
+    quality=VISION_JPEG_QUALITY,
+    max_images=VISION_MAX_IMAGES
+)
+
+if SLACK_API_URL:
+    app = AsyncApp(client=AsyncWebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL))
+else:
+    app = AsyncApp(token=SLACK_BOT_TOKEN)
+
+# one set of Slack rate limit buckets for every client in the process (see slack_client.py)
+slack_limiter = SlackRateLimiter(
+    SLACK_RATE_LIMITS,
+    burst_seconds=SLACK_RATE_BURST,
+    max_retries=SLACK_MAX_RETRIES,
+    max_retry_wait=SLACK_MAX_RETRY_WAIT,
+    enabled=SLACK_RATE_LIMITING
+)
+
+tool_engine = AsyncToolEngine(max_workers=TOOL_WORKERS, long_tools=LONG_TOOLS, long_workers=LONG_TOOL_WORKERS)
+prompt_builder = PromptBuilder(SYSTEM_INSTRUCTIONS, tools, turn_context, summary=summary_context, recall=recall_context)
+router = AsyncModelRouter(
+    fallbacks=MODEL_FALLBACKS,
+    hedge_after=HEDGE_AFTER,
+    slo_seconds=MODEL_SLO_SECONDS,
+    max_error_rate=MODEL_MAX_ERROR_RATE,
+    min_samples=MODEL_MIN_SAMPLES,
+    window=MODEL_STATS_WINDOW,
+    cooldown=MODEL_COOLDOWN
+)
+scheduler = AsyncScheduler(
+    chat_slots=CHAT_SLOTS,
+    long_slots=LONG_SLOTS,
+    max_queue=TURN_QUEUE_MAX,
+    per_user=PER_USER_CONCURRENCY,
+    per_channel=PER_CHANNEL_CONCURRENCY
+)
+image_slots = asyncio.Semaphore(IMAGE_GEN_CONCURRENCY)
+
+profiler = Profiler(
+    PROFILE_DIR,
+    mode=PROFILE_MODE,
+    memory=PROFILE_MEMORY,
+    interval=PROFILE_INTERVAL_MS / 1000,
+    stack_after=PROFILE_STACK_AFTER
+)
+profiler.arm(PROFILE_NEXT)
+
+user_name_cache = TTLCache("user_names", maxsize=5000, ttl=USER_CACHE_TTL)
+channel_model_cache = TTLCache("channel_models", maxsize=1000, ttl=MODEL_CACHE_TTL)
+
+# the async supabase client has to be created inside the running loop, see main()
+supabase = None
+conversation_store = None
+chat_memory = None
+summaries = None
+coordinator = None
+job_runner = None
+recall = None
+retention = None
+
+
+
+async def search_the_web(query, fresh=False):
+    print(f"currently searching for {query} :3")
+
+    async def fetch():
+        response = await http.get(
+            "search",
+            SEARCH_API_URL,
+            params={"q": query},
+            headers={'Authorization': f'Bearer {SEARCH_API_KEY}'}
+        )
+        response.raise_for_status()
+        return response.text
+
+    try:
+        return await tool_cache.aget_or_compute("web_search", {"query": query}, fetch, fresh=fresh)
+    except CircuitOpenError as e:
+        return unavailable_message("web_search", e)
+    except Exception as e:
+        print(f"*cries* unable to search for {query}. {e}")
+        return f"Unable to search."
+
+async def generate_img(prompt):
+    print(f"calling nano banana to generate {prompt} :3")
+    try:
+        async with aspan("llm", model=IMGGEN_MODEL, round="image"):
+            image_response = await default_client.chat.completions.create(
+                model=IMGGEN_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                extra_body={
+                    "modalities": ["image"],
+                    "response_format": "b64_json"
+                },
+                timeout=60
+            )
+        record_usage(IMGGEN_MODEL, getattr(image_response, "usage", None))
+        images = extract_images(image_response.choices[0].message)
+        del image_response
+        return images
+    except Exception as e:
+        print(f"waahhh! cannot generate image! {e}")
+        traceback.print_exc()
+        return []
+
+async def download_slack_img(file_url, token=SLACK_BOT_TOKEN):
+    try:
+        res = await http.get("slack_files", file_url, headers={"Authorization": f"Bearer {token}"})
+        if res.status_code == 200:
+            return res.content
+        return None
+    except Exception as e:
+        print("Failed to download IMG")
+        return None
+
+async def linkup_fetch(endpoint, payload):
+    response = await http.post(
+        endpoint,
+        LINKUP_API_URL,
+        headers={
+            'Authorization': f'Bearer {LINKUP_API_KEY}',
+            'Content-Type': 'application/json',
+        },
+        json=payload,
+    )
+    response.raise_for_status()
+    return response.json().get("markdown", "No content")
+
+async def deep_research(query, fresh=False):
+    # raises when it fails; background jobs retry instead of answering with the error
+    return await tool_cache.aget_or_compute("deep_research", {"prompt": query}, lambda: linkup_fetch("linkup_research", {
+        "q": query,
+        "depth": 'deep',
+        "includeInlineCitations": 'true',
+        "includeSources": 'true',
+    }), fresh=fresh)
+
+async def do_deep_research(query, fresh=False):
+    print (f"deeply researching {query} via linkup :3")
+    try:
+        return await deep_research(query, fresh=fresh)
+    except CircuitOpenError as e:
+        return unavailable_message("deep_research", e)
+    except Exception as e:
+        print(f"*waah* unable to deep search. {e}")
+        return(f"Unable to deep research {query}")
+
+async def scrape_url_with_linkup(url, fresh=False):
+    print (f"scraping {url} via linkup :3")
+    try:
+        return await tool_cache.aget_or_compute("url_scrape", {"url": url}, lambda: linkup_fetch("linkup_scrape", {"url": url, "renderJs": True}), fresh=fresh)
+    except CircuitOpenError as e:
+        return unavailable_message("url_scrape", e)
+    except Exception as e:
+        print(f"*waah* unable scrape URL. {e}")
+        return(f"Unable to scrape {url}")
+
+async def call_tool(function_name, arguments, client, channel_id, thread_ts, cancel, user_name=None, model=None):
+    # what's running shows in the reply message (see answer), tools don't post status of their own
+    if not tool_status_text(function_name):
+        return f"Unknown tool {function_name}."
+
+    if BACKGROUND_JOBS and function_name in LONG_TOOLS:
+        started = await start_job(function_name, arguments, client, channel_id, thread_ts, user_name, model)
+        if started:
+            return started
+
+    if function_name == "web_search":
+        return await search_the_web(arguments.get("query"), fresh=bool(arguments.get("fresh")))
+
+    elif function_name == "url_scrape":
+        return await scrape_url_with_linkup(arguments.get("url"), fresh=bool(arguments.get("fresh")))
+
+    elif function_name == "deep_research":
+        return await do_deep_research(arguments.get("prompt"), fresh=bool(arguments.get("fresh")))
+
+    elif function_name == "image_generate":
+        prompt = arguments.get("prompt")
+        async with image_slots:
+            images = await generate_img(prompt)
+
+            if cancel.is_set():
+                return "Image generation timed out."
+            if not images:
+                return "Failed to generate image!"
+            try:
+                await client.files_upload_v2(
+                    channel=channel_id,
+                    thread_ts=thread_ts,
+                    file_uploads=image_uploads(images, prompt)
+                )
+                return images_uploaded_text(images)
+            except Exception as e:
+                print(f"Failed to upload image. {e}")
+                return f"Image genereated but failed to upload to Slack. {e}"
+
+
+# --------- BACKGROUND JOBS ---------
+# slow tools run through job_runner (see jobs.py); these post their results back by themselves
+job_slack = AsyncRateLimitedWebClient(AsyncTracedWebClient(app.client), slack_limiter)
+
+async def start_job(kind, arguments, client, channel_id, thread_ts, user_name, model):
+    # returns the tool result for the model, or None to run the tool inline after all
+    status_ts = None
+    try:
+        status_ts = (await client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, text=tool_status_text(kind)))["ts"]
+    except Exception as e:
+        print(f"Unable to post tool status. {e}")
+    try:
+        job = await job_runner.submit(kind, arguments, channel_id, thread_ts, user_name=user_name, model=model, status_ts=status_ts)
+    except Exception as e:
+        print(f"unable to queue {kind} job, running it right away instead. {e}")
+        await clear_job_status({"channel_id": channel_id, "status_ts": status_ts})
+        return None
+    print(f"queued {kind} job {job['id']} :3")
+    return job_started_text(kind, job["id"])
+
+async def clear_job_status(job):
+    if not job.get("status_ts"):
+        return
+    try:
+        await job_slack.chat_delete(channel=job["channel_id"], ts=job["status_ts"])
+    except Exception as e:
+        print(f"Unable to delete job status. {e}")
+
+async def show_job_progress(job, text):
+    if not job.get("status_ts"):
+        return
+    try:
+        await job_slack.chat_update(channel=job["channel_id"], ts=job["status_ts"], text=text)
+    except Exception as e:
+        print(f"Unable to update job status. {e}")
+
+async def replace_job_status(job, text, blocks=None):
+    # the job's status message becomes its result; a new message only when there's no status to edit
+    if job.get("status_ts"):
+        try:
+            await job_slack.chat_update(channel=job["channel_id"], ts=job["status_ts"], text=text, blocks=blocks)
+            return
+        except Exception as e:
+            print(f"Unable to update job status, posting instead. {e}")
+            await clear_job_status(job)
+    await job_slack.chat_postMessage(channel=job["channel_id"], thread_ts=job["thread_ts"], text=text, blocks=blocks)
+
+async def report_job_failure(job, error):
+    try:
+        await replace_job_status(job, job_failure_text(job, error))
+    except Exception as e:
+        print(f"Unable to report failed job. {e}")
+
+async def finish_job(job, text, footer=None, shown=None):
+    # posts the job's result into its thread and remembers it, one turn at a time like replies
+    thread_ts = job["thread_ts"]
+    async with coordinator.thread_lock(thread_ts):
+        await replace_job_status(job, shown or text, blocks=reply_blocks(text, footer) if footer else None)
+        await chat_memory.append(memory_row(job["channel_id"], thread_ts, "assistant", text))
+        if coordinator.shared:
+            await asyncio.get_running_loop().run_in_executor(None, chat_memory.writer.flush)
+
+async def research_job(job, progress):
+    query = job["args"].get("prompt")
+    print(f"deeply researching {query} via linkup in job {job['id']} :3")
+    async with scheduler.background_lane():
+        findings = await deep_research(query, fresh=bool(job["args"].get("fresh")))
+    await progress("Done researching, writing up what I found...")
+
+    model = job["model"] or DEFAULT_MODEL
+    thread_ts = job["thread_ts"]
+    if coordinator.shared:
+        chat_memory.invalidate(thread_ts)
+        summaries.cache.invalidate(thread_ts)
+    summary, history = await summaries.prepare(thread_ts, await chat_memory.recent(thread_ts), model)
+    prompt = build_prompt(
+        prompt_builder,
+        model,
+        history,
+        job["user_name"] or "User",
+        summary=summary,
+        result=job_result_context(job["kind"], job["args"], reducer.reduce(job["kind"], findings, query))
+    )
+    response, model = await router.call(
+        model,
+        completion(default_client.chat.completions.create, prompt.messages, prompt.tools, "none"),
+        round="job"
+    )
+    text, _ = read_response(model, response)
+    await finish_job(job, text or "", footer=research_footer(model, job))
+    background(summaries.fold(thread_ts, await chat_memory.recent(thread_ts), model))
+
+async def image_job(job, progress):
+    prompt = job["args"].get("prompt")
+    if not job["args"].get("uploaded"):
+        async with scheduler.background_lane(), image_slots:
+            images = await generate_img(prompt)
+            if not images:
+                raise RuntimeError("the image model didn't return an image")
+            await progress("Uploading your image...")
+            await job_slack.files_upload_v2(
+                channel=job["channel_id"],
+                thread_ts=job["thread_ts"],
+                file_uploads=image_uploads(images, prompt)
+            )
+        await job_runner.checkpoint(job, uploaded=len(images))
+    count = job["args"]["uploaded"]
+    await finish_job(job, f"(generated and uploaded {count} image(s) for: {prompt})", shown=image_ready_text(count, prompt))
+
+
+async def get_user_name(client, user_id):
+    user_name = user_name_cache.get(user_id)
+    if user_name:
+        return user_name
+    try:
+        user_info = await client.users_info(user=user_id)
+        profile = user_info['user']['profile']
+        user_name = profile.get('display_name') or profile.get('real_name') or "User"
+        user_name_cache.set(user_id, user_name)
+        return user_name
+    except Exception as e:
+        print(f"Cannot fetch user info. {e}")
+        return "User"
+
+async def get_channel_model(channel_id):
+    target_model = channel_model_cache.get(channel_id)
+    if target_model:
+        return target_model
+    try:
+        target_model = await conversation_store.get_model(channel_id) or DEFAULT_MODEL
+        channel_model_cache.set(channel_id, target_model)
+        return target_model
+    except Exception as e:
+        print(f"Failed to fetch custom model, defaulting: {e}")
+        return DEFAULT_MODEL
+
+
+async def check_moderation(user_message):
+    try:
+        async with aspan("moderation"):
+            moderation = await moderation_client.moderations.create(input=user_message)
+        return moderation_refusal(moderation.results[0])
+    except Exception as e:
+        print(f"unable to call moderation API. {e}")
+        return None
+
+async def summarize_turns(previous, turns):
+    async with aspan("llm", model=SUMMARY_MODEL, round="summary"):
+        response = await default_client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=summary_request(previous, turns),
+        )
+    record_usage(SUMMARY_MODEL, response.usage)
+    return (response.choices[0].message.content or "").strip()
+
+def embed_texts(texts):
+    extra = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+    response = indexer_embeddings_client.embeddings.create(model=EMBEDDING_MODEL, input=texts, **extra)
+    record_usage(EMBEDDING_MODEL, getattr(response, "usage", None))
+    return [item.embedding for item in response.data]
+
+async def aembed_texts(texts):
+    extra = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+    response = await embeddings_client.embeddings.create(model=EMBEDDING_MODEL, input=texts, **extra)
+    record_usage(EMBEDDING_MODEL, getattr(response, "usage", None))
+    return [item.embedding for item in response.data]
+
+async def prepare_images(thread_ts, files):
+    async with aspan("vision"):
+        return await vision.aprepare(thread_ts, files, download_slack_img, remember=False)
+
+def metrics_gauges():
+    return gauges([user_name_cache, channel_model_cache, tool_cache.memory], chat_memory, http)
+
+registry.add_collector(metrics_gauges)
+
+# --------- STARTUP ---------
+# same checks as app.py, through the clients (and connection pools) the handlers use
+health = Health(timeout=HEALTH_CHECK_TIMEOUT, recheck=HEALTH_RECHECK)
+
+async def probe_slack():
+    return f"signed in as {(await app.client.auth_test())['user']}"
+
+async def probe_openai(client):
+    return await atouch(lambda: client.with_options(max_retries=0, timeout=HEALTH_CHECK_TIMEOUT).models.list())
+
+async def probe_llm():
+    return await probe_openai(default_client)
+
+async def probe_moderation():
+    return await probe_openai(moderation_client)
+
+async def probe_embeddings():
+    return await probe_openai(embeddings_client)
+
+async def probe_supabase():
+    for table, column in SUPABASE_TABLES:
+        await supabase.table(table).select(column).limit(1).execute()
+
+async def probe_search():
+    return await atouch(lambda: http_client.head(SEARCH_API_URL, timeout=HEALTH_CHECK_TIMEOUT))
+
+health.add("slack", probe_slack)
+health.add("llm", probe_llm, clients=(default_client,))
+if SUPABASE_TABLES:
+    health.add("supabase", probe_supabase)
+if MODERATION_URL:
+    health.add("moderation", probe_moderation, required=False, clients=(moderation_client,))
+if RECALL_ENABLED:
+    health.add("embeddings", probe_embeddings, required=False, clients=(embeddings_client, indexer_embeddings_client))
+if SEARCH_API_URL:
+    health.add("search", probe_search, required=False)
+
+
+# every Slack Web API call a listener makes shows up as a slack stage, per method,
+# and waits for its rate limit bucket instead of running into 429s
+@app.middleware
+async def trace_slack_calls(context, next):
+    context["client"] = AsyncRateLimitedWebClient(AsyncTracedWebClient(context.client), slack_limiter)
+    await next()
+
+# fire-and-forget tasks need a strong reference or the loop may drop them mid-flight
+background_tasks = set()
+
+def background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+@app.event("member_joined_channel")
+async def channel_join_handler(event, say, logger, ack, context, client):
+    user_id = event["user"]
+    channel_id = event["channel"]
+    bot_user_id = context.get("bot_user_id")
+
+    if user_id == bot_user_id and channel_id != ALLOWED_CHANNEL_ID:
+        try:
+            await say(f"Hi, it looks like you added me to a channel. I am only authorized to do tasks in <#{ALLOWED_CHANNEL_ID}. I will be leaving this channel now, goodbye!")
+            await client.conversations_leave(channel=channel_id)
+        except Exception as e:
+            print(f"Unable to leave channel {e}")
+
+async def not_a_dm(event):
+    return event.get("channel_type") != "im"
+
+# bolt only runs the first listener that matches, so DMs have to fall through to ai_msg
+@app.event("message", matchers=[not_a_dm])
+async def handle_msg_event(body, logger):
+    logger.info(body)
+
+@app.command("/model")
+async def switch_model(ack, body, respond, logger, command):
+    await ack()
+    logger.info(body)
+    requested_model = command["text"].strip()
+    channel_id = command["channel_id"]
+
+    if not requested_model:
+        await respond(f"Current available models: {', '.join(ALLOWED_MODELS)}\nUsage: `/model moonshotai/kimi-k2-0905`")
+        return
+
+    if requested_model not in ALLOWED_MODELS:
+        await respond(f"Invalid model {requested_model}. Please choose from: {', '.join(ALLOWED_MODELS)}")
+        return
+
+    try:
+        await conversation_store.set_model(channel_id, requested_model)
+        channel_model_cache.invalidate(channel_id)
+        await respond(f"Success! I have switched the model to {requested_model} for this channel.")
+    except Exception as e:
+        print(f"Unable to switch model! {e}")
+        await respond(f"Failed to switch to model. {e}")
+
+@app.command("/symphony-help")
+async def help_msg(ack, respond, logger, body):
+    await ack()
+    logger.info(body)
+    await respond(blocks=HELP_BLOCKS)
+
+
+@app.command("/symphony-profile")
+async def profile_replies(ack, respond, logger, body, command):
+    await ack()
+    logger.info(body)
+    if command["user_id"] not in ADMIN_USER_IDS:
+        await respond("Sorry, only admins can profile replies.")
+        return
+
+    args = command["text"].split()
+    if not args:
+        status = profiler.status()
+        if status["remaining"]:
+            await respond(f"Profiling the next {status['remaining']} replies ({status['mode']}).")
+        else:
+            await respond(f"Not profiling anything right now. {PROFILE_USAGE}")
+        return
+    if args[0].lower() == "off":
+        profiler.arm(0)
+        await respond("Profiling is off.")
+        return
+
+    count = int(args[0]) if args[0].isdigit() else 0
+    options = {arg.lower() for arg in args[1:]}
+    modes = options & set(MODES)
+    if not 1 <= count <= 20 or len(modes) > 1 or options - modes - {"memory", "nomemory"}:
+        await respond(PROFILE_USAGE)
+        return
+    memory = True if "memory" in options else False if "nomemory" in options else None
+    profiler.arm(count, modes.pop() if modes else None, memory, channel_id=command["channel_id"])
+    await respond(f"Profiling the next {count} replies in this channel ({profiler.describe()}). Each reply gets its hotspots in the thread, the full report goes to `{PROFILE_DIR}`.")
+
+@app.message("Ping")
+async def hello_back(ack, say, client, body, event):
+    await ack()
+    await say("Pong!")
+    await client.reactions_add(
+        name="agahi",
+        channel=event["channel"],
+        timestamp=event["ts"]
+    )
+
+
+@app.event("app_mention")
+@app.event("message")
+async def ai_msg(event, say, body, client, ack, respond):
+
+    if event.get("type") == "message" and event.get("channel_type") != "im":
+        return
+    await ack()
+
+    # redeliveries and the same message seen by another replica stop here, before any real work
+    if not await coordinator.first_delivery(event):
+        print(f"already got message {event['ts']}, skipping it")
+        return
+
+    trace = start_trace()
+    thread_ts = event.get("thread_ts", event["ts"])
+    ticket = scheduler.submit(event["user"], event["channel"], lambda ticket: answer_in_order(ticket, event, say, client), key=thread_ts)
+    if ticket is None:
+        print(f"turn queue is full, shedding message from {event['user']}")
+        try:
+            await say(text=BUSY_TEXT, thread_ts=event.get("thread_ts", event["ts"]))
+        except Exception as e:
+            print(f"Unable to send busy reply. {e}")
+        registry.observe("symphony_request_seconds", time.monotonic() - trace.started, outcome="shed")
+
+
+async def answer_in_order(ticket, event, say, client):
+    thread_ts = event.get("thread_ts", event["ts"])
+    # /symphony-profile: None unless this turn is one of the ones to profile. on the loop the
+    # profiler sees every coroutine that runs meanwhile, not just this turn's
+    profile = profiler.begin(thread_ts, event["channel"])
+    try:
+        # the scheduler already keeps this process to one turn per thread; the lease does the same across replicas
+        async with coordinator.thread_lock(thread_ts):
+            if coordinator.shared:
+                # another replica may have answered in this thread since we cached it
+                chat_memory.invalidate(thread_ts)
+                summaries.cache.invalidate(thread_ts)
+            await answer(ticket, event, say, client)
+            if coordinator.shared:
+                # the next replica to take this thread reads history from the store, so it has to be there first
+                await asyncio.get_running_loop().run_in_executor(None, chat_memory.writer.flush)
+    finally:
+        if profile:
+            profiler.end(profile)
+    if profile:
+        await post_profile(client, event["channel"], thread_ts, profile)
+
+
+async def post_profile(client, channel_id, thread_ts, profile):
+    try:
+        # writing the report (pstats, tracemalloc statistics) is too slow for the loop
+        summary = await asyncio.get_running_loop().run_in_executor(None, profiler.report, profile)
+        await client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, text=summary)
+    except Exception as e:
+        print(f"Unable to post profile summary. {e}")
+
+
+async def answer(ticket, event, say, client):
+    user_id = event['user']
+    user_message=event['text']
+    thread_ts=event.get("thread_ts", event["ts"])
+    channel_id=event["channel"]
+    files = event.get("files", [])
+    # tasks copy the context when they're created, so they all report into this trace
+    trace = ticket.trace
+
+    # everything the reply needs is fetched at once; nothing visible or persisted
+    # happens until moderation has said yes
+    user_name_t = asyncio.create_task(get_user_name(client, user_id))
+    moderation_t = asyncio.create_task(check_moderation(user_message))
+    # (with several replicas the cached window was just dropped; appending below then writes
+    # the turn and reads the fresh window in one round trip instead)
+    history_t = asyncio.create_task(chat_memory.recent(thread_ts)) if not coordinator.shared else None
+    summary_t = asyncio.create_task(summaries.get(thread_ts))
+    model_t = asyncio.create_task(get_channel_model(channel_id))
+    images_t = asyncio.create_task(prepare_images(thread_ts, files))
+    recall_t = asyncio.create_task(recall.query(channel_id, user_message)) if recall else None
+
+    refusal = await moderation_t
+    if refusal:
+        # the lookups are read-only, let them finish (and warm the caches) in the background
+        for task in filter(None, (user_name_t, history_t, summary_t, model_t, images_t, recall_t)):
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        await say(text=refusal, thread_ts=thread_ts)
+        registry.observe("symphony_request_seconds", time.monotonic() - trace.started, outcome="refused")
+        return
+
+    user_name = await user_name_t
+    # the turn's one message: what the tools are doing, then the answer. when streaming it
+    # starts out as "Thinking...", posted while the prompt is put together
+    reply = AsyncSlackStreamer(client, channel_id, thread_ts, min_interval=STREAM_UPDATE_INTERVAL)
+    reply_t = None
+    try:
+        reply_t = asyncio.create_task(reply.start()) if STREAM_RESPONSES else None
+        vision.remember(thread_ts, files)
+
+        if history_t:
+            await history_t
+        turns = await chat_memory.append_recent(memory_row(channel_id, thread_ts, "user", user_message, user_name))
+        target_model = await model_t
+        await summary_t
+        summary, history = await summaries.prepare(thread_ts, turns, target_model)
+        # snippets from other threads in this channel; whatever is already in the history is skipped
+        recalled = recall.search(channel_id, await recall_t, history, thread_ts) if recall_t else None
+
+        prompt = build_prompt(prompt_builder, target_model, history, user_name, summary=summary, images=await images_t, recalled=recalled)
+        msgs = prompt.messages
+
+        start_time = time.time()
+
+        if reply_t:
+            await reply_t
+        streamer = reply if STREAM_RESPONSES else None
+        # the router may answer with a fallback model; whichever answers keeps the rest of the turn
+        if streamer:
+            (content, tool_caller), target_model = await router.call(
+                target_model,
+                completion(functools.partial(astream_completion, default_client, streamer), msgs, prompt.tools, "auto"),
+                hedge=False,
+                on_failover=lambda model: streamer.reset(streamer.placeholder)
+            )
+        else:
+            response, target_model = await router.call(
+                target_model,
+                completion(default_client.chat.completions.create, msgs, prompt.tools, "auto")
+            )
+            content, tool_caller = read_response(target_model, response)
+
+        if tool_caller:
+            msgs.append({"role": "assistant", "content": content, "tool_calls": tool_caller})
+            await reply.show(tool_status(tool_caller))
+
+            jobs, queries = tool_jobs(
+                tool_caller,
+                user_message,
+                lambda name, args, model=target_model: lambda cancel: call_tool(name, args, client, channel_id, thread_ts, cancel, user_name, model)
+            )
+            async with ticket.long_lane() if needs_long_lane(jobs) else contextlib.nullcontext():
+                msgs.extend(tool_messages(await tool_engine.run_all(jobs), queries, reducer))
+
+            if streamer:
+                (ai_rspnd, _), target_model = await router.call(
+                    target_model,
+                    completion(functools.partial(astream_completion, default_client, streamer), msgs, prompt.tools, "none"),
+                    round="followup",
+                    hedge=False,
+                    on_failover=lambda model: streamer.reset(streamer.placeholder)
+                )
+            else:
+                response, target_model = await router.call(
+                    target_model,
+                    completion(default_client.chat.completions.create, msgs, prompt.tools, "none"),
+                    round="followup"
+                )
+                ai_rspnd, _ = read_response(target_model, response)
+        else:
+            ai_rspnd = content
+        ai_rspnd = ai_rspnd or ""
+
+        await chat_memory.append(memory_row(channel_id, thread_ts, "assistant", ai_rspnd))
+        # fold whatever no longer fits into the thread summary, off the reply path
+        background(summaries.fold(thread_ts, await chat_memory.recent(thread_ts), target_model))
+
+        blocks = reply_blocks(ai_rspnd, reply_footer(target_model, start_time, streamer, trace))
+        if not await reply.finish(text=ai_rspnd, blocks=blocks):
+            await say(blocks=blocks, thread_ts=thread_ts)
+        registry.observe("symphony_request_seconds", time.monotonic() - trace.started, outcome="ok")
+    except Exception as e:
+        registry.observe("symphony_request_seconds", time.monotonic() - trace.started, outcome="error")
+        print(f"failed to get response {e}")
+        # the placeholder may still be on its way; edit it rather than leave it behind
+        if reply_t:
+            await reply_t
+        if not await reply.finish(text=error_text(e)):
+            await say(text=error_text(e), thread_ts=thread_ts)
+
+
+async def setup():
+    # everything that needs the running loop; also used by bench/ to drive the handlers directly
+    global supabase, conversation_store, chat_memory, summaries, coordinator, job_runner, recall, retention
+    from supabase import acreate_client, create_client
+    # nothing configured on Supabase (all sqlite/memory) means no client at all
+    supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_TABLES else None
+    # blocking client for the writer thread and the job store (which runs on the executor)
+    sync_supabase = Lazy("supabase", lambda: create_client(SUPABASE_URL, SUPABASE_KEY))
+    archive_horizon = CHAT_ARCHIVE_AFTER_DAYS * DAY or None
+    conversation_store = create_async_conversation_store(
+        CONVERSATION_STORE, supabase, path=CONVERSATION_DB, archive_horizon=archive_horizon
+    )
+    # the chat_mem writer, the recall indexer and the retention job run on threads of their own
+    writer_store = create_conversation_store(
+        CONVERSATION_STORE, sync_supabase, path=CONVERSATION_DB, archive_horizon=archive_horizon, partitioned=CHAT_MEM_PARTITIONED
+    )
+    chat_memory = create_async_memory(
+        conversation_store,
+        writer_store,
+        window=HISTORY_WINDOW,
+        journal_path=CHAT_MEM_JOURNAL,
+        flush_interval=CHAT_MEM_FLUSH_INTERVAL
+    )
+    summaries = AsyncThreadSummaries(
+        conversation_store,
+        summarize_turns,
+        budget=HISTORY_TOKEN_BUDGET,
+        budgets=HISTORY_TOKEN_BUDGETS,
+        keep_recent=SUMMARY_KEEP_RECENT,
+        window=HISTORY_WINDOW
+    )
+    recall = create_async_recall(
+        RECALL_ENABLED,
+        writer_store,
+        embed_texts,
+        aembed_texts,
+        EMBEDDING_MODEL,
+        path=RECALL_PATH,
+        top_k=RECALL_TOP_K,
+        min_score=RECALL_MIN_SCORE,
+        max_tokens=RECALL_MAX_TOKENS,
+        backfill=RECALL_BACKFILL,
+        max_rows=RECALL_MAX_ROWS
+    )
+    if recall:
+        chat_memory.on_append = recall.add
+
+    def forget_expired(expired):
+        # retention deleted these threads; nothing else should remember them either
+        thread_ids = {thread_ts for _, thread_ts in expired}
+        for thread_ts in thread_ids:
+            chat_memory.invalidate(thread_ts)
+        summaries.forget(thread_ids, store=writer_store)
+        if recall:
+            recall.forget(expired)
+
+    retention = create_retention(
+        writer_store,
+        archive_after_days=CHAT_ARCHIVE_AFTER_DAYS,
+        ttl_days=CHAT_MEM_TTL_DAYS,
+        ttls_days=CHAT_MEM_TTLS,
+        interval=RETENTION_INTERVAL,
+        batch=RETENTION_BATCH,
+        on_expired=forget_expired
+    )
+    coordinator = create_async_coordinator(
+        COORDINATION_STORE,
+        supabase,
+        event_ttl=EVENT_DEDUPE_TTL,
+        lease_ttl=THREAD_LEASE_TTL,
+        wait=THREAD_LOCK_WAIT
+    )
+    job_runner = AsyncJobRunner(
+        create_job_store(JOB_STORE, sync_supabase, path=JOBS_PATH),
+        {"deep_research": research_job, "image_generate": image_job},
+        coordinator,
+        workers=JOB_WORKERS,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        retry_delay=JOB_RETRY_DELAY,
+        lease_ttl=JOB_LEASE_TTL,
+        rescan_interval=JOB_RESCAN_INTERVAL,
+        on_progress=show_job_progress,
+        on_failed=report_job_failure
+    )
+
+
+async def main():
+    await setup()
+    start_exporters(METRICS_PORT, METRICS_FILE, METRICS_FILE_INTERVAL)
+    # checks are coroutines; /readyz refreshes them from the metrics server's thread
+    health.loop = asyncio.get_running_loop()
+    health.expose()
+    if HEALTH_PORT and HEALTH_PORT != METRICS_PORT:
+        serve(HEALTH_PORT, path="/readyz")
+    if WARM_UP:
+        await health.awarm_up()
+    if BACKGROUND_JOBS:
+        await job_runner.start()
+    retention.start()
+    handler = AsyncSocketModeHandler(app, SLACK_APP_TOKEN)
+    try:
+        await handler.connect_async()
+        health.serving = True
+        print("connected to Slack, ready :3")
+        await asyncio.sleep(float("inf"))
+    finally:
+        await http_client.aclose()
+
+
+if __name__ == "__main__":
+    # turn SIGTERM into a normal exit so the chat_mem writer gets to flush
+    # and stop reporting ready, so a rolling restart doesn't count on this replica any more
+    signal.signal(signal.SIGTERM, lambda signum, frame: (health.drain(), sys.exit(0)))
+    asyncio.run(main())
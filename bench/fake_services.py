@@ -0,0 +1,525 @@
+import json
+import time
+import zlib
+import email.parser
+import random
+import base64
+import threading
+import itertools
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# one local HTTP server standing in for every service the bot talks to:
+#   /api/<method>        Slack Web API (the handful of methods the bot calls) + file uploads
+#   /files/<name>        Slack url_private image downloads
+#   /v1/...              OpenAI-compatible chat completions (streamed or not), moderations, embeddings, image model
+#   /rest/v1/<table>     Supabase PostgREST (chat_mem, bot_settings, ...) backed by plain lists
+#   /rest/v1/rpc/claim_lease  the lease function the multi-replica coordination uses
+#   /rest/v1/rpc/append_chat_turn  insert a turn + read its thread's window in one call
+#   /rest/v1/rpc/restore_chat_thread  move an archived thread (tables["chat_archive"]) back into chat_mem
+#   /search              search API
+#   /linkup/v1/fetch     LinkUp scrape / deep research
+# each service gets its own latency, jitter and error rate so the bench can inject trouble.
+
+# 1x1 png, enough for the vision pipeline and the image upload path
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+SERVICES = ("slack", "slack_files", "llm", "moderation", "embeddings", "supabase", "search", "linkup")
+
+
+class Faults:
+    def __init__(self, latency=None, jitter=0.2, error_rate=None, token_interval=0.02, seed=None):
+        # latency: {service: seconds}, error_rate: {service: 0..1}
+        self.latency = {s: 0.0 for s in SERVICES}
+        self.latency.update(latency or {})
+        self.error_rate = {s: 0.0 for s in SERVICES}
+        self.error_rate.update(error_rate or {})
+        self.jitter = jitter
+        self.token_interval = token_interval
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self, service):
+        base = self.latency.get(service, 0.0)
+        if base <= 0:
+            return
+        with self.lock:
+            spread = self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, base * (1 + spread)))
+
+    def fails(self, service):
+        rate = self.error_rate.get(service, 0.0)
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+
+class FakeState:
+    def __init__(self, faults):
+        self.faults = faults
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.tables = {"chat_mem": [], "bot_settings": []}
+        self.calls = {}
+        self.finished = {}
+        self.threads = {}
+        self.on_finish = None
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def finish(self, msg_ts):
+        # a reply is done when the answer (the only message with footer blocks) lands in its thread;
+        # bench events all start their own thread, so the thread ts is the event's ts
+        with self.lock:
+            if msg_ts is None or msg_ts in self.finished:
+                return
+            self.finished[msg_ts] = time.monotonic()
+        if self.on_finish:
+            self.on_finish(msg_ts)
+
+
+def _tool_for(text):
+    text = text or ""
+    if "[search]" in text:
+        return "web_search", {"query": text.replace("[search]", "").strip() or "symphony"}
+    if "[scrape]" in text:
+        return "url_scrape", {"url": "https://example.com/" + str(abs(hash(text)) % 1000)}
+    if "[research]" in text:
+        return "deep_research", {"prompt": text.replace("[research]", "").strip() or "symphony"}
+    if "[image]" in text:
+        return "image_generate", {"prompt": text.replace("[image]", "").strip() or "a cat"}
+    return None
+
+
+def _last_user_text(messages):
+    for msg in reversed(messages):
+        if msg.get("role") == "user":
+            content = msg.get("content")
+            if isinstance(content, list):
+                return " ".join(p.get("text", "") for p in content if p.get("type") == "text")
+            return content or ""
+    return ""
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---- plumbing ----
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return raw
+
+    def _send(self, status, payload, content_type="application/json", headers=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _service(self, path):
+        if path.startswith("/api/"):
+            return "slack"
+        if path.startswith("/files/") or path.startswith("/upload/"):
+            return "slack_files"
+        if path.startswith("/v1/moderations"):
+            return "moderation"
+        if path.startswith("/v1/embeddings"):
+            return "embeddings"
+        if path.startswith("/v1/"):
+            return "llm"
+        if path.startswith("/rest/v1/"):
+            return "supabase"
+        if path.startswith("/search"):
+            return "search"
+        if path.startswith("/linkup/"):
+            return "linkup"
+        return None
+
+    def _handle(self, method):
+        parts = urlsplit(self.path)
+        path = parts.path
+        service = self._service(path)
+        raw = self._body()
+        if service is None:
+            self._send(404, {"error": "not found"})
+            return
+
+        state = self.state
+        state.count(service)
+        if service != "llm":
+            state.faults.delay(service)
+        if state.faults.fails(service):
+            state.count(f"{service}_injected_error")
+            if service == "slack":
+                self._send(200, {"ok": False, "error": "fatal_error"})
+            else:
+                self._send(500, {"error": "injected failure"})
+            return
+
+        if service == "slack":
+            self._slack(path[len("/api/"):], parse_qs(parts.query), raw)
+        elif service == "slack_files":
+            if method == "GET":
+                self._send(200, PNG, content_type="image/png")
+            else:
+                self._send(200, b"OK", content_type="text/plain")
+        elif service == "moderation":
+            self._moderation(json.loads(raw or b"{}"))
+        elif service == "embeddings":
+            self._embeddings(json.loads(raw or b"{}"))
+        elif service == "llm":
+            self._llm(path, json.loads(raw or b"{}"))
+        elif service == "supabase":
+            self._postgrest(method, path[len("/rest/v1/"):], parse_qs(parts.query), raw)
+        elif service == "search":
+            q = parse_qs(parts.query).get("q", [""])[0]
+            self._send(200, f"results for {q}: symphony is a slack bot. https://example.com/{q}".encode(), content_type="text/plain")
+        elif service == "linkup":
+            payload = json.loads(raw or b"{}")
+            topic = payload.get("url") or payload.get("q")
+            self._send(200, {"markdown": f"# {topic}\n\nlorem ipsum " * 20})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    # ---- slack ----
+
+    def _slack(self, api_method, query, raw):
+        ctype = self.headers.get("Content-Type", "")
+        if "json" in ctype:
+            args = json.loads(raw or b"{}")
+        elif "multipart/form-data" in ctype:
+            # aiohttp (AsyncWebClient) posts multipart
+            form = email.parser.BytesParser().parsebytes(f"Content-Type: {ctype}\r\n\r\n".encode() + raw)
+            args = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True).decode("utf-8", "replace")
+                    for part in form.get_payload()}
+        else:
+            args = {k: v[0] for k, v in parse_qs(raw.decode("utf-8", "replace")).items()}
+        # AsyncWebClient sends its arguments in the query string
+        args.update({k: v[0] for k, v in query.items()})
+        state = self.state
+        state.count(f"slack.{api_method}")
+        host = f"http://{self.headers.get('Host')}"
+        ts = f"{time.time():.6f}"
+
+        if api_method == "auth.test":
+            self._send(200, {"ok": True, "url": "https://fake.slack.com/", "team": "bench", "user": "symphony",
+                             "team_id": "T000BENCH", "user_id": "U000BOT", "bot_id": "B000BOT"})
+        elif api_method in ("chat.postMessage", "chat.update"):
+            if api_method == "chat.postMessage":
+                with state.lock:
+                    state.threads[ts] = args.get("thread_ts") or ts
+            if args.get("blocks"):
+                state.finish(args.get("thread_ts") or state.threads.get(args.get("ts")))
+            self._send(200, {"ok": True, "channel": args.get("channel"), "ts": args.get("ts") or ts, "message": {"text": args.get("text")}})
+        elif api_method == "users.info":
+            user = args.get("user")
+            self._send(200, {"ok": True, "user": {"id": user, "profile": {"display_name": f"bench-{user}", "real_name": "Bench User"}}})
+        elif api_method == "files.getUploadURLExternal":
+            file_id = f"F{state.next_id():08d}"
+            self._send(200, {"ok": True, "upload_url": f"{host}/upload/{file_id}", "file_id": file_id})
+        elif api_method == "files.completeUploadExternal":
+            self._send(200, {"ok": True, "files": json.loads(args.get("files") or "[]")})
+        else:
+            # chat.delete, reactions.add, conversations.leave, ...
+            self._send(200, {"ok": True})
+
+    # ---- openai ----
+
+    def _moderation(self, payload):
+        text = payload.get("input") or ""
+        flagged = "[flag]" in text
+        categories = {k: False for k in (
+            "harassment", "harassment/threatening", "hate", "hate/threatening", "illicit", "illicit/violent",
+            "self-harm", "self-harm/instructions", "self-harm/intent", "sexual", "sexual/minors",
+            "violence", "violence/graphic")}
+        categories["harassment"] = flagged
+        self._send(200, {"id": f"modr-{self.state.next_id()}", "model": "fake-moderation", "results": [{
+            "flagged": flagged,
+            "categories": categories,
+            "category_scores": {k: (0.9 if v else 0.0) for k, v in categories.items()},
+            "category_applied_input_types": {k: ["text"] for k in categories},
+        }]})
+
+    def _embeddings(self, payload):
+        # hashed bag of words: texts sharing words end up close, which is all recall needs
+        texts = payload.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        dims = int(payload.get("dimensions") or 64)
+        data = []
+        for n, text in enumerate(texts):
+            vector = [0.0] * dims
+            for word in str(text).lower().split():
+                vector[zlib.crc32(word.encode()) % dims] += 1.0
+            data.append({"object": "embedding", "index": n, "embedding": vector})
+        tokens = sum(len(str(t)) // 4 for t in texts)
+        self._send(200, {"object": "list", "data": data, "model": payload.get("model"),
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _llm(self, path, payload):
+        faults = self.state.faults
+        if path.startswith("/v1/models"):
+            self._send(200, {"object": "list", "data": []})
+            return
+
+        messages = payload.get("messages") or []
+        model = payload.get("model") or "fake-model"
+        usage = {"prompt_tokens": sum(len(json.dumps(m)) // 4 for m in messages), "completion_tokens": 40, "total_tokens": 0}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        message = {"role": "assistant", "content": None}
+        if "image" in (payload.get("modalities") or []):
+            message["content"] = ""
+            message["images"] = [{"type": "image_url", "image_url": {"url": "data:image/png;base64," + base64.b64encode(PNG).decode()}}]
+        else:
+            answered_tools = any(m.get("role") == "tool" for m in messages)
+            call = None if answered_tools or not payload.get("tools") or payload.get("tool_choice") == "none" else _tool_for(_last_user_text(messages))
+            if call:
+                name, args = call
+                message["tool_calls"] = [{"id": f"call_{self.state.next_id()}", "type": "function",
+                                          "function": {"name": name, "arguments": json.dumps(args)}}]
+            else:
+                message["content"] = "Here is a benchmark answer. " * 8
+
+        if payload.get("stream"):
+            self._stream(model, message, usage, (payload.get("stream_options") or {}).get("include_usage"))
+            return
+
+        faults.delay("llm")
+        self._send(200, {
+            "id": f"chatcmpl-{self.state.next_id()}", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, model, message, usage, include_usage):
+        faults = self.state.faults
+        chunk_id = f"chatcmpl-{self.state.next_id()}"
+
+        def chunk(delta, finish=None, with_usage=None):
+            data = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [] if with_usage else [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            if with_usage:
+                data["usage"] = with_usage
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        # latency is time to first token, then one chunk per token_interval
+        faults.delay("llm")
+        try:
+            if message.get("tool_calls"):
+                call = message["tool_calls"][0]
+                chunk({"role": "assistant", "tool_calls": [{"index": 0, "id": call["id"], "type": "function",
+                                                            "function": {"name": call["function"]["name"], "arguments": ""}}]})
+                chunk({"tool_calls": [{"index": 0, "function": {"arguments": call["function"]["arguments"]}}]}, finish="tool_calls")
+            else:
+                for word in (message.get("content") or "").split(" "):
+                    chunk({"content": word + " "})
+                    if faults.token_interval:
+                        time.sleep(faults.token_interval)
+                chunk({}, finish="stop")
+            if include_usage:
+                chunk(None, with_usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    # ---- postgrest ----
+
+    def _postgrest(self, method, table, query, raw):
+        state = self.state
+        state.count(f"supabase.{table}.{method.lower()}")
+        if table == "rpc/claim_lease":
+            self._claim_lease(json.loads(raw or b"{}"))
+            return
+        if table == "rpc/append_chat_turn":
+            self._append_chat_turn(json.loads(raw or b"{}"))
+            return
+        if table == "rpc/restore_chat_thread":
+            with state.lock:
+                restored = self._rehydrate(json.loads(raw or b"{}")["p_thread_ts"])
+            self._send(200, restored)
+            return
+        with state.lock:
+            rows = state.tables.setdefault(table, [])
+
+            filters = {k: v[0] for k, v in query.items() if k not in ("select", "order", "limit")}
+
+            def matches(r):
+                for key, value in filters.items():
+                    op, _, arg = value.partition(".")
+                    if op == "eq" and str(r.get(key)) != arg:
+                        return False
+                    if op == "lt" and not str(r.get(key)) < arg:
+                        return False
+                    if op == "gt" and not str(r.get(key)) > arg:
+                        return False
+                    if op == "gte" and not str(r.get(key)) >= arg:
+                        return False
+                    if op == "in" and str(r.get(key)) not in arg.strip("()").split(","):
+                        return False
+                return True
+
+            if method == "DELETE":
+                result = [r for r in rows if matches(r)]
+                rows[:] = [r for r in rows if not matches(r)]
+            elif method == "PATCH":
+                changes = json.loads(raw or b"{}")
+                result = [r for r in rows if matches(r)]
+                for r in result:
+                    r.update(changes)
+            elif method == "GET":
+                found = [r for r in rows if matches(r)]
+                order = query.get("order", [None])[0]
+                limit = query.get("limit", [None])[0]
+                if order:
+                    column, _, direction = order.partition(".")
+                    found.sort(key=lambda r: r.get(column) or "", reverse=direction.startswith("desc"))
+                if limit is not None:
+                    found = found[:int(limit)]
+                result = found
+            else:
+                incoming = json.loads(raw or b"[]")
+                if isinstance(incoming, dict):
+                    incoming = [incoming]
+                result = []
+                upsert = "merge-duplicates" in (self.headers.get("Prefer") or "")
+                for row in incoming:
+                    row = dict(row)
+                    if upsert and table == "bot_settings":
+                        rows[:] = [r for r in rows if r.get("channel_id") != row.get("channel_id")]
+                    row.setdefault("id", len(rows) + 1)
+                    rows.append(row)
+                    result.append(row)
+
+        self._send(201 if method == "POST" else 200, result, headers={"Content-Range": f"0-{max(len(result) - 1, 0)}/*"})
+
+    def _append_chat_turn(self, args):
+        # same as the SQL function: insert, then the thread's newest p_limit rows (newest first)
+        with self.state.lock:
+            self._rehydrate(args["p_thread_ts"])
+            rows = self.state.tables.setdefault("chat_mem", [])
+            rows.append({
+                "id": len(rows) + 1,
+                "channel_id": args["p_channel_id"],
+                "thread_ts": args["p_thread_ts"],
+                "user_name": args.get("p_user_name"),
+                "role": args["p_role"],
+                "content": args["p_content"],
+                "created_at": args.get("p_created_at") or time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime()),
+            })
+            window = sorted((r for r in rows if r["thread_ts"] == args["p_thread_ts"]), key=lambda r: r["created_at"], reverse=True)
+            result = [{"role": r["role"], "content": r["content"], "created_at": r["created_at"]} for r in window[:int(args["p_limit"])]]
+        self._send(200, result)
+
+    def _rehydrate(self, thread_ts):
+        # archived threads keep their turns as a plain list here; the SQL version decompresses jsonb
+        archive = self.state.tables.setdefault("chat_archive", [])
+        found = next((a for a in archive if a["thread_ts"] == thread_ts), None)
+        if found is None:
+            return 0
+        archive.remove(found)
+        rows = self.state.tables.setdefault("chat_mem", [])
+        for turn in found["turns"]:
+            rows.append(dict(turn, id=len(rows) + 1))
+        return len(found["turns"])
+
+    def _claim_lease(self, args):
+        # same semantics as the SQL function: take the key if it's free or its lease ran out
+        now = time.time()
+        with self.state.lock:
+            rows = self.state.tables.setdefault("bot_leases", [])
+            held = next((r for r in rows if r["key"] == args["p_key"]), None)
+            claimed = held is None or held["expires"] <= now
+            if claimed:
+                if held is not None:
+                    rows.remove(held)
+                expires = now + float(args["p_ttl_seconds"])
+                rows.append({
+                    "key": args["p_key"],
+                    "owner": args["p_owner"],
+                    "expires": expires,
+                    "expires_at": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(expires)),
+                })
+        self._send(200, claimed)
+
+
+class FakeServices:
+    def __init__(self, faults=None, host="127.0.0.1", port=0):
+        self.state = FakeState(faults or Faults())
+        handler = type("BoundFakeHandler", (FakeHandler,), {"state": self.state})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def env(self):
+        # environment that points config.py at this server instead of the real services
+        return {
+            "SLACK_API_URL": f"{self.url}/api/",
+            "SLACK_BOT_TOKEN": "xoxb-bench",
+            "SLACK_APP_TOKEN": "xapp-bench",
+            "AI_KEY": "sk-bench",
+            "AI_BASE_URL": f"{self.url}/v1",
+            "MODERATION_URL": f"{self.url}/v1",
+            "MODERATION_KEY": "sk-bench",
+            "DEFAULT_MODEL": "bench/default",
+            "IMGGEN_MODEL": "bench/image",
+            "SUPABASE_URL": self.url,
+            # postgrest only needs something shaped like a jwt
+            "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.YmVuY2g",
+            "SEARCH_API_URL": f"{self.url}/search",
+            "SEARCH_API_KEY": "bench",
+            "LINKUP_API_KEY": "bench",
+            "LINKUP_API_URL": f"{self.url}/linkup/v1/fetch",
+            "ALLOWED_CHANNEL_ID": "C000BENCH",
+        }
@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextlib
+
+from bench.fake_services import FakeServices, Faults, SERVICES
+
+
+# replays N app_mention / DM events through the real handlers of app.py or async_app.py,
+# with every outside service replaced by bench/fake_services.py. nothing leaves the machine.
+#
+#   python -m bench.run --runtime sync --events 200 --concurrency 20
+#   python -m bench.run --runtime async --events 500 --concurrency 100 --latency llm=1.5 --error-rate search=0.1
+#
+# reports throughput and p50/p95/p99 for every stage the metrics module records
+# (slack calls, moderation, supabase, llm rounds, tools) plus the end-to-end time.
+
+# roughly what the real services take on a good day
+DEFAULT_LATENCY = "slack=0.05,slack_files=0.05,llm=0.8,moderation=0.15,embeddings=0.05,supabase=0.04,search=0.6,linkup=1.5"
+
+KINDS = {
+    "plain": "tell me something nice",
+    "search": "[search] symphony release notes",
+    "scrape": "[scrape] read this page",
+    "research": "[research] history of slack bots",
+    "image": "[image] a cat playing violin",
+    "flag": "[flag] something rude",
+    "vision": "what is in this picture?",
+}
+
+
+def parse_pairs(text, cast=float):
+    # "llm=1.5,slack=0.05" -> {"llm": 1.5, "slack": 0.05}
+    out = {}
+    for pair in filter(None, (text or "").split(",")):
+        key, _, value = pair.partition("=")
+        out[key.strip()] = cast(value)
+    return out
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def build_events(count, mix, users, dm_ratio, seed, duplicates=0.0):
+    rng = random.Random(seed)
+    kinds = [k for k, w in mix.items() for _ in range(int(w))]
+    base = int(time.time())
+    bodies = []
+    for n in range(count):
+        kind = rng.choice(kinds)
+        ts = f"{base + n}.{n:06d}"
+        user = f"U{rng.randrange(users):07d}"
+        # distinct queries so the tool cache doesn't hide the tool latency
+        text = f"{KINDS[kind]} #{n}"
+        if rng.random() < dm_ratio:
+            event = {"type": "message", "channel_type": "im", "channel": "D000BENCH", "user": user, "text": text, "ts": ts, "event_ts": ts}
+        else:
+            event = {"type": "app_mention", "channel": "C000BENCH", "user": user, "text": f"<@U000BOT> {text}", "ts": ts, "event_ts": ts}
+        if kind == "vision":
+            event["files"] = [{"id": f"F{n:08d}", "name": f"bench-{n}.png", "mimetype": "image/png", "url_private": None}]
+        body = {
+            "token": "bench",
+            "team_id": "T000BENCH",
+            "api_app_id": "A000BENCH",
+            "event": event,
+            "type": "event_callback",
+            "event_id": f"Ev{n:08d}",
+            "event_time": base + n,
+            "authorizations": [{"enterprise_id": None, "team_id": "T000BENCH", "user_id": "U000BOT", "is_bot": True, "is_enterprise_install": False}],
+        }
+        bodies.append((kind, ts, body))
+        if rng.random() < duplicates:
+            # a redelivery of the same event, which the bot should drop without answering
+            bodies.append(("duplicate", ts, body))
+    return bodies
+
+
+class Recorder:
+    # collects raw observations from the metrics registry plus per-event dispatch / finish times
+    def __init__(self, on_request):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.outcomes = {}
+        self.dispatched = {}
+        self.finished = {}
+        self.on_request = on_request
+
+    def sink(self, name, value, labels):
+        if name == "symphony_request_seconds":
+            with self.lock:
+                self.samples.setdefault("request", []).append(value)
+                outcome = labels.get("outcome", "ok")
+                self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.on_request()
+            return
+        if name != "symphony_stage_seconds":
+            return
+        detail = labels.get("method") or labels.get("op") or labels.get("tool") or labels.get("round")
+        key = labels["stage"] + (f" {detail}" if detail else "")
+        with self.lock:
+            self.samples.setdefault(key, []).append(value)
+            if labels.get("outcome") not in (None, "ok"):
+                err = f"{key} ({labels['outcome']})"
+                self.outcomes[err] = self.outcomes.get(err, 0) + 1
+
+    def finish(self, msg_ts):
+        with self.lock:
+            if msg_ts in self.dispatched:
+                self.finished[msg_ts] = time.monotonic()
+
+    def end_to_end(self):
+        with self.lock:
+            return [self.finished[ts] - self.dispatched[ts] for ts in self.finished]
+
+
+def report(args, recorder, fakes, wall):
+    done = sum(n for k, n in recorder.outcomes.items() if k in ("ok", "error", "refused", "shed"))
+    rows = []
+    e2e = recorder.end_to_end()
+    if e2e:
+        rows.append(("end_to_end (dispatch -> reply)", e2e))
+    for key in sorted(recorder.samples, key=lambda k: (k != "request", k)):
+        rows.append((key, recorder.samples[key]))
+
+    result = {
+        "runtime": args.runtime,
+        "events": args.events,
+        "concurrency": args.concurrency,
+        "stream": args.stream,
+        "completed": done,
+        "wall_seconds": round(wall, 3),
+        "throughput_per_s": round(done / wall, 3) if wall else 0.0,
+        "outcomes": recorder.outcomes,
+        "fake_calls": dict(sorted(fakes.state.calls.items())),
+        "stages": {
+            key: {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 4),
+                "p95": round(percentile(values, 95), 4),
+                "p99": round(percentile(values, 99), 4),
+                "max": round(max(values), 4),
+            }
+            for key, values in rows
+        },
+    }
+
+    print(f"\n{args.runtime} runtime, {done}/{args.events} replies in {wall:.2f}s "
+          f"({result['throughput_per_s']}/s, concurrency {args.concurrency}, stream={args.stream})")
+    print(f"outcomes: {json.dumps(recorder.outcomes)}")
+    print(f"\n{'stage':<44}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for key, stats in result["stages"].items():
+        print(f"{key:<44}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nwrote {args.json}")
+    return result
+
+
+def prepare_env(args, fakes, workdir):
+    env = fakes.env()
+    env.update({
+        "STREAM_RESPONSES": "true" if args.stream else "false",
+        "STREAM_UPDATE_INTERVAL": str(args.stream_interval),
+        "CHAT_MEM_JOURNAL": os.path.join(workdir, "chat_mem_journal.jsonl"),
+        "TOOL_CACHE_PATH": os.path.join(workdir, "tool_cache.db"),
+        "JOBS_PATH": os.path.join(workdir, "jobs.db"),
+        "CONVERSATION_DB": os.path.join(workdir, "symphony.db"),
+        "RECALL_PATH": os.path.join(workdir, "recall_index"),
+        # the fake Slack has no rate limits; --set SLACK_RATE_LIMITING=true to see the local buckets at work
+        "SLACK_RATE_LIMITING": "false",
+        "METRICS_PORT": "0",
+        "METRICS_FILE": "",
+    })
+    env.update(parse_pairs(args.set, str))
+    # explicit env wins over .env, so a developer's real keys are never picked up
+    os.environ.update(env)
+
+
+def run_sync(args, bodies, recorder, fakes):
+    from slack_bolt.request import BoltRequest
+    import app as bot
+
+    # like app.py's main(), so the first turns don't pay for importing openai/supabase
+    if bot.WARM_UP:
+        bot.health.warm_up()
+    slots = threading.BoundedSemaphore(args.concurrency)
+    recorder.on_request = slots.release
+
+    start = time.monotonic()
+    for kind, ts, body in bodies:
+        if kind != "duplicate":
+            slots.acquire()
+            recorder.dispatched[ts] = time.monotonic()
+        bot.app.dispatch(BoltRequest(body=json.dumps(body), mode="socket_mode"))
+
+    # wait for the stragglers
+    for _ in range(args.concurrency):
+        if not slots.acquire(timeout=args.timeout):
+            print("timed out waiting for replies")
+            break
+    # background jobs (deep research, images) finish after their turn did
+    deadline = time.monotonic() + args.timeout
+    while not bot.job_runner.idle() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    wall = time.monotonic() - start
+    bot.chat_memory.writer.close()
+    if bot.recall:
+        bot.recall.close()
+    return wall
+
+
+async def run_async_runtime(args, bodies, recorder, fakes):
+    from slack_bolt.request.async_request import AsyncBoltRequest
+    import async_app as bot
+
+    await bot.setup()
+    if bot.WARM_UP:
+        await bot.health.awarm_up()
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(args.concurrency)
+    recorder.on_request = slots.release
+
+    start = time.monotonic()
+    for kind, ts, body in bodies:
+        if kind != "duplicate":
+            await slots.acquire()
+            recorder.dispatched[ts] = time.monotonic()
+        await bot.app.async_dispatch(AsyncBoltRequest(body=json.dumps(body), mode="socket_mode"))
+
+    for _ in range(args.concurrency):
+        try:
+            await asyncio.wait_for(slots.acquire(), args.timeout)
+        except asyncio.TimeoutError:
+            print("timed out waiting for replies")
+            break
+    deadline = time.monotonic() + args.timeout
+    while not bot.job_runner.idle() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    wall = time.monotonic() - start
+    await loop.run_in_executor(None, bot.chat_memory.writer.close)
+    if bot.recall:
+        await loop.run_in_executor(None, bot.recall.close)
+    await bot.http_client.aclose()
+    return wall
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="offline load test for symphony")
+    parser.add_argument("--runtime", choices=("sync", "async"), default="sync")
+    parser.add_argument("--events", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10, help="max replies in flight")
+    parser.add_argument("--users", type=int, default=25)
+    parser.add_argument("--dm-ratio", type=float, default=0.2)
+    parser.add_argument("--duplicates", type=float, default=0.0, help="share of events Slack delivers twice")
+    parser.add_argument("--mix", default="plain=6,search=2,scrape=1,image=1",
+                        help=f"weights per event kind ({', '.join(KINDS)})")
+    parser.add_argument("--latency", default="", help=f"seconds per service, on top of the defaults ({', '.join(SERVICES)})")
+    parser.add_argument("--error-rate", default="", help="0..1 per service, e.g. search=0.1,llm=0.02")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--token-interval", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--stream-interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--set", default="", help="extra settings for the bot, e.g. CHAT_SLOTS=4,TURN_QUEUE_MAX=20")
+    parser.add_argument("--json", help="also write the results here (for comparing runs)")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own output")
+    args = parser.parse_args(argv)
+
+    latency = parse_pairs(DEFAULT_LATENCY)
+    latency.update(parse_pairs(args.latency))
+    faults = Faults(latency, args.jitter, parse_pairs(args.error_rate), args.token_interval, args.seed)
+    fakes = FakeServices(faults).start()
+    recorder = Recorder(lambda: None)
+    fakes.state.on_finish = recorder.finish
+
+    bodies = build_events(args.events, parse_pairs(args.mix, int), args.users, args.dm_ratio, args.seed, args.duplicates)
+    for kind, ts, body in bodies:
+        for f in body["event"].get("files", []):
+            f["url_private"] = f"{fakes.url}/files/{f['name']}"
+
+    with tempfile.TemporaryDirectory(prefix="symphony-bench-") as workdir:
+        prepare_env(args, fakes, workdir)
+        from metrics import registry
+        registry.add_sink(recorder.sink)
+
+        quiet = open(os.devnull, "w") if not args.verbose else None
+        with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+            if args.runtime == "sync":
+                wall = run_sync(args, bodies, recorder, fakes)
+            else:
+                wall = asyncio.run(run_async_runtime(args, bodies, recorder, fakes))
+        if quiet:
+            quiet.close()
+
+        result = report(args, recorder, fakes, wall)
+    fakes.stop()
+    return result
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,219 @@
+import os
+from dotenv import load_dotenv
+from http_client import Endpoint
+load_dotenv()
+
+
+# --------- SLACK ENVS ------------
+SLACK_BOT_TOKEN= os.getenv("SLACK_BOT_TOKEN")
+SLACK_APP_TOKEN= os.getenv("SLACK_APP_TOKEN")
+# only set this to point the bot at a local stand-in (see bench/)
+SLACK_API_URL = os.getenv("SLACK_API_URL")
+# keep Slack Web API calls under Slack's per-method tiers locally (429s are retried either way)
+SLACK_RATE_LIMITING = os.getenv("SLACK_RATE_LIMITING", "true").lower() == "true"
+# calls per minute per method (per channel for chat_postMessage), on top of the
+# built-in tier defaults in slack_client.py, e.g. "chat_update=50,users_info=100"
+SLACK_RATE_LIMITS = {
+    method.strip(): float(rate)
+    for method, _, rate in (pair.rpartition("=") for pair in os.getenv("SLACK_RATE_LIMITS", "").split(",") if "=" in pair)
+}
+# how many seconds' worth of calls may go out in a burst, and how often / how long a 429 is retried
+SLACK_RATE_BURST = float(os.getenv("SLACK_RATE_BURST", "30"))
+SLACK_MAX_RETRIES = int(os.getenv("SLACK_MAX_RETRIES", "3"))
+SLACK_MAX_RETRY_WAIT = float(os.getenv("SLACK_MAX_RETRY_WAIT", "60"))
+# --------- AI CONFIG ------------
+AI_KEY = os.getenv("AI_KEY")
+AI_BASE_URL = os.getenv("AI_BASE_URL")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL")
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() == "true"
+STREAM_UPDATE_INTERVAL = float(os.getenv("STREAM_UPDATE_INTERVAL", "1.0"))
+ALLOWED_MODELS = ["google/gemini-2.5-flash-lite-preview-09-2025", "qwen/qwen3-235b-a22b", "z-ai/glm-4.7", "openai/gpt-oss-120b", "moonshotai/kimi-k2.5", "minimax/minimax-m2.1", "x-ai/grok-4.1-fast"]
+# ---------- MODERATION CONFIG ----------
+MODERATION_URL = os.getenv("MODERATION_URL")
+MODERATION_KEY = os.getenv("MODERATION_KEY")
+# --------- TOOLS ------------
+SEARCH_API_URL= os.getenv("SEARCH_API_URL")
+SEARCH_API_KEY= os.getenv("SEARCH_API_KEY")
+IMGGEN_MODEL = os.getenv("IMGGEN_MODEL")
+IMAGE_GEN_CONCURRENCY = int(os.getenv("IMAGE_GEN_CONCURRENCY", "2"))
+LINKUP_API_KEY = os.getenv("LINKUP_API_KEY")
+LINKUP_API_URL = os.getenv("LINKUP_API_URL", "https://api.linkup.so/v1/fetch")
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+TOOL_TIMEOUTS = {
+    "web_search": float(os.getenv("WEB_SEARCH_TIMEOUT", "30")),
+    "url_scrape": float(os.getenv("URL_SCRAPE_TIMEOUT", "60")),
+    "deep_research": float(os.getenv("DEEP_RESEARCH_TIMEOUT", "300")),
+    "image_generate": float(os.getenv("IMAGE_GENERATE_TIMEOUT", "120")),
+}
+# tool results are cached per tool for this many seconds (0 turns caching off for that tool)
+TOOL_CACHE_PATH = os.getenv("TOOL_CACHE_PATH", "tool_cache.db")
+TOOL_CACHE_TTLS = {
+    "web_search": float(os.getenv("WEB_SEARCH_CACHE_TTL", "900")),
+    "url_scrape": float(os.getenv("URL_SCRAPE_CACHE_TTL", "3600")),
+    "deep_research": float(os.getenv("DEEP_RESEARCH_CACHE_TTL", "86400")),
+}
+# tool output is trimmed (boilerplate, duplicates, then the passages least related to the question)
+# to this many tokens before it goes into the prompt (0 sends it untouched)
+TOOL_OUTPUT_BUDGETS = {
+    "web_search": int(os.getenv("WEB_SEARCH_OUTPUT_TOKENS", "1500")),
+    "url_scrape": int(os.getenv("URL_SCRAPE_OUTPUT_TOKENS", "3000")),
+    "deep_research": int(os.getenv("DEEP_RESEARCH_OUTPUT_TOKENS", "5000")),
+}
+# --------- VISION ---------
+VISION_MAX_DIM = int(os.getenv("VISION_MAX_DIM", "1568"))
+VISION_MAX_BYTES = int(os.getenv("VISION_MAX_BYTES", "1500000"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+VISION_MAX_IMAGES = int(os.getenv("VISION_MAX_IMAGES", "4"))
+# --------- OUTBOUND HTTP ---------
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+HTTP_ENDPOINTS = [
+    Endpoint("search", HTTP_CONNECT_TIMEOUT, float(os.getenv("SEARCH_READ_TIMEOUT", "20")), retries=HTTP_RETRIES, idempotent=True),
+    Endpoint("linkup_scrape", HTTP_CONNECT_TIMEOUT, float(os.getenv("LINKUP_READ_TIMEOUT", "55")), retries=1, idempotent=True),
+    # deep research is slow and billed per call, so it never gets retried
+    Endpoint("linkup_research", HTTP_CONNECT_TIMEOUT, float(os.getenv("DEEP_RESEARCH_READ_TIMEOUT", "290"))),
+    Endpoint("slack_files", HTTP_CONNECT_TIMEOUT, float(os.getenv("SLACK_FILE_READ_TIMEOUT", "30")), retries=HTTP_RETRIES, idempotent=True),
+]
+# --------- MEMORY CONFIG ---------
+SUPABASE_URL= os.getenv("SUPABASE_URL")
+SUPABASE_KEY= os.getenv("SUPABASE_KEY")
+# where chat_mem, chat_summaries and bot_settings live: "supabase", or "sqlite" (a local WAL file, one process only)
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "supabase").lower()
+CONVERSATION_DB = os.getenv("CONVERSATION_DB", "symphony.db")
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "3600"))
+MODEL_CACHE_TTL = float(os.getenv("MODEL_CACHE_TTL", "300"))
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "10"))
+CHAT_MEM_JOURNAL = os.getenv("CHAT_MEM_JOURNAL", "chat_mem_journal.jsonl")
+CHAT_MEM_FLUSH_INTERVAL = float(os.getenv("CHAT_MEM_FLUSH_INTERVAL", "1.0"))
+# history (thread summary + recent turns) sent per message is kept under this many tokens;
+# HISTORY_TOKEN_BUDGETS overrides it per model, e.g. "z-ai/glm-4.7=16000,openai/gpt-oss-120b=6000"
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "8000"))
+HISTORY_TOKEN_BUDGETS = {
+    model.strip(): int(tokens)
+    for model, _, tokens in (pair.rpartition("=") for pair in os.getenv("HISTORY_TOKEN_BUDGETS", "").split(",") if "=" in pair)
+}
+# older turns get folded into a rolling summary by this model; the newest few always stay verbatim
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL") or DEFAULT_MODEL
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "4"))
+# --------- MEMORY RECALL ---------
+# embeds every stored turn into a per-channel vector index (needs numpy, `pip install .[recall]`)
+# and adds the few most relevant snippets from other threads to each prompt
+RECALL_ENABLED = os.getenv("RECALL_ENABLED", "false").lower() == "true"
+# any OpenAI-compatible /embeddings endpoint; defaults to the chat provider
+EMBEDDINGS_BASE_URL = os.getenv("EMBEDDINGS_BASE_URL") or AI_BASE_URL
+EMBEDDINGS_KEY = os.getenv("EMBEDDINGS_KEY") or AI_KEY
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# ask for shorter vectors (0 = the model's own size) to keep the index small, if the endpoint supports it
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+RECALL_PATH = os.getenv("RECALL_PATH", "recall_index")
+RECALL_TOP_K = int(os.getenv("RECALL_TOP_K", "4"))
+# cosine similarity a snippet needs to be injected, and the token budget for all of them
+RECALL_MIN_SCORE = float(os.getenv("RECALL_MIN_SCORE", "0.35"))
+RECALL_MAX_TOKENS = int(os.getenv("RECALL_MAX_TOKENS", "600"))
+# rows read back from chat_mem when a channel has no saved index yet, and the cap per channel
+RECALL_BACKFILL = int(os.getenv("RECALL_BACKFILL", "2000"))
+RECALL_MAX_ROWS = int(os.getenv("RECALL_MAX_ROWS", "5000"))
+# --------- RETENTION ---------
+# threads with no new turn for this many days move out of chat_mem into chat_archive (compressed,
+# one row per thread) and come back the next time someone reads them; 0 (the default) keeps
+# everything live. needs the chat_archive tables and functions from the README
+CHAT_ARCHIVE_AFTER_DAYS = float(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "0"))
+# threads idle this long are deleted, archived or not (0 = never); CHAT_MEM_TTLS overrides it
+# per channel, e.g. "C0123456=7,C0ABCDEF=0" (0 keeps that channel forever)
+CHAT_MEM_TTL_DAYS = float(os.getenv("CHAT_MEM_TTL_DAYS", "0"))
+CHAT_MEM_TTLS = {
+    channel.strip(): float(days)
+    for channel, _, days in (pair.rpartition("=") for pair in os.getenv("CHAT_MEM_TTLS", "").split(",") if "=" in pair)
+}
+# how often the retention job runs, and how many threads it archives per transaction
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "200"))
+# set when chat_mem is the monthly-partitioned table from the README; the job then keeps the
+# coming months' partitions created and drops old empty ones
+CHAT_MEM_PARTITIONED = os.getenv("CHAT_MEM_PARTITIONED", "false").lower() == "true"
+# --------- MODEL ROUTING ---------
+# models a turn fails over (and hedges) to, in order, when the channel's model errors or is over its SLO
+MODEL_FALLBACKS = [m.strip() for m in os.getenv("MODEL_FALLBACKS", "").split(",") if m.strip()] or [DEFAULT_MODEL]
+# fire a second request at the next fallback when a call is still running after this many seconds (0 = off)
+HEDGE_AFTER = float(os.getenv("HEDGE_AFTER", "0"))
+# a model whose p95 latency or error rate over the window breaches these sits out for MODEL_COOLDOWN seconds
+MODEL_SLO_SECONDS = float(os.getenv("MODEL_SLO_SECONDS", "60"))
+MODEL_MAX_ERROR_RATE = float(os.getenv("MODEL_MAX_ERROR_RATE", "0.5"))
+MODEL_MIN_SAMPLES = int(os.getenv("MODEL_MIN_SAMPLES", "5"))
+MODEL_STATS_WINDOW = float(os.getenv("MODEL_STATS_WINDOW", "300"))
+MODEL_COOLDOWN = float(os.getenv("MODEL_COOLDOWN", "60"))
+# --------- REQUEST PIPELINE ---------
+# threads used to fetch user info, moderation, history, model and images side by side
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "32"))
+# --------- REPLICAS ---------
+# "memory" for a single process, "supabase" when several bot processes share the workspace
+COORDINATION_STORE = os.getenv("COORDINATION_STORE", "memory").lower()
+# how long a handled message is remembered, and how long a turn may hold its thread before the lease lapses
+EVENT_DEDUPE_TTL = float(os.getenv("EVENT_DEDUPE_TTL", "3600"))
+THREAD_LEASE_TTL = float(os.getenv("THREAD_LEASE_TTL", "420"))
+# how long a turn waits for another replica to finish the same thread before answering anyway
+THREAD_LOCK_WAIT = float(os.getenv("THREAD_LOCK_WAIT", "300"))
+# --------- BACKGROUND JOBS ---------
+# deep research and image generation run as persisted jobs that post back to the thread when done
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "true").lower() == "true"
+# "sqlite" (local file, one process) or "supabase" (bot_jobs table, shared by replicas)
+JOB_STORE = os.getenv("JOB_STORE", "sqlite").lower()
+JOBS_PATH = os.getenv("JOBS_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# a failed job is retried (delay doubling each time) until it has run this many times
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "30"))
+# a job whose worker died is taken over once its lease lapses, at the next rescan. progress
+# updates renew it, but it never goes below the slowest job tool's timeout (plus a minute),
+# or a second replica could take over a job that is still running
+JOB_LEASE_TTL = max(
+    float(os.getenv("JOB_LEASE_TTL", "600")),
+    TOOL_TIMEOUTS["deep_research"] + 60,
+    TOOL_TIMEOUTS["image_generate"] + 60,
+)
+JOB_RESCAN_INTERVAL = float(os.getenv("JOB_RESCAN_INTERVAL", "60"))
+# --------- SCHEDULER ---------
+# replies running at once in the chat lane, and in the lane for turns using slow tools
+CHAT_SLOTS = int(os.getenv("CHAT_SLOTS", "16"))
+LONG_SLOTS = int(os.getenv("LONG_SLOTS", "4"))
+LONG_TOOLS = ("deep_research", "image_generate")
+LONG_TOOL_WORKERS = int(os.getenv("LONG_TOOL_WORKERS", "4"))
+# turns waiting beyond this get a "busy, try again" reply
+TURN_QUEUE_MAX = int(os.getenv("TURN_QUEUE_MAX", "100"))
+PER_USER_CONCURRENCY = int(os.getenv("PER_USER_CONCURRENCY", "2"))
+PER_CHANNEL_CONCURRENCY = int(os.getenv("PER_CHANNEL_CONCURRENCY", "12"))
+# --------- ASYNC RUNTIME ---------
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+# --------- METRICS ---------
+# per-stage latency histograms in Prometheus text format, served on localhost and/or written to a file
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+METRICS_FOOTER_BREAKDOWN = os.getenv("METRICS_FOOTER_BREAKDOWN", "false").lower() == "true"
+# --------- STARTUP ---------
+# open a connection to every backend (LLM, moderation, Supabase, search, Slack) in parallel before taking events
+WARM_UP = os.getenv("WARM_UP", "true").lower() == "true"
+# per-dependency check timeout (seconds), and how stale a check may get before /readyz runs it again
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "10"))
+HEALTH_RECHECK = float(os.getenv("HEALTH_RECHECK", "30"))
+# /healthz and /readyz on 127.0.0.1:<port>; they are also served on METRICS_PORT. 0 = only there
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "0"))
+# --------- PROFILING ---------
+# slack user ids allowed to run /symphony-profile
+ADMIN_USER_IDS = {u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}
+# profile the next N replies right from startup (same as running /symphony-profile N)
+PROFILE_NEXT = int(os.getenv("PROFILE_NEXT", "0"))
+# "sample" (every thread, sampled) or "cprofile" (the reply's own thread, exact)
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample").lower()
+# tracemalloc too (makes allocation-heavy code several times slower while a reply is profiled)
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "true").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+# dump every thread's stack each this many seconds the profiled reply is still running
+PROFILE_STACK_AFTER = float(os.getenv("PROFILE_STACK_AFTER", "3"))
+# ----------- MISC ----------
+ALLOWED_CHANNEL_ID = os.getenv("ALLOWED_CHANNEL_ID")
+
@@ -0,0 +1,290 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import datetime
+import threading
+import contextlib
+from cache import TTLCache
+from metrics import registry, record, span, aspan
+
+
+# lets more than one bot process run against the same workspace. every incoming message
+# is claimed once by its channel + ts (Slack redelivers on slow acks, and a mention can
+# show up as more than one event), so duplicates are dropped before any model call. a turn
+# then holds a lease on its thread while it answers, so two replicas never answer the same
+# thread at once and the second one reads history that already has the first one's reply.
+#
+# the store is pluggable: MemoryStore for a single process, SupabaseStore (a bot_leases
+# table plus the claim_lease() function from the README) when several replicas share it.
+# every store failure fails open, like the rest of the bot: better a rare double reply
+# than no reply.
+
+registry.describe("symphony_duplicate_events_total", "Slack events dropped because the message was already claimed.")
+
+
+class MemoryStore:
+    shared = False
+
+    def __init__(self, sweep_every=1000):
+        self.leases = {}
+        self.lock = threading.Lock()
+        self.sweep_every = sweep_every
+        self.claims = 0
+
+    def claim(self, key, owner, ttl):
+        # True when the key was free (or its lease ran out) and is now ours for ttl seconds
+        now = time.monotonic()
+        with self.lock:
+            held = self.leases.get(key)
+            if held is not None and held[1] > now:
+                return False
+            self.leases[key] = (owner, now + ttl)
+            self.claims += 1
+            if self.claims % self.sweep_every == 0:
+                self.leases = {k: v for k, v in self.leases.items() if v[1] > now}
+            return True
+
+    def release(self, key, owner):
+        with self.lock:
+            held = self.leases.get(key)
+            if held is not None and held[0] == owner:
+                del self.leases[key]
+
+    def renew(self, key, owner, ttl):
+        # pushes out a lease we still hold; False when it lapsed and someone else has it now
+        with self.lock:
+            held = self.leases.get(key)
+            if held is None or held[0] != owner:
+                return False
+            self.leases[key] = (owner, time.monotonic() + ttl)
+            return True
+
+
+class SupabaseStore:
+    shared = True
+
+    def __init__(self, supabase, table="bot_leases", function="claim_lease", sweep_interval=600, keep=86400):
+        self.supabase = supabase
+        self.table = table
+        self.function = function
+        self.sweep_interval = sweep_interval
+        self.keep = keep
+        self.next_sweep = time.monotonic() + sweep_interval
+
+    def _claim_query(self, key, owner, ttl):
+        return self.supabase.rpc(self.function, {"p_key": key, "p_owner": owner, "p_ttl_seconds": ttl})
+
+    def _release_query(self, key, owner):
+        return self.supabase.table(self.table).delete().eq("key", key).eq("owner", owner)
+
+    def _renew_query(self, key, owner, ttl):
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl)
+        return self.supabase.table(self.table).update({"expires_at": expires_at.isoformat()}).eq("key", key).eq("owner", owner)
+
+    def _sweep_query(self):
+        # expired event claims are kept a while so late redeliveries still find them
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=self.keep)
+        return self.supabase.table(self.table).delete().lt("expires_at", cutoff.isoformat())
+
+    def _sweep_due(self):
+        now = time.monotonic()
+        if now < self.next_sweep:
+            return False
+        self.next_sweep = now + self.sweep_interval
+        return True
+
+    def claim(self, key, owner, ttl):
+        with span("supabase", op=f"{self.function}.rpc"):
+            claimed = bool(self._claim_query(key, owner, ttl).execute().data)
+        if self._sweep_due():
+            try:
+                with span("supabase", op=f"{self.table}.delete"):
+                    self._sweep_query().execute()
+            except Exception as e:
+                print(f"unable to sweep old leases. {e}")
+        return claimed
+
+    def release(self, key, owner):
+        with span("supabase", op=f"{self.table}.delete"):
+            self._release_query(key, owner).execute()
+
+    def renew(self, key, owner, ttl):
+        with span("supabase", op=f"{self.table}.update"):
+            return bool(self._renew_query(key, owner, ttl).execute().data)
+
+
+class Coordinator:
+    def __init__(self, store, owner=None, event_ttl=3600, lease_ttl=420, wait=300, poll=0.25, max_poll=2.0):
+        self.store = store
+        # one owner id per process, so a lease can only be released by whoever took it
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.event_ttl = event_ttl
+        self.lease_ttl = lease_ttl
+        self.wait = wait
+        self.poll = poll
+        self.max_poll = max_poll
+        # local duplicates (a mention in a DM arrives twice, quick redeliveries) never hit the shared store
+        self.seen = TTLCache("seen_events", maxsize=10000, ttl=event_ttl)
+        self.lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return self.store.shared
+
+    def _event_key(self, event):
+        return f"event:{event['channel']}:{event['ts']}"
+
+    def _seen_before(self, key):
+        with self.lock:
+            if self.seen.get(key):
+                registry.inc("symphony_duplicate_events_total", where="local")
+                return True
+            self.seen.set(key, True)
+            return False
+
+    def first_delivery(self, event):
+        # False for a message some replica (maybe this one) already picked up
+        key = self._event_key(event)
+        if self._seen_before(key):
+            return False
+        if not self.shared:
+            return True
+        try:
+            claimed = self.store.claim(key, self.owner, self.event_ttl)
+        except Exception as e:
+            print(f"unable to claim event, answering anyway. {e}")
+            return True
+        if not claimed:
+            registry.inc("symphony_duplicate_events_total", where="shared")
+        return claimed
+
+    def _try_claim(self, key):
+        try:
+            return self.store.claim(key, self.owner, self.lease_ttl)
+        except Exception as e:
+            print(f"unable to take thread lease, going ahead without it. {e}")
+            return None
+
+    def _release(self, key):
+        try:
+            self.store.release(key, self.owner)
+        except Exception as e:
+            print(f"unable to release thread lease, it will expire on its own. {e}")
+
+    @contextlib.contextmanager
+    def thread_lock(self, thread_ts):
+        # waits (up to `wait` seconds) while another turn holds the thread, then holds it for this one
+        key = f"thread:{thread_ts}"
+        start = time.monotonic()
+        delay = self.poll
+        held = self._try_claim(key)
+        while held is False and time.monotonic() - start < self.wait:
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_poll)
+            held = self._try_claim(key)
+        record("thread_lock_wait", time.monotonic() - start)
+        if held is False:
+            print(f"waah, thread {thread_ts} stayed busy for {self.wait:.0f}s, answering anyway")
+        try:
+            yield
+        finally:
+            if held:
+                self._release(key)
+
+
+# asyncio flavour: same logic, store calls are awaited and the lease wait doesn't block the loop
+
+class AsyncMemoryStore(MemoryStore):
+    async def claim(self, key, owner, ttl):
+        return super().claim(key, owner, ttl)
+
+    async def release(self, key, owner):
+        super().release(key, owner)
+
+    async def renew(self, key, owner, ttl):
+        return super().renew(key, owner, ttl)
+
+
+class AsyncSupabaseStore(SupabaseStore):
+    async def claim(self, key, owner, ttl):
+        async with aspan("supabase", op=f"{self.function}.rpc"):
+            res = await self._claim_query(key, owner, ttl).execute()
+        if self._sweep_due():
+            try:
+                async with aspan("supabase", op=f"{self.table}.delete"):
+                    await self._sweep_query().execute()
+            except Exception as e:
+                print(f"unable to sweep old leases. {e}")
+        return bool(res.data)
+
+    async def release(self, key, owner):
+        async with aspan("supabase", op=f"{self.table}.delete"):
+            await self._release_query(key, owner).execute()
+
+    async def renew(self, key, owner, ttl):
+        async with aspan("supabase", op=f"{self.table}.update"):
+            res = await self._renew_query(key, owner, ttl).execute()
+        return bool(res.data)
+
+
+class AsyncCoordinator(Coordinator):
+    async def first_delivery(self, event):
+        key = self._event_key(event)
+        if self._seen_before(key):
+            return False
+        if not self.shared:
+            return True
+        try:
+            claimed = await self.store.claim(key, self.owner, self.event_ttl)
+        except Exception as e:
+            print(f"unable to claim event, answering anyway. {e}")
+            return True
+        if not claimed:
+            registry.inc("symphony_duplicate_events_total", where="shared")
+        return claimed
+
+    async def _try_claim(self, key):
+        try:
+            return await self.store.claim(key, self.owner, self.lease_ttl)
+        except Exception as e:
+            print(f"unable to take thread lease, going ahead without it. {e}")
+            return None
+
+    async def _release(self, key):
+        try:
+            await self.store.release(key, self.owner)
+        except Exception as e:
+            print(f"unable to release thread lease, it will expire on its own. {e}")
+
+    @contextlib.asynccontextmanager
+    async def thread_lock(self, thread_ts):
+        key = f"thread:{thread_ts}"
+        start = time.monotonic()
+        delay = self.poll
+        held = await self._try_claim(key)
+        while held is False and time.monotonic() - start < self.wait:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll)
+            held = await self._try_claim(key)
+        record("thread_lock_wait", time.monotonic() - start)
+        if held is False:
+            print(f"waah, thread {thread_ts} stayed busy for {self.wait:.0f}s, answering anyway")
+        try:
+            yield
+        finally:
+            if held:
+                await self._release(key)
+
+
+def create_coordinator(kind, supabase, **kwargs):
+    if kind == "supabase":
+        return Coordinator(SupabaseStore(supabase), **kwargs)
+    return Coordinator(MemoryStore(), **kwargs)
+
+
+def create_async_coordinator(kind, async_supabase, **kwargs):
+    if kind == "supabase":
+        return AsyncCoordinator(AsyncSupabaseStore(async_supabase), **kwargs)
+    return AsyncCoordinator(AsyncMemoryStore(), **kwargs)
@@ -0,0 +1,301 @@
+import os
+import json
+import atexit
+import datetime
+import threading
+from collections import deque
+from cache import TTLCache
+from metrics import registry
+
+
+def utc_now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _parse_ts(value):
+    try:
+        return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except Exception:
+        return None
+
+
+# queues chat_mem rows and inserts them in batches from a background thread.
+# every queued row is journaled to a local file first, so rows that have not made
+# it to the conversation store yet (failed batch, crash, restart) are retried on the next start.
+# a batch the store refuses is retried row by row: a row refused while others go in is bad
+# (not an outage), so it's set aside in the .rejected file next to the journal instead of
+# blocking every row queued behind it.
+
+registry.describe("symphony_chat_mem_rejected_rows_total", "chat_mem rows the store refused on their own, set aside instead of retried.")
+
+class WriteBehindWriter:
+    def __init__(self, store, journal_path="chat_mem_journal.jsonl",
+                 batch_size=50, flush_interval=1.0, max_backoff=60.0):
+        # store: a sync conversation store (store.py), this runs on its own thread
+        self.store = store
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.failures = 0
+        self.flushed_rows = 0
+        self.rejected_rows = 0
+        # the background loop and an explicit flush() (e.g. before handing a thread to another replica) take turns
+        self.flush_lock = threading.Lock()
+        self._load_journal()
+        self.thread = threading.Thread(target=self._loop, name="chat-mem-writer", daemon=True)
+        self.thread.start()
+
+    def _load_journal(self):
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        self.pending.append(json.loads(line))
+                    except Exception as e:
+                        print(f"skipping broken chat_mem journal line. {e}")
+        if self.pending:
+            print(f"found {len(self.pending)} unflushed chat_mem rows from last run, retrying them")
+
+    def _rewrite_journal(self):
+        if not self.journal_path:
+            return
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for row in self.pending:
+                f.write(json.dumps(row) + "\n")
+        os.replace(tmp, self.journal_path)
+
+    def enqueue(self, row):
+        with self.lock:
+            self.pending.append(row)
+            if self.journal_path:
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(row) + "\n")
+            if len(self.pending) >= self.batch_size:
+                self.wake.set()
+
+    def pending_for(self, thread_ts):
+        with self.lock:
+            return [row for row in self.pending if row.get("thread_ts") == thread_ts]
+
+    def flush(self):
+        # inserts everything queued so far; returns False if the store refused a batch
+        with self.flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        while True:
+            with self.lock:
+                batch = self.pending[:self.batch_size]
+            if not batch:
+                return True
+            try:
+                self.store.insert(batch)
+            except Exception as e:
+                self.failures += 1
+                print(f"chat_mem batch insert failed, trying its {len(batch)} rows one by one. {e}")
+                if not self._insert_each(batch):
+                    return False
+            with self.lock:
+                del self.pending[:len(batch)]
+                self.flushed_rows += len(batch)
+                self._rewrite_journal()
+
+    def _insert_each(self, batch):
+        # False when nothing went in (the store is likely down): the batch stays queued
+        refused = []
+        for row in batch:
+            try:
+                self.store.insert([row])
+            except Exception as e:
+                refused.append((row, e))
+        if len(refused) == len(batch):
+            print(f"chat_mem store refused all {len(batch)} rows, keeping them for retry")
+            return False
+        for row, error in refused:
+            self._reject(row, error)
+        return True
+
+    def _reject(self, row, error):
+        self.rejected_rows += 1
+        registry.inc("symphony_chat_mem_rejected_rows_total")
+        print(f"waah, chat_mem refused a row of thread {row.get('thread_ts')}, setting it aside. {error}")
+        if not self.journal_path:
+            return
+        try:
+            with open(self.journal_path + ".rejected", "a", encoding="utf-8") as f:
+                f.write(json.dumps({"row": row, "error": str(error)}) + "\n")
+        except Exception as e:
+            print(f"unable to save the rejected chat_mem row. {e}")
+
+    def _loop(self):
+        backoff = self.flush_interval
+        while not self.stopping.is_set():
+            self.wake.wait(backoff)
+            self.wake.clear()
+            if self.flush():
+                backoff = self.flush_interval
+            else:
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def close(self, timeout=10.0):
+        self.stopping.set()
+        self.wake.set()
+        self.thread.join(timeout)
+        if not self.flush():
+            print(f"could not flush {len(self.pending)} chat_mem rows on shutdown, they stay in {self.journal_path}")
+
+
+# keeps the most recent turns of each thread in memory. a miss loads the latest
+# `window` rows from the conversation store and merges anything still sitting in the
+# writer queue, so the window is right however long the thread is. the queue is read
+# before the store: a row flushed in between then shows up twice (and is deduped)
+# instead of in neither.
+
+class ThreadHistoryCache:
+    def __init__(self, store, writer, window=10, ttl=1800, maxsize=2000):
+        self.store = store
+        self.writer = writer
+        self.window = window
+        self.threads = TTLCache("thread_history", maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+        # on_append(row) sees every stored turn (the recall index hangs off this)
+        self.on_append = None
+
+    def _load(self, thread_ts):
+        pending = self.writer.pending_for(thread_ts)
+        return self._merge(self.store.recent(thread_ts, self.window), pending)
+
+    def _merge(self, data, pending):
+        rows = list(data or [])
+
+        seen = {(r["role"], _parse_ts(r.get("created_at"))) for r in rows}
+        for row in pending:
+            if (row["role"], _parse_ts(row.get("created_at"))) not in seen:
+                rows.append(row)
+        rows.sort(key=lambda r: _parse_ts(r.get("created_at")) or datetime.datetime.max.replace(tzinfo=datetime.timezone.utc))
+
+        turns = deque(maxlen=self.window)
+        for row in rows:
+            # created_at tells the thread summary which turns it already covers
+            turns.append({"role": row["role"], "content": row["content"], "created_at": row.get("created_at")})
+        return turns
+
+    def _turns(self, thread_ts):
+        turns = self.threads.get(thread_ts)
+        if turns is None:
+            turns = self._store(thread_ts, self._load(thread_ts))
+        return turns
+
+    def _store(self, thread_ts, turns):
+        with self.lock:
+            existing = self.threads.get(thread_ts)
+            if existing is not None:
+                return existing
+            self.threads.set(thread_ts, turns)
+            return turns
+
+    def recent(self, thread_ts):
+        turns = self._turns(thread_ts)
+        with self.lock:
+            return list(turns)
+
+    def append(self, row):
+        row = dict(row)
+        row.setdefault("created_at", utc_now_iso())
+        turns = self._turns(row["thread_ts"])
+        with self.lock:
+            turns.append({"role": row["role"], "content": row["content"], "created_at": row["created_at"]})
+        self.writer.enqueue(row)
+        if self.on_append:
+            self.on_append(row)
+
+    def _appended(self, row, data, pending):
+        # window the store sent back with the new row in it; cache it unless a read beat us to it
+        turns = self._merge(data, pending)
+        stored = self._store(row["thread_ts"], turns)
+        if stored is not turns:
+            with self.lock:
+                stored.append({"role": row["role"], "content": row["content"], "created_at": row["created_at"]})
+        if self.on_append:
+            self.on_append(row)
+        with self.lock:
+            return list(stored)
+
+    def append_recent(self, row):
+        # appends a turn and returns the window ending with it. a thread already in memory is a
+        # memory hit (the row goes out through the writer); otherwise the store writes the row
+        # and reads the window back in a single round trip
+        row = dict(row)
+        row.setdefault("created_at", utc_now_iso())
+        if self.threads.get(row["thread_ts"]) is None:
+            try:
+                pending = self.writer.pending_for(row["thread_ts"])
+                return self._appended(row, self.store.append_recent(row, self.window), pending)
+            except Exception as e:
+                print(f"unable to append the turn directly, queueing it instead. {e}")
+        self.append(row)
+        return self.recent(row["thread_ts"])
+
+    def invalidate(self, thread_ts):
+        self.threads.invalidate(thread_ts)
+
+
+# asyncio flavour: misses are loaded with the async store, everything else
+# (the in-memory window, the write-behind writer thread) is shared with the sync one.
+
+class AsyncThreadHistoryCache(ThreadHistoryCache):
+    async def _aturns(self, thread_ts):
+        turns = self.threads.get(thread_ts)
+        if turns is None:
+            pending = self.writer.pending_for(thread_ts)
+            turns = self._store(thread_ts, self._merge(await self.store.recent(thread_ts, self.window), pending))
+        return turns
+
+    async def recent(self, thread_ts):
+        turns = await self._aturns(thread_ts)
+        with self.lock:
+            return list(turns)
+
+    async def append(self, row):
+        row = dict(row)
+        row.setdefault("created_at", utc_now_iso())
+        turns = await self._aturns(row["thread_ts"])
+        with self.lock:
+            turns.append({"role": row["role"], "content": row["content"], "created_at": row["created_at"]})
+        self.writer.enqueue(row)
+        if self.on_append:
+            self.on_append(row)
+
+    async def append_recent(self, row):
+        row = dict(row)
+        row.setdefault("created_at", utc_now_iso())
+        if self.threads.get(row["thread_ts"]) is None:
+            try:
+                pending = self.writer.pending_for(row["thread_ts"])
+                return self._appended(row, await self.store.append_recent(row, self.window), pending)
+            except Exception as e:
+                print(f"unable to append the turn directly, queueing it instead. {e}")
+        await self.append(row)
+        return await self.recent(row["thread_ts"])
+
+
+def create_memory(store, window=10, journal_path="chat_mem_journal.jsonl", batch_size=50, flush_interval=1.0):
+    writer = WriteBehindWriter(store, journal_path=journal_path, batch_size=batch_size, flush_interval=flush_interval)
+    atexit.register(writer.close)
+    return ThreadHistoryCache(store, writer, window=window)
+
+
+def create_async_memory(async_store, store, window=10, journal_path="chat_mem_journal.jsonl", batch_size=50, flush_interval=1.0):
+    # reads go through the async store; the single writer thread keeps using the sync one
+    writer = WriteBehindWriter(store, journal_path=journal_path, batch_size=batch_size, flush_interval=flush_interval)
+    atexit.register(writer.close)
+    return AsyncThreadHistoryCache(async_store, writer, window=window)
@@ -0,0 +1,210 @@
+import time
+import random
+import asyncio
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# one HTTP layer for every outside call the tools make: pooled keep-alive connections,
+# connect/read timeouts per endpoint, jittered retries for calls that are safe to repeat,
+# and a circuit breaker per endpoint so a dead upstream fails fast instead of pinning workers.
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint, retry_in):
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+        super().__init__(f"{endpoint} is unavailable right now (circuit open, retrying in {retry_in:.0f}s)")
+
+
+class Endpoint:
+    def __init__(self, name, connect_timeout=5.0, read_timeout=30.0, retries=0, idempotent=False):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # retries only ever apply to idempotent calls
+        self.retries = retries if idempotent else 0
+        self.idempotent = idempotent
+
+
+class CircuitBreaker:
+    # closed -> open after `threshold` failures in a row; after `reset_timeout` one probe
+    # call is let through (half open) and its result closes or re-opens the circuit.
+    # a probe that never gets a result (cancelled by a tool deadline, or blew up outside
+    # the HTTP client) is released so the next call can probe instead.
+
+    def __init__(self, name, threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_timeout or self.probing:
+                raise CircuitOpenError(self.name, max(0.0, self.reset_timeout - waited))
+            self.probing = True
+            return True
+
+    def release(self):
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"{self.name} is back, closing its circuit")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    print(f"{self.name} failed {self.failures} times, opening its circuit for {self.reset_timeout:g}s")
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0, retry_after=None):
+    # full jitter, but never sooner than a Retry-After the server asked for
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), cap * 4))
+        except ValueError:
+            pass
+    return delay
+
+
+class HttpLayer:
+    def __init__(self, endpoints, pool_size=20, breaker_threshold=5, breaker_reset=30.0):
+        self.endpoints = {e.name: e for e in endpoints}
+        self.breakers = {e.name: CircuitBreaker(e.name, breaker_threshold, breaker_reset) for e in endpoints}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(endpoints) + 4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, endpoint_name, method, url, **kwargs):
+        endpoint = self.endpoints[endpoint_name]
+        breaker = self.breakers[endpoint_name]
+        probe = breaker.before_call()
+        kwargs.setdefault("timeout", (endpoint.connect_timeout, endpoint.read_timeout))
+
+        try:
+            return self._send(endpoint, breaker, method, url, kwargs)
+        except BaseException:
+            if probe:
+                breaker.release()
+            raise
+
+    def _send(self, endpoint, breaker, method, url, kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                if isinstance(e, (requests.ConnectionError, requests.Timeout)) and attempt < endpoint.retries:
+                    time.sleep(backoff_delay(attempt))
+                    attempt += 1
+                    continue
+                breaker.record_failure()
+                raise
+
+            if response.status_code in RETRY_STATUSES and attempt < endpoint.retries:
+                time.sleep(backoff_delay(attempt, retry_after=response.headers.get("Retry-After")))
+                attempt += 1
+                continue
+
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return response
+
+    def get(self, endpoint_name, url, **kwargs):
+        return self.request(endpoint_name, "GET", url, **kwargs)
+
+    def post(self, endpoint_name, url, **kwargs):
+        return self.request(endpoint_name, "POST", url, **kwargs)
+
+    def breaker_states(self):
+        return {name: b.state for name, b in self.breakers.items()}
+
+
+# same policy on top of a shared httpx.AsyncClient for async_app.py
+
+class AsyncHttpLayer(HttpLayer):
+    def __init__(self, client, endpoints, breaker_threshold=5, breaker_reset=30.0):
+        self.endpoints = {e.name: e for e in endpoints}
+        self.breakers = {e.name: CircuitBreaker(e.name, breaker_threshold, breaker_reset) for e in endpoints}
+        self.client = client
+
+    async def request(self, endpoint_name, method, url, **kwargs):
+        endpoint = self.endpoints[endpoint_name]
+        breaker = self.breakers[endpoint_name]
+        probe = breaker.before_call()
+        kwargs.setdefault("timeout", httpx.Timeout(endpoint.read_timeout, connect=endpoint.connect_timeout))
+
+        try:
+            return await self._send(endpoint, breaker, method, url, kwargs)
+        except BaseException:
+            if probe:
+                breaker.release()
+            raise
+
+    async def _send(self, endpoint, breaker, method, url, kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                if isinstance(e, httpx.TransportError) and attempt < endpoint.retries:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    attempt += 1
+                    continue
+                breaker.record_failure()
+                raise
+
+            if response.status_code in RETRY_STATUSES and attempt < endpoint.retries:
+                await asyncio.sleep(backoff_delay(attempt, retry_after=response.headers.get("Retry-After")))
+                attempt += 1
+                continue
+
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return response
+
+    async def get(self, endpoint_name, url, **kwargs):
+        return await self.request(endpoint_name, "GET", url, **kwargs)
+
+    async def post(self, endpoint_name, url, **kwargs):
+        return await self.request(endpoint_name, "POST", url, **kwargs)
+
+
+def unavailable_message(tool_name, error):
+    # what the model sees when a tool's circuit is open, so it answers without it
+    return f"The {tool_name} tool is temporarily unavailable ({error}). Do not call it again for this reply; answer with what you already know and tell the user it can be retried later."
@@ -0,0 +1,388 @@
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import registry, record, span
+
+
+# slow tools (deep research, image generation) run as background jobs instead of inside
+# the reply. submitting a job writes it to a store and returns right away, so the turn
+# can tell the user it's on it and finish. workers run the job out of band, report
+# progress as they go, and the handler posts the result back to the original thread.
+# jobs survive restarts: on startup (and every rescan) unfinished jobs are picked up
+# again, a failed attempt is retried after a delay, and a job whose worker died is taken
+# over once its lease runs out. every progress update renews the lease, so a job only
+# needs it to outlast its slowest step. a handler that has done something it must not
+# repeat (uploading the image) checkpoints it into the job's args, so a retry skips that
+# part. the lease comes from the coordination store, so with several replicas each job
+# still runs in one place at a time.
+#
+# job rows are plain dicts: id, kind, args, channel_id, thread_ts, user_name, model, state
+# (queued -> running -> done / failed), attempts, progress, status_ts, error and the
+# created_at / started_at / finished_at / not_before / updated_at timestamps (epoch seconds).
+
+UNFINISHED = ("queued", "running")
+FIELDS = (
+    "id", "kind", "args", "channel_id", "thread_ts", "user_name", "model", "state", "attempts",
+    "progress", "status_ts", "error", "not_before", "created_at", "started_at", "finished_at", "updated_at",
+)
+
+registry.describe("symphony_jobs_total", "Background jobs by kind and how they ended.")
+
+
+class SqliteJobStore:
+    # one local file, fine for a single bot process (survives restarts)
+    def __init__(self, path="jobs.db"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("pragma journal_mode=wal")
+            self.conn.execute(
+                "create table if not exists bot_jobs ("
+                " id text primary key, kind text not null, args text not null, channel_id text not null,"
+                " thread_ts text not null, user_name text, model text, state text not null,"
+                " attempts integer not null default 0, progress text, status_ts text, error text,"
+                " not_before real, created_at real, started_at real, finished_at real, updated_at real)"
+            )
+            self.conn.execute("create index if not exists bot_jobs_state_idx on bot_jobs (state)")
+            self.conn.commit()
+
+    def _row(self, values):
+        job = dict(zip(FIELDS, values))
+        job["args"] = json.loads(job["args"] or "{}")
+        return job
+
+    def insert(self, job):
+        values = [json.dumps(job["args"]) if f == "args" else job.get(f) for f in FIELDS]
+        with self.lock:
+            self.conn.execute(
+                f"insert into bot_jobs ({', '.join(FIELDS)}) values ({', '.join('?' for _ in FIELDS)})", values
+            )
+            self.conn.commit()
+
+    def update(self, job_id, **fields):
+        values = [json.dumps(v) if k == "args" else v for k, v in fields.items()]
+        with self.lock:
+            self.conn.execute(
+                f"update bot_jobs set {', '.join(f'{k} = ?' for k in fields)} where id = ?",
+                [*values, job_id],
+            )
+            self.conn.commit()
+
+    def unfinished(self):
+        with self.lock:
+            rows = self.conn.execute(
+                f"select {', '.join(FIELDS)} from bot_jobs where state in ({', '.join('?' for _ in UNFINISHED)})"
+                " order by created_at",
+                UNFINISHED,
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+
+class SupabaseJobStore:
+    # shared bot_jobs table (SQL in the README), for several replicas
+    def __init__(self, supabase, table="bot_jobs"):
+        self.supabase = supabase
+        self.table = table
+
+    def insert(self, job):
+        with span("supabase", op=f"{self.table}.insert"):
+            self.supabase.table(self.table).insert({f: job.get(f) for f in FIELDS}).execute()
+
+    def update(self, job_id, **fields):
+        with span("supabase", op=f"{self.table}.update"):
+            self.supabase.table(self.table).update(fields).eq("id", job_id).execute()
+
+    def unfinished(self):
+        with span("supabase", op=f"{self.table}.select"):
+            res = self.supabase.table(self.table) \
+                .select(", ".join(FIELDS)) \
+                .in_("state", list(UNFINISHED)) \
+                .order("created_at") \
+                .execute()
+        return [dict(row) for row in res.data or []]
+
+
+class JobRunner:
+    def __init__(self, store, handlers, coordinator, workers=4, max_attempts=3, retry_delay=30.0,
+                 lease_ttl=600.0, rescan_interval=60.0, on_progress=None, on_failed=None):
+        # handlers: kind -> fn(job, progress) that does the work and posts the result.
+        # on_progress(job, text) / on_failed(job, error) let the app show it in Slack
+        self.store = store
+        self.handlers = handlers
+        self.coordinator = coordinator
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_ttl = lease_ttl
+        self.rescan_interval = rescan_interval
+        self.on_progress = on_progress
+        self.on_failed = on_failed
+        self.active = set()
+        self.lock = threading.Lock()
+        self.pool = self._make_pool(workers)
+        registry.add_collector(self.gauges)
+
+    def _make_pool(self, workers):
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="symphony-job")
+
+    def new_job(self, kind, args, channel_id, thread_ts, **extra):
+        now = time.time()
+        job = {f: None for f in FIELDS}
+        job.update(extra)
+        job.update({
+            "id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "args": args,
+            "channel_id": channel_id,
+            "thread_ts": thread_ts,
+            "state": "queued",
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        return job
+
+    def _take(self, job):
+        # True when this process should start the job now
+        if job["not_before"] and job["not_before"] > time.time():
+            return False
+        with self.lock:
+            if job["id"] in self.active:
+                return False
+            self.active.add(job["id"])
+            return True
+
+    def _finish_attempt(self, job, error):
+        # returns the fields to store after a failed attempt, and whether the job is out of tries
+        if job["attempts"] < self.max_attempts:
+            delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+            print(f"job {job['id']} ({job['kind']}) failed, retrying in {delay:.0f}s. {error}")
+            return {"state": "queued", "error": str(error), "not_before": time.time() + delay}, False
+        print(f"waah, job {job['id']} ({job['kind']}) failed for good. {error}")
+        return {"state": "failed", "error": str(error), "finished_at": time.time()}, True
+
+    def _record(self, job, started, outcome):
+        record("job", time.monotonic() - started, tool=job["kind"], outcome=outcome)
+        registry.inc("symphony_jobs_total", kind=job["kind"], outcome=outcome)
+
+    def submit(self, kind, args, channel_id, thread_ts, **extra):
+        job = self.new_job(kind, args, channel_id, thread_ts, **extra)
+        self.store.insert(job)
+        if self._take(job):
+            self.pool.submit(self._run, job)
+        return job
+
+    def _progress(self, job, text):
+        job["progress"] = text
+        try:
+            self.store.update(job["id"], progress=text, updated_at=time.time())
+        except Exception as e:
+            print(f"unable to save job progress. {e}")
+        try:
+            if not self.coordinator.store.renew(f"job:{job['id']}", self.coordinator.owner, self.lease_ttl):
+                print(f"job {job['id']} lost its lease, another replica may pick it up")
+        except Exception as e:
+            print(f"unable to renew job lease. {e}")
+        if self.on_progress:
+            self.on_progress(job, text)
+
+    def checkpoint(self, job, **args):
+        job["args"].update(args)
+        try:
+            self.store.update(job["id"], args=job["args"], updated_at=time.time())
+        except Exception as e:
+            print(f"unable to save job checkpoint. {e}")
+
+    def _run(self, job):
+        key = f"job:{job['id']}"
+        try:
+            try:
+                # another replica may be running (or have just finished) this one
+                if not self.coordinator.store.claim(key, self.coordinator.owner, self.lease_ttl):
+                    return
+            except Exception as e:
+                print(f"unable to take job lease, running it anyway. {e}")
+            self._attempt(job)
+        finally:
+            with self.lock:
+                self.active.discard(job["id"])
+            try:
+                self.coordinator.store.release(key, self.coordinator.owner)
+            except Exception as e:
+                print(f"unable to release job lease, it will expire on its own. {e}")
+
+    def _attempt(self, job):
+        started = time.monotonic()
+        now = time.time()
+        job.update(state="running", attempts=job["attempts"] + 1, started_at=now, not_before=None)
+        try:
+            record("job_queue_wait", now - job["created_at"], tool=job["kind"])
+            self.store.update(job["id"], state="running", attempts=job["attempts"], started_at=now, not_before=None, updated_at=now)
+            self.handlers[job["kind"]](job, lambda text: self._progress(job, text))
+            self.store.update(job["id"], state="done", error=None, finished_at=time.time(), updated_at=time.time())
+            self._record(job, started, "ok")
+        except Exception as e:
+            fields, final = self._finish_attempt(job, e)
+            job.update(fields)
+            self._record(job, started, "failed" if final else "retry")
+            try:
+                self.store.update(job["id"], updated_at=time.time(), **fields)
+            except Exception as store_error:
+                print(f"unable to save job state. {store_error}")
+            if final and self.on_failed:
+                self.on_failed(job, e)
+
+    def rescan(self):
+        # starts every unfinished job that is due and not already running here
+        try:
+            pending = self.store.unfinished()
+        except Exception as e:
+            print(f"unable to load unfinished jobs. {e}")
+            return 0
+        started = 0
+        for job in pending:
+            if job["kind"] in self.handlers and self._take(job):
+                self.pool.submit(self._run, job)
+                started += 1
+        return started
+
+    def start(self):
+        resumed = self.rescan()
+        if resumed:
+            print(f"picked up {resumed} unfinished background jobs :3")
+        thread = threading.Thread(target=self._loop, name="symphony-job-rescan", daemon=True)
+        thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.rescan_interval)
+            self.rescan()
+
+    def idle(self):
+        with self.lock:
+            return not self.active
+
+    def gauges(self):
+        with self.lock:
+            return [("symphony_jobs_active", {}, len(self.active))]
+
+
+# asyncio flavour: jobs are tasks, handlers are coroutine functions, and the (blocking)
+# store calls run on the default executor so a slow store never stalls the loop
+
+class AsyncJobRunner(JobRunner):
+    def __init__(self, *args, workers=4, **kwargs):
+        self.tasks = set()
+        self.slots = asyncio.Semaphore(workers)
+        super().__init__(*args, workers=workers, **kwargs)
+
+    def _make_pool(self, workers):
+        return None
+
+    async def _store(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: fn(*args, **kwargs))
+
+    def _spawn(self, job):
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def submit(self, kind, args, channel_id, thread_ts, **extra):
+        job = self.new_job(kind, args, channel_id, thread_ts, **extra)
+        await self._store(self.store.insert, job)
+        if self._take(job):
+            self._spawn(job)
+        return job
+
+    async def _progress(self, job, text):
+        job["progress"] = text
+        try:
+            await self._store(self.store.update, job["id"], progress=text, updated_at=time.time())
+        except Exception as e:
+            print(f"unable to save job progress. {e}")
+        try:
+            if not await self.coordinator.store.renew(f"job:{job['id']}", self.coordinator.owner, self.lease_ttl):
+                print(f"job {job['id']} lost its lease, another replica may pick it up")
+        except Exception as e:
+            print(f"unable to renew job lease. {e}")
+        if self.on_progress:
+            await self.on_progress(job, text)
+
+    async def checkpoint(self, job, **args):
+        job["args"].update(args)
+        try:
+            await self._store(self.store.update, job["id"], args=job["args"], updated_at=time.time())
+        except Exception as e:
+            print(f"unable to save job checkpoint. {e}")
+
+    async def _run(self, job):
+        key = f"job:{job['id']}"
+        try:
+            async with self.slots:
+                try:
+                    if not await self.coordinator.store.claim(key, self.coordinator.owner, self.lease_ttl):
+                        return
+                except Exception as e:
+                    print(f"unable to take job lease, running it anyway. {e}")
+                await self._attempt(job)
+        finally:
+            with self.lock:
+                self.active.discard(job["id"])
+            try:
+                await self.coordinator.store.release(key, self.coordinator.owner)
+            except Exception as e:
+                print(f"unable to release job lease, it will expire on its own. {e}")
+
+    async def _attempt(self, job):
+        started = time.monotonic()
+        now = time.time()
+        job.update(state="running", attempts=job["attempts"] + 1, started_at=now, not_before=None)
+        try:
+            record("job_queue_wait", now - job["created_at"], tool=job["kind"])
+            await self._store(self.store.update, job["id"], state="running", attempts=job["attempts"], started_at=now, not_before=None, updated_at=now)
+            await self.handlers[job["kind"]](job, lambda text: self._progress(job, text))
+            await self._store(self.store.update, job["id"], state="done", error=None, finished_at=time.time(), updated_at=time.time())
+            self._record(job, started, "ok")
+        except Exception as e:
+            fields, final = self._finish_attempt(job, e)
+            job.update(fields)
+            self._record(job, started, "failed" if final else "retry")
+            try:
+                await self._store(self.store.update, job["id"], updated_at=time.time(), **fields)
+            except Exception as store_error:
+                print(f"unable to save job state. {store_error}")
+            if final and self.on_failed:
+                await self.on_failed(job, e)
+
+    async def rescan(self):
+        try:
+            pending = await self._store(self.store.unfinished)
+        except Exception as e:
+            print(f"unable to load unfinished jobs. {e}")
+            return 0
+        started = 0
+        for job in pending:
+            if job["kind"] in self.handlers and self._take(job):
+                self._spawn(job)
+                started += 1
+        return started
+
+    async def start(self):
+        resumed = await self.rescan()
+        if resumed:
+            print(f"picked up {resumed} unfinished background jobs :3")
+        self._loop_task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.rescan_interval)
+            await self.rescan()
+
+
+def create_job_store(kind, supabase, path="jobs.db"):
+    if kind == "supabase":
+        return SupabaseJobStore(supabase)
+    return SqliteJobStore(path)
@@ -0,0 +1,95 @@
+import re
+import binascii
+
+
+# pulls generated images straight out of the fields image models put them in
+# (message.images[] on OpenRouter-style providers, image_url content parts, b64_json),
+# instead of stringifying the whole message and regexing megabytes of base64.
+# each payload is decoded from a single slice of the data URL, so at most one
+# transient copy of the base64 text exists next to the decoded bytes.
+
+_B64_RUN = re.compile(r"[A-Za-z0-9+/=]+")
+
+EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+
+
+def _field(obj, name):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    value = getattr(obj, name, None)
+    if value is None:
+        extra = getattr(obj, "model_extra", None) or {}
+        value = extra.get(name)
+    return value
+
+
+def decode_data_url(url, start=0):
+    # returns (bytes, mimetype) for a data:image/...;base64, URL starting at `start`
+    if not url.startswith("data:image/", start):
+        return None
+    comma = url.find(",", start)
+    if comma == -1 or url.rfind(";base64", start, comma) == -1:
+        return None
+    mimetype = url[start + 5:url.find(";", start)]
+    run = _B64_RUN.match(url, comma + 1)
+    if not run:
+        return None
+    try:
+        return binascii.a2b_base64(url[run.start():run.end()]), mimetype
+    except binascii.Error as e:
+        print(f"image payload was not valid base64. {e}")
+        return None
+
+
+def _from_part(part):
+    b64 = _field(part, "b64_json")
+    if b64:
+        try:
+            return binascii.a2b_base64(b64), "image/png"
+        except binascii.Error as e:
+            print(f"image payload was not valid base64. {e}")
+            return None
+    image_url = _field(part, "image_url")
+    url = _field(image_url, "url") if image_url is not None and not isinstance(image_url, str) else image_url
+    if isinstance(url, str):
+        return decode_data_url(url)
+    return None
+
+
+def extract_images(msg_obj):
+    # returns a list of (bytes, mimetype), one per image in the reply
+    found = []
+
+    for part in _field(msg_obj, "images") or []:
+        image = _from_part(part)
+        if image:
+            found.append(image)
+    if found:
+        return found
+
+    content = _field(msg_obj, "content")
+    if isinstance(content, list):
+        for part in content:
+            image = _from_part(part)
+            if image:
+                found.append(image)
+    elif isinstance(content, str):
+        # last resort: data URLs written inline in the text
+        pos = content.find("data:image/")
+        while pos != -1:
+            image = decode_data_url(content, pos)
+            if image:
+                found.append(image)
+            pos = content.find("data:image/", pos + 11)
+    return found
+
+
+def image_filename(n, mimetype):
+    return f"GenAIGeneratedIMG-{n}.{EXTENSIONS.get(mimetype, 'png')}" if n else f"GenAIGeneratedIMG.{EXTENSIONS.get(mimetype, 'png')}"
@@ -0,0 +1,329 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# per-stage timing for every request. code wraps a stage in `with span("moderation"):`
+# (or `async with aspan(...)`), which feeds a histogram and, when a request trace is
+# active, that request's own breakdown (used for the optional footer). everything is
+# exported in Prometheus text format from a local endpoint and/or a periodically
+# rewritten file.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        # rough quantile from bucket bounds, good enough for a bench summary
+        if not self.total:
+            return 0.0
+        target = q * self.total
+        for i, bound in enumerate(self.buckets):
+            if self.counts[i] >= target:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []
+        self.sinks = []
+        self.help = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+        for sink in self.sinks:
+            sink(name, value, labels)
+
+    def add_sink(self, fn):
+        # fn(name, value, labels) sees every raw observation (the bench uses it for exact percentiles)
+        self.sinks.append(fn)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add_collector(self, fn):
+        # fn() -> [(metric_name, {labels}, value)], read at export time (gauges)
+        self.collectors.append(fn)
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def histogram(self, name, **labels):
+        with self.lock:
+            return self.histograms.get((name, _label_key(labels)))
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        seen = set()
+        for (name, key), hist in histograms:
+            if name not in seen:
+                seen.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {hist.total}")
+            lines.append(f"{name}_sum{_format_labels(key)} {hist.sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(key)} {hist.total}")
+
+        for (name, key), value in counters:
+            if name not in seen:
+                seen.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"metrics collector failed. {e}")
+                continue
+            for name, labels, value in samples:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{_format_labels(_label_key(labels))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+registry.describe("symphony_stage_seconds", "Time spent in each stage of handling a message.")
+registry.describe("symphony_request_seconds", "End to end time to answer a message.")
+registry.describe("symphony_llm_tokens_total", "Tokens reported by the LLM provider.")
+
+
+class Trace:
+    # one per handled message; collects (stage, seconds) from every thread/task working on it
+    def __init__(self):
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.stages = []
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages.append((stage, seconds))
+
+    def breakdown(self):
+        totals = {}
+        with self.lock:
+            for stage, seconds in self.stages:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def summary(self, limit=6):
+        totals = sorted(self.breakdown().items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return " · ".join(f"{stage} {seconds:.2f}s" for stage, seconds in totals)
+
+
+current_trace = contextvars.ContextVar("symphony_trace", default=None)
+
+
+def start_trace():
+    trace = Trace()
+    current_trace.set(trace)
+    return trace
+
+
+def bind(fn):
+    # thread pools don't carry contextvars over, so hand the caller's trace to the worker
+    trace = current_trace.get()
+
+    def run(*args, **kwargs):
+        token = current_trace.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_trace.reset(token)
+    return run
+
+
+def record(stage, seconds, **labels):
+    registry.observe("symphony_stage_seconds", seconds, stage=stage, **labels)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage, **labels):
+    start = time.monotonic()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        record(stage, time.monotonic() - start, outcome=outcome, **labels)
+
+
+class aspan:
+    # `async with aspan("llm", model=m):` -- same as span for coroutines
+    def __init__(self, stage, **labels):
+        self.stage = stage
+        self.labels = labels
+
+    async def __aenter__(self):
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # a cancelled call (e.g. the losing side of a hedged request) isn't an error
+        outcome = "cancelled" if exc_type is asyncio.CancelledError else "error" if exc_type else "ok"
+        record(self.stage, time.monotonic() - self.start, outcome=outcome, **self.labels)
+        return False
+
+
+def record_usage(model, usage):
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", None) or 0
+    completion = getattr(usage, "completion_tokens", None) or 0
+    registry.inc("symphony_llm_tokens_total", prompt, model=model, kind="prompt")
+    registry.inc("symphony_llm_tokens_total", completion, model=model, kind="completion")
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached:
+        registry.inc("symphony_llm_tokens_total", cached, model=model, kind="cached_prompt")
+
+
+class TracedWebClient:
+    # wraps a Slack WebClient so every API method call becomes a slack.<method> span
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        def call(*args, **kwargs):
+            with span("slack", method=name):
+                return attr(*args, **kwargs)
+        return call
+
+
+class AsyncTracedWebClient(TracedWebClient):
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        async def call(*args, **kwargs):
+            async with aspan("slack", method=name):
+                return await attr(*args, **kwargs)
+        return call
+
+
+# other GET endpoints served next to /metrics: path -> fn() returning (status, content type, body)
+routes = {}
+
+
+def add_route(path, fn):
+    routes[path] = fn
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path in routes:
+            status, content_type, body = routes[path]()
+        elif path in ("/metrics", "/"):
+            status, content_type, body = 200, "text/plain; version=0.0.4", registry.render()
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1", path="/metrics"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"{path.strip('/')} on http://{host}:{port}{path}")
+    return server
+
+
+def write_periodically(path, interval=15.0):
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                tmp = path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(registry.render())
+                os.replace(tmp, path)
+            except Exception as e:
+                print(f"unable to write metrics file. {e}")
+    threading.Thread(target=loop, name="metrics-file", daemon=True).start()
+
+
+def start_exporters(port=0, path=None, interval=15.0):
+    if port:
+        serve(port)
+    if path:
+        write_periodically(path, interval)
@@ -0,0 +1,333 @@
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import linecache
+import traceback
+import tracemalloc
+from metrics import registry
+
+
+# on-demand profiling of slow replies. an admin runs `/symphony-profile 3` (or the bot starts
+# with PROFILE_NEXT=3) and the next 3 turns are profiled, one at a time:
+#   cpu     "sample": every thread's stack every `interval` seconds, so the prefetch pool, tool
+#           workers and the event loop are all covered (wall time; only stacks that are in our
+#           code, and not parked on a lock or queue, count). "cprofile": cProfile on the thread
+#           running the turn, exact call counts but nothing that happens on other threads
+#   memory  tracemalloc while the turn runs, with a snapshot whenever traced memory hits a new high.
+#           it makes allocation-heavy code several times slower, which skews the cpu numbers
+#           towards it; `/symphony-profile 3 nomemory` leaves it out
+#   stacks  every thread's stack, each `stack_after` seconds the turn is still running
+# the reports go to <directory>/<thread_ts>-<n>/ and a few lines of hotspots go to the thread.
+
+registry.describe("symphony_profiles_total", "Turns profiled on demand.")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODES = ("sample", "cprofile")
+# leaf frames of a thread that is waiting for work, not doing any
+IDLE = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("socketserver.py", "serve_forever"),
+}
+# builtins cProfile times that are waits (locks, sleeps, polling sockets)
+WAITS = ("acquire' of '_thread", "time.sleep", "'poll' of", "'select' of", "'control' of")
+MAX_DEPTH = 64
+MAX_SNAPSHOTS = 8
+MAX_STACK_DUMPS = 5
+
+
+def _where(filename):
+    # repo files relative to the repo, everything else from its package directory on
+    if filename.startswith(ROOT + os.sep):
+        return os.path.relpath(filename, ROOT)
+    parts = filename.replace("\\", "/").split("/")
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            return "/".join(parts[parts.index(marker) + 1:])
+    return "/".join(parts[-2:])
+
+
+def _ours(filename):
+    return filename.startswith(ROOT + os.sep) and "site-packages" not in filename and filename != __file__
+
+
+def _mib(size):
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+
+class TurnProfile:
+    def __init__(self, profiler, thread_ts, mode, memory=True):
+        self.profiler = profiler
+        self.thread_ts = thread_ts
+        self.mode = mode
+        self.memory = memory
+        self.started = time.monotonic()
+        self.wall = 0.0
+        self.samples = 0
+        self.idle = 0
+        self.other = 0
+        # leaf frame -> samples, innermost repo frame -> samples, folded stack -> samples
+        self.leaves = {}
+        self.own = {}
+        self.folded = {}
+        self.snapshots = 0
+        self.peak_snapshot = None
+        self.final_snapshot = None
+        self.peak = 0
+        self.stack_dumps = []
+        self.cprofile = None
+        self.started_tracing = False
+        self.stopping = threading.Event()
+        self.watcher = None
+        self.turn_thread = threading.get_ident()
+        self.directory = None
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.profiler.trace_frames)
+            self.started_tracing = True
+        if self.mode == "cprofile":
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self.watcher = threading.Thread(target=self._watch, name="symphony-profiler", daemon=True)
+        self.watcher.start()
+
+    def stop(self):
+        # cheap part only (the turn's thread is still waiting); report() does the formatting
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.wall = time.monotonic() - self.started
+        self.stopping.set()
+        self.watcher.join()
+        if self.memory and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.final_snapshot = self._snapshot()
+            if self.started_tracing:
+                tracemalloc.stop()
+
+    def _snapshot(self):
+        # filtering a snapshot walks every trace in python; the report does it on far fewer rows
+        return tracemalloc.take_snapshot()
+
+    def _watch(self):
+        interval = self.profiler.interval
+        next_dump = self.started + self.profiler.stack_after
+        snapshot_at = 1024 * 1024
+        while not self.stopping.wait(interval):
+            if self.mode == "sample":
+                self._sample()
+            current, peak = tracemalloc.get_traced_memory() if self.memory else (0, 0)
+            self.peak = max(self.peak, peak)
+            # the high water mark is where big buffers (base64 images, scraped pages) show up
+            if self.memory and current >= snapshot_at and self.snapshots < MAX_SNAPSHOTS:
+                self.peak_snapshot = self._snapshot()
+                self.snapshots += 1
+                snapshot_at = current * 1.25
+            if time.monotonic() >= next_dump and len(self.stack_dumps) < MAX_STACK_DUMPS:
+                self.stack_dumps.append(self._dump_stacks())
+                next_dump += self.profiler.stack_after
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+                frame = frame.f_back
+            if not stack:
+                continue
+            leaf_file, leaf_line, leaf_name = stack[0]
+            if (os.path.basename(leaf_file), leaf_name) in IDLE:
+                self.idle += 1
+                continue
+            own = next((f"{_where(f)}:{line} {name}" for f, line, name in stack if _ours(f)), None)
+            if own is None:
+                # not running any of our code: slack's socket threads, a server waiting on keep-alive, ...
+                self.other += 1
+                continue
+            self.samples += 1
+            self.own[own] = self.own.get(own, 0) + 1
+            leaf = f"{_where(leaf_file)}:{leaf_line} {leaf_name}"
+            self.leaves[leaf] = self.leaves.get(leaf, 0) + 1
+            folded = ";".join([names.get(ident, str(ident))] + [f"{name} ({_where(f)}:{line})" for f, line, name in reversed(stack)])
+            self.folded[folded] = self.folded.get(folded, 0) + 1
+
+    def _dump_stacks(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        lines = [f"--- {time.monotonic() - self.started:.1f}s into the turn ---"]
+        for ident, frame in sys._current_frames().items():
+            if ident == threading.get_ident():
+                continue
+            marker = " (this turn)" if ident == self.turn_thread else ""
+            lines.append(f"\nthread {names.get(ident, ident)}{marker}:")
+            lines.append("".join(traceback.format_stack(frame)).rstrip())
+        return "\n".join(lines)
+
+    def _top(self, counts, limit):
+        total = self.samples or 1
+        return [(key, count, 100.0 * count / total) for key, count in sorted(counts.items(), key=lambda kv: -kv[1])[:limit]]
+
+    def _cprofile_top(self, limit, sort="tottime"):
+        stats = pstats.Stats(self.cprofile)
+        rows = []
+        for (filename, line, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+            # waiting isn't a hotspot, and neither is the profiler itself
+            if (os.path.basename(filename), name) in IDLE or any(word in name for word in WAITS):
+                continue
+            if filename in (__file__, tracemalloc.__file__, linecache.__file__) or "_tracemalloc" in name:
+                continue
+            rows.append((f"{_where(filename)}:{line} {name}", nc, tt, ct))
+        rows.sort(key=lambda row: -row[2 if sort == "tottime" else 3])
+        return rows[:limit]
+
+    def _memory_top(self, snapshot, limit):
+        if snapshot is None:
+            return []
+        # the profiler's own allocations (and the source lines for its stack dumps) aren't the turn's
+        mine = (tracemalloc.__file__, __file__, linecache.__file__)
+        stats = [stat for stat in snapshot.statistics("lineno") if stat.traceback[0].filename not in mine]
+        return [(f"{_where(stat.traceback[0].filename)}:{stat.traceback[0].lineno}", stat.size, stat.count) for stat in stats[:limit]]
+
+    def report(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        if self.mode == "cprofile":
+            self.cprofile.dump_stats(os.path.join(directory, "cpu.pstats"))
+            out = io.StringIO()
+            stats = pstats.Stats(self.cprofile, stream=out)
+            stats.sort_stats("tottime").print_stats(40)
+            stats.sort_stats("cumulative").print_stats(40)
+            with open(os.path.join(directory, "cpu.txt"), "w", encoding="utf-8") as f:
+                f.write(out.getvalue())
+        else:
+            with open(os.path.join(directory, "cpu.txt"), "w", encoding="utf-8") as f:
+                f.write(
+                    f"{self.samples} samples in symphony code ({self.idle} idle, {self.other} elsewhere) "
+                    f"over {self.wall:.2f}s, every {self.profiler.interval * 1000:.0f}ms\n"
+                )
+                f.write("\ninnermost symphony frame (where in our code the time goes):\n")
+                for key, count, share in self._top(self.own, 40):
+                    f.write(f"{share:6.1f}% {count:6d}  {key}\n")
+                f.write("\nleaf frame (what was actually running):\n")
+                for key, count, share in self._top(self.leaves, 40):
+                    f.write(f"{share:6.1f}% {count:6d}  {key}\n")
+            # folded stacks, for flamegraph.pl / speedscope
+            with open(os.path.join(directory, "cpu.folded"), "w", encoding="utf-8") as f:
+                for stack, count in sorted(self.folded.items()):
+                    f.write(f"{stack} {count}\n")
+
+        with open(os.path.join(directory, "memory.txt"), "w", encoding="utf-8") as f:
+            if not self.memory:
+                f.write("memory tracing was off for this profile\n")
+            else:
+                f.write(f"peak traced memory {_mib(self.peak)}\n")
+            for title, snapshot in (("at the high water mark", self.peak_snapshot), ("still allocated when the turn ended", self.final_snapshot)):
+                f.write(f"\n{title}:\n")
+                for where, size, count in self._memory_top(snapshot, 30):
+                    f.write(f"{_mib(size):>12} {count:8d} blocks  {where}\n")
+
+        with open(os.path.join(directory, "stacks.txt"), "w", encoding="utf-8") as f:
+            if self.stack_dumps:
+                f.write("\n\n".join(self.stack_dumps) + "\n")
+            else:
+                f.write(f"the turn took {self.wall:.2f}s, done before the first dump at {self.profiler.stack_after:g}s\n")
+        return self.summary(directory)
+
+    def summary(self, directory, limit=5):
+        what = self.mode + (" + memory" if self.memory else "")
+        lines = [f":mag: Profiled this reply ({what}, {self.wall:.1f}s wall). Report: `{directory}`"]
+        if self.mode == "cprofile":
+            lines.append("Hotspots (own time):")
+            lines += [f"• `{key}` {tt:.3f}s in {calls} calls" for key, calls, tt, ct in self._cprofile_top(limit)]
+        else:
+            if self.samples:
+                lines.append(f"Hotspots ({self.samples} samples, innermost bot frame):")
+                lines += [f"• `{key}` {share:.0f}%" for key, count, share in self._top(self.own, limit)]
+                lines.append("Leaf frames:")
+                lines += [f"• `{key}` {share:.0f}%" for key, count, share in self._top(self.leaves, 3)]
+            else:
+                lines.append("No samples caught symphony code running.")
+        if self.memory:
+            memory = self._memory_top(self.peak_snapshot or self.final_snapshot, 3)
+            lines.append(
+                f"Memory: peak {_mib(self.peak)}" + (", biggest: " + ", ".join(f"`{where}` {_mib(size)}" for where, size, count in memory) if memory else "")
+            )
+        if self.stack_dumps:
+            lines.append(f"{len(self.stack_dumps)} stack dumps in stacks.txt")
+        return "\n".join(lines)
+
+
+class Profiler:
+    def __init__(self, directory="profiles", mode="sample", memory=True, interval=0.01, stack_after=3.0, trace_frames=1):
+        # trace_frames: frames tracemalloc keeps per allocation; 1 is all the per-line statistics
+        # need, and every extra frame makes allocation-heavy code (imports, JSON) slower still
+        self.directory = directory
+        self.mode = mode
+        self.interval = interval
+        self.stack_after = stack_after
+        self.trace_frames = trace_frames
+        self.remaining = 0
+        self.channel_id = None
+        self.armed_mode = mode
+        self.memory = memory
+        self.armed_memory = memory
+        self.active = None
+        self.taken = 0
+        self.lock = threading.Lock()
+
+    def arm(self, count, mode=None, memory=None, channel_id=None):
+        # profile the next `count` turns (in channel_id only, when given); 0 disarms
+        with self.lock:
+            self.remaining = max(0, count)
+            self.armed_mode = mode or self.mode
+            self.armed_memory = self.memory if memory is None else memory
+            self.channel_id = channel_id
+        if count:
+            print(f"profiling the next {count} replies ({self.describe()}) :3")
+
+    def describe(self):
+        return self.armed_mode + (" + memory" if self.armed_memory else "")
+
+    def status(self):
+        with self.lock:
+            return {"remaining": self.remaining, "mode": self.describe(), "channel_id": self.channel_id, "running": self.active is not None}
+
+    def begin(self, thread_ts, channel_id=None):
+        # None unless armed; one profile at a time, a turn that starts meanwhile just isn't profiled
+        if not self.remaining:
+            return None
+        with self.lock:
+            if not self.remaining or self.active is not None:
+                return None
+            if self.channel_id and channel_id != self.channel_id:
+                return None
+            self.remaining -= 1
+            self.taken += 1
+            profile = self.active = TurnProfile(self, thread_ts, self.armed_mode, self.armed_memory)
+            profile.directory = os.path.join(self.directory, f"{thread_ts}-{self.taken}")
+        profile.start()
+        registry.inc("symphony_profiles_total", mode=profile.mode)
+        return profile
+
+    def end(self, profile):
+        # on the thread that called begin() (cProfile only sees that thread)
+        try:
+            profile.stop()
+        finally:
+            with self.lock:
+                self.active = None
+
+    def report(self, profile):
+        # writes the report files, returns the summary for the thread; slow-ish, keep it off the loop
+        summary = profile.report(profile.directory)
+        print(f"profile of {profile.thread_ts} written to {profile.directory}")
+        return summary
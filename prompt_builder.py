@@ -0,0 +1,108 @@
+import json
+import threading
+from metrics import registry
+from tokens import count_tokens, message_tokens, messages_tokens
+from vision import attach_images
+
+
+# assembles the messages for a reply so that providers with prompt/prefix caching can
+# actually hit: the system instructions and tool schemas form a prefix that is built once
+# per model and is byte-for-byte the same on every call. then the history (append-only
+# within a thread), and only at the very end, on the message being answered, the bits
+# that change: the thread summary, recalled snippets from other threads, a finished
+# job's output, who is asking and the current time.
+# every build reports how many prompt tokens each section took.
+
+SECTIONS = ("system", "tools", "history", "summary", "recall", "result", "context")
+
+NOTES_HEADER = "[Context for this turn, not written by the user]\n"
+NOTES_FOOTER = "\n[End of context]\n\n"
+
+registry.describe("symphony_prompt_tokens_total", "Prompt tokens sent, by section (estimated locally).")
+
+
+class Prompt:
+    def __init__(self, model, messages, tools, sections):
+        self.model = model
+        self.messages = messages
+        self.tools = tools
+        self.sections = sections
+
+    def prefix_tokens(self):
+        return self.sections["system"] + self.sections["tools"]
+
+    def total_tokens(self):
+        return sum(self.sections.values())
+
+
+class PromptBuilder:
+    def __init__(self, instructions, tools, context, summary=None, recall=None):
+        # instructions: str, or fn(model) -> str when a model needs its own wording
+        # context: fn(**volatile) -> str, summary: fn(summary) -> str, recall: fn(snippets) -> str
+        self.instructions = instructions
+        self.tools = tools
+        self.context = context
+        self.summary = summary
+        self.recall = recall
+        self.prefixes = {}
+        self.lock = threading.Lock()
+
+    def prefix(self, model):
+        # (system message, tool schemas, their token counts), frozen on first use
+        with self.lock:
+            cached = self.prefixes.get(model)
+            if cached is not None:
+                return cached
+            text = self.instructions(model) if callable(self.instructions) else self.instructions
+            system = {"role": "system", "content": text}
+            # a private deep copy so nothing can mutate the schemas between calls
+            tools = json.loads(json.dumps(self.tools))
+            cached = self.prefixes[model] = (system, tools, message_tokens(system), count_tokens(tools))
+            return cached
+
+    def build(self, model, history, summary=None, images=None, recalled=None, result=None, **volatile):
+        system, tools, system_tokens, tool_tokens = self.prefix(model)
+        msgs = [system]
+        sections = dict.fromkeys(SECTIONS, 0)
+        sections["system"] = system_tokens
+        sections["tools"] = tool_tokens
+
+        turns = [{"role": row["role"], "content": row["content"]} for row in history]
+        attach_images(turns, images)
+        sections["history"] = messages_tokens(turns)
+        msgs.extend(turns)
+
+        # everything after the history rides along on the newest user message instead of
+        # being extra system messages; some chat templates reject or drop a system message
+        # that isn't the first one
+        notes = []
+        if summary and self.summary:
+            notes.append(("summary", self.summary(summary)))
+        if recalled and self.recall:
+            notes.append(("recall", self.recall(recalled)))
+        if result:
+            notes.append(("result", result))
+        if volatile:
+            notes.append(("context", self.context(**volatile)))
+        for section, text in notes:
+            sections[section] = count_tokens(text)
+        if notes:
+            block = NOTES_HEADER + "\n\n".join(text for _, text in notes) + NOTES_FOOTER
+            _prepend(msgs, block)
+
+        for section, count in sections.items():
+            if count:
+                registry.inc("symphony_prompt_tokens_total", count, model=model, section=section)
+        return Prompt(model, msgs, tools, sections)
+
+
+def _prepend(msgs, block):
+    # onto the newest user message when it is the last one, otherwise (a background job
+    # answering after the bot's own reply) as a user message of its own
+    last = msgs[-1]
+    if last["role"] != "user":
+        msgs.append({"role": "user", "content": block.rstrip()})
+    elif isinstance(last["content"], list):
+        last["content"] = [{"type": "text", "text": block}] + last["content"]
+    else:
+        last["content"] = block + (last["content"] or "")
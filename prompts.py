@@ -0,0 +1,276 @@
+from config import IMGGEN_MODEL
+
+
+tools = [
+    {
+        "type": "function",
+        "function" : {
+            "name": "web_search",
+            "description": "Search the world wide web for information.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                            "description": "The search query.",
+                },
+                    "fresh": {
+                        "type": "boolean",
+                        "description": "Set to true only when the user explicitly wants up-to-the-minute results. Skips cached results.",
+                    },
+            },
+            "required": ["query"],
+           }
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "image_generate",
+            "description": "Generates an image with Nano Banana based on a detailed text description.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "prompt": {
+                        "type": "string",
+                        "description": "A prompt for the image.",
+                    },
+                },
+                "required": ["prompt"],
+            }
+            
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "deep_research",
+            "description": "Perform a deep, comprehensive research on a topic. Use this for complex queries, report generation, or when a simple web search is insufficient.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "prompt": {
+                        "type": "string",
+                        "description": "A query to search deeply.",
+                    },
+                    "fresh": {
+                        "type": "boolean",
+                        "description": "Set to true only when the user explicitly wants up-to-the-minute results. Skips cached results.",
+                    },
+                },
+                "required": ["prompt"],
+            }
+            
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "url_scrape",
+            "description": "Scrape content from a specific URL using Linkup. Use this when a user provides a specific link they want you to read.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "url": {
+                        "type": "string",
+                        "description": "The URL to scrape.",
+                    },
+                    "fresh": {
+                        "type": "boolean",
+                        "description": "Set to true only when the user explicitly wants up-to-the-minute results. Skips cached results.",
+                    },
+                },
+                "required": ["url"],
+            }
+        },
+    }
+]
+
+
+# never put anything per-request in here: this text (and the tool list above) is the
+# cacheable prefix of every prompt. who is asking and the time go in turn_context().
+SYSTEM_INSTRUCTIONS = """You are Symphony, a helpful and harmless AI assistant chatting with people on Slack.
+The last system message of the conversation tells you who you are talking to and the current time.
+
+You have access to: `web_search`, `deep_research`, `image_generate`, and `url_scrape`.
+
+### Tool Usage & Routing
+1. **web_search**: Use for current events, facts, or quick info.
+   - **Crucial:** If a query appears strange, vague, or ambiguous, you must NOT refuse or ask for clarification. Execute the search immediately using the user's input to find the most likely intent.
+2. **deep_research**: Use for complex topics, market analysis, or when the user explicitly asks for a "deep dive."
+3. **url_scrape**: Use ONLY when the user provides a specific URL to read or summarize.
+4. **image_generate**: Use when the user asks to create visual content.
+
+### Operational Constraints
+- **Deep Research Limit**: When using `deep_research`, your final output **MUST be under 3000 characters**. This is a strict Slack platform requirement. Prioritize concise, high-density information over length.
+- **Vague Inputs**: Never hallucinate an answer for a vague query; use `web_search` to ground your response in reality.
+
+### Image Generation Protocols
+When using `image_generate`, you must act as a prompt engineer. Never pass a short user prompt directly to the tool.
+- **Rewrite**: Expand vague requests (e.g., "a dog") into high-fidelity descriptions.
+- **Include**: Artistic medium (e.g., "oil painting," "Unreal Engine 5 render"), lighting (e.g., "cinematic," "golden hour"), composition, and mood.
+- **Example**: "draw a car" → "A sleek matte black sports car drifting on a neon-lit cyber city street, heavy rain reflections, 8k resolution, photorealistic, cinematic lighting."""
+
+
+def turn_context(user_name, current_time):
+    return f"""You are engaging with {user_name}.
+Current time: {current_time}"""
+
+
+def tool_status_text(function_name):
+    if function_name == "web_search":
+        return "I am currently searching the web for your query. Please wait!"
+    elif function_name == "url_scrape":
+        return "I'm currently scraping and searching the URL."
+    elif function_name == "deep_research":
+        return "I'm currenly deep researching on the topic you requested. This might take a few minutes."
+    elif function_name == "image_generate":
+        return f"I am currently using {IMGGEN_MODEL} to generate your image. Please wait!"
+    return None
+
+
+def tools_status_text(function_names):
+    # what the reply message says while a round of tools runs, one line per distinct tool
+    lines = [tool_status_text(name) for name in dict.fromkeys(function_names)]
+    return "\n".join(line for line in lines if line) or "Working on it..."
+
+
+SUMMARY_INSTRUCTIONS = """You keep a running summary of a Slack thread between a user and Symphony, an AI assistant.
+You get the summary so far (may be empty) and the next turns of the conversation. Return the updated summary only.
+- Keep facts, names, numbers, decisions, open questions and anything the user asked to be remembered.
+- For long answers (research, scraped pages) keep the conclusions and key sources, not the full text.
+- Write compact bullet points, no preamble. Stay under 400 words."""
+
+
+def summary_request(previous, turns, max_chars=4000):
+    # turns that don't fit the budget anymore get folded into the existing summary
+    transcript = "\n\n".join(
+        f"{t['role']}: {t['content'][:max_chars]}" + (" [...]" if len(t["content"]) > max_chars else "")
+        for t in turns if isinstance(t.get("content"), str)
+    )
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"Summary so far:\n{previous or '(none)'}\n\nNext turns:\n{transcript}"},
+    ]
+
+
+def summary_context(summary):
+    return f"Summary of the earlier part of this thread (older messages are not shown):\n{summary}"
+
+
+def recall_context(snippets):
+    lines = []
+    for s in snippets:
+        who = "you" if s["role"] == "assistant" else "user"
+        when = (s.get("created_at") or "")[:10]
+        lines.append(f"- ({who}, {when}) {s['text']}" if when else f"- ({who}) {s['text']}")
+    return ("Possibly relevant bits from earlier conversations in this channel (not this thread). "
+            "They may be outdated; only use them if they actually help:\n" + "\n".join(lines))
+
+
+def job_started_text(kind, job_id):
+    # what the model gets back instead of the tool output when a slow tool runs in the background
+    what = "The image is being generated" if kind == "image_generate" else "The deep research is running"
+    return (f"{what} as background job {job_id}. The result will be posted in this thread by itself when it's ready "
+            "(usually within a few minutes). Tell the user it's on its way; don't make up any results.")
+
+
+def image_ready_text(count, prompt):
+    # what the image job's status message turns into once the image is in the thread
+    return f"Here {'are your images' if count > 1 else 'is your image'} for \"{prompt}\" :3"
+
+
+def job_result_context(kind, args, output):
+    topic = args.get("prompt") or ""
+    return (f"The background {kind} job you started earlier for \"{topic}\" has finished. Its output:\n\n{output}\n\n"
+            "Write your reply to the user's request from it. Keep it under 3000 characters.")
+
+
+BUSY_TEXT = "I'm a little swamped right now and can't take on more questions. Please try again in a minute! :pleading_face:"
+
+PROFILE_USAGE = "Usage: `/symphony-profile 3` profiles the next 3 replies in this channel (at most 20). Add `sample` or `cprofile` to pick the profiler and `memory` or `nomemory` to trace allocations or not; `/symphony-profile off` stops."
+
+
+def moderation_refusal(result):
+    # text to send back when the moderation endpoint flags a message, None when it is fine
+    if not result.flagged:
+        return None
+    categories = result.categories
+    if categories.self_harm or categories.self_harm_instructions or categories.self_harm_intent:
+        return f"I am unable to fufill your request. It looks like you're going through a hard time. Please check out this resource. https://hackclub.enterprise.slack.com/docs/T0266FRGM/F08HU1DD1AP. Remember, you are not alone. :ohneheart:"
+    return f"I cannot fulfill this request because it violates my content moderation policies."
+
+
+def reply_blocks(text, footer):
+    return [
+		{
+			"type": "section",
+			"text": {
+				"type": "mrkdwn",
+				"text": f"{text}"
+			}
+		},
+		{
+			"type": "divider"
+		},
+		{
+			"type": "section",
+			"text": {
+				"type": "plain_text",
+				"text": footer,
+				"emoji": True
+			}
+		}
+	]
+
+
+HELP_BLOCKS = [
+		{
+			"type": "section",
+			"text": {
+				"type": "plain_text",
+				"text": "Hi! My name is Symphony! Here is some things I can assist you with! :agahi:",
+				"emoji": True
+			}
+		},
+		{
+			"type": "section",
+			"text": {
+				"type": "plain_text",
+				"text": "1. Chat: Just mention me to talk.",
+				"emoji": True
+			}
+		},
+		{
+			"type": "section",
+			"text": {
+				"type": "plain_text",
+				"text": "2. Search and Deep Research: I can search the web and do deep research for more information",
+				"emoji": True
+			}
+		},
+		{
+			"type": "section",
+			"text": {
+				"type": "plain_text",
+				"text": "3. Generate Images: I can generate images you request with ",
+				"emoji": True
+			}
+		},
+        {
+			"type": "section",
+			"text": {
+				"type": "plain_text",
+				"text": "4. URL Scraping: I can search specific URLs for more information. ",
+				"emoji": True
+			}
+		},
+		{
+			"type": "section",
+			"text": {
+				"type": "plain_text",
+				"text": "5. Vision: I can see images. Upload an image and ask me about it.",
+				"emoji": True
+			}
+		}
+	]
@@ -0,0 +1,413 @@
+import os
+import re
+import json
+import time
+import atexit
+import asyncio
+import threading
+from cache import TTLCache
+from metrics import registry, span, aspan
+from tokens import count_tokens
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional (`pip install .[recall]`); without it there is no recall and nothing gets embedded
+    np = None
+
+
+# cross-thread memory. every chat_mem row is also embedded (in the background, in batches)
+# into a small per-channel vector index: unit-length float32 rows in one numpy array that
+# grows in place, saved to RECALL_PATH so it survives restarts. on startup (or when a
+# channel is first seen) rows written since the saved copy are read back from chat_mem and
+# embedded, so replicas and restarts catch up incrementally.
+#
+# a reply embeds the incoming message (alongside the other prefetches), takes the top-k
+# closest snippets from the channel, drops the ones already in the prompt's history and
+# injects what fits in a small token budget, instead of replaying raw history from old threads.
+
+registry.describe("symphony_recall_total", "Recall lookups and whether they found anything worth injecting.")
+registry.describe("symphony_recall_indexed_total", "Chat snippets embedded into the recall index.")
+
+
+def chunk_text(text, size=1200, limit=4):
+    # long answers (research dumps) become a few paragraph-aligned chunks, the rest is dropped
+    text = (text or "").strip()
+    if len(text) <= size:
+        return [text] if text else []
+    chunks, current = [], ""
+    for part in re.split(r"\n\s*\n", text):
+        while len(part) > size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(part[:size])
+            part = part[size:]
+        if current and len(current) + len(part) + 2 > size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{part}" if current else part
+    if current:
+        chunks.append(current)
+    return chunks[:limit]
+
+
+def _safe_name(scope):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", scope)
+
+
+class VectorIndex:
+    # one channel's snippets. meta[i] describes vectors[i]; rows past max_rows drop the oldest
+    def __init__(self, model, max_rows=5000):
+        self.model = model
+        self.max_rows = max_rows
+        self.vectors = None
+        self.size = 0
+        self.meta = []
+        self.keys = set()
+        self.indexed_until = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def add(self, vectors, metas):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self.lock:
+            if self.vectors is not None and vectors.shape[1] != self.vectors.shape[1]:
+                print(f"waah, embedding size changed ({self.vectors.shape[1]} -> {vectors.shape[1]}), starting the index over")
+                self.vectors, self.size, self.meta, self.keys = None, 0, [], set()
+            vectors, metas = vectors[-self.max_rows:], list(metas)[-self.max_rows:]
+            n = len(vectors)
+            if self.size + n > self.max_rows:
+                keep = self.max_rows - n
+                drop = self.size - keep
+                self.vectors[:keep] = self.vectors[drop:self.size]
+                for meta in self.meta[:drop]:
+                    self.keys.discard(meta["key"])
+                self.meta = self.meta[drop:]
+                self.size = keep
+            if self.vectors is None or self.size + n > len(self.vectors):
+                # grow by doubling so incremental adds stay amortized O(1)
+                capacity = max(64, self.size + n, 2 * (len(self.vectors) if self.vectors is not None else 0))
+                grown = np.zeros((min(capacity, self.max_rows), vectors.shape[1]), dtype=np.float32)
+                if self.size:
+                    grown[:self.size] = self.vectors[:self.size]
+                self.vectors = grown
+            self.vectors[self.size:self.size + n] = vectors
+            self.size += n
+            self.meta.extend(metas)
+            self.keys.update(meta["key"] for meta in metas)
+            for meta in metas:
+                if meta.get("created_at") and (self.indexed_until is None or meta["created_at"] > self.indexed_until):
+                    self.indexed_until = meta["created_at"]
+            self.dirty = True
+
+    def forget(self, thread_ids):
+        # drops every snippet from these threads (expired by retention); returns how many went
+        with self.lock:
+            keep = [i for i, meta in enumerate(self.meta) if meta["thread_ts"] not in thread_ids]
+            dropped = self.size - len(keep)
+            if not dropped:
+                return 0
+            if keep:
+                self.vectors[:len(keep)] = self.vectors[keep]
+            for i in set(range(self.size)) - set(keep):
+                self.keys.discard(self.meta[i]["key"])
+            self.meta = [self.meta[i] for i in keep]
+            self.size = len(keep)
+            self.dirty = True
+            return dropped
+
+    def search(self, query, k, exclude=None):
+        # [(score, meta)] best first; query must already be unit length. rows of the
+        # thread `exclude` sink to the bottom (-inf) so they never crowd out other threads
+        with self.lock:
+            if not self.size:
+                return []
+            scores = self.vectors[:self.size] @ query
+            if exclude is not None:
+                scores[[i for i, meta in enumerate(self.meta) if meta["thread_ts"] == exclude]] = -np.inf
+            if self.size > k:
+                top = np.argpartition(-scores, k)[:k]
+            else:
+                top = np.arange(self.size)
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), self.meta[i]) for i in top]
+
+    def save(self, path):
+        with self.lock:
+            if not self.dirty:
+                return
+            vectors = self.vectors[:self.size].copy() if self.size else np.zeros((0, 0), dtype=np.float32)
+            info = json.dumps({"model": self.model, "indexed_until": self.indexed_until, "meta": self.meta})
+            self.dirty = False
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, vectors=vectors, info=np.array(info))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, model, max_rows=5000):
+        index = cls(model, max_rows)
+        if not os.path.exists(path):
+            return index
+        try:
+            with np.load(path) as data:
+                info = json.loads(str(data["info"]))
+                vectors = data["vectors"]
+        except Exception as e:
+            print(f"unable to read recall index {path}, rebuilding it. {e}")
+            return index
+        if info.get("model") != model:
+            print(f"recall index {path} was built with {info.get('model')}, rebuilding it for {model}")
+            return index
+        if len(vectors):
+            index.add(vectors, info["meta"])
+        index.indexed_until = info.get("indexed_until")
+        index.dirty = False
+        return index
+
+
+class MemoryRecall:
+    def __init__(self, store, embed, model, path="recall_index", top_k=4, min_score=0.35,
+                 max_tokens=600, backfill=2000, max_rows=5000, chunk_chars=1200, batch_size=64,
+                 flush_interval=2.0, save_interval=60.0):
+        # store: the (sync) conversation store, embed(texts) -> list of vectors from an OpenAI-compatible /embeddings endpoint
+        self.store = store
+        self.embed = embed
+        self.model = model
+        self.path = path
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_tokens = max_tokens
+        self.backfill = backfill
+        self.max_rows = max_rows
+        self.chunk_chars = chunk_chars
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.save_interval = save_interval
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.queue = []
+        self.catch_up = set()
+        self.queries = TTLCache("recall_queries", maxsize=1000, ttl=600)
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        if path:
+            os.makedirs(path, exist_ok=True)
+        registry.add_collector(self.gauges)
+        self.thread = threading.Thread(target=self._loop, name="recall-indexer", daemon=True)
+        self.thread.start()
+
+    def _file(self, channel_id):
+        return os.path.join(self.path, _safe_name(channel_id) + ".npz") if self.path else None
+
+    def index(self, channel_id):
+        # the channel's index, read from disk the first time; rows newer than it are indexed in the background
+        with self.lock:
+            index = self.indexes.get(channel_id)
+        if index is not None:
+            return index
+        path = self._file(channel_id)
+        loaded = VectorIndex.load(path, self.model, self.max_rows) if path else VectorIndex(self.model, self.max_rows)
+        with self.lock:
+            index = self.indexes.setdefault(channel_id, loaded)
+            if index is loaded:
+                self.catch_up.add(channel_id)
+                self.wake.set()
+        return index
+
+    def add(self, row):
+        # chat_memory.on_append hook: queue a stored turn for embedding
+        if not row.get("channel_id") or row.get("role") not in ("user", "assistant"):
+            return
+        with self.lock:
+            self.queue.append(row)
+            if len(self.queue) >= self.batch_size:
+                self.wake.set()
+
+    def _snippets(self, row):
+        base = f"{row['thread_ts']}:{row['role']}:{row.get('created_at')}"
+        return [
+            (text, {"key": f"{base}:{n}", "thread_ts": row["thread_ts"], "role": row["role"],
+                    "created_at": row.get("created_at"), "text": text})
+            for n, text in enumerate(chunk_text(row.get("content"), self.chunk_chars))
+        ]
+
+    def _index_rows(self, channel_id, rows):
+        index = self.index(channel_id)
+        pending = [s for row in rows for s in self._snippets(row) if s[1]["key"] not in index.keys]
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            with span("embed", op="index"):
+                vectors = self.embed([text for text, _ in batch])
+            index.add(vectors, [meta for _, meta in batch])
+            registry.inc("symphony_recall_indexed_total", len(batch))
+
+    def _catch_up(self, channel_id):
+        index = self.index(channel_id)
+        data = self.store.channel_rows(channel_id, since=index.indexed_until, limit=self.backfill)
+        rows = [dict(row, channel_id=channel_id) for row in data]
+        if rows:
+            print(f"indexing {len(rows)} earlier messages from {channel_id} for recall :3")
+        self._index_rows(channel_id, rows)
+
+    def _drain(self):
+        with self.lock:
+            rows, self.queue = self.queue, []
+            channels, self.catch_up = self.catch_up, set()
+        for channel_id in channels:
+            try:
+                self._catch_up(channel_id)
+            except Exception as e:
+                print(f"unable to catch up the recall index for {channel_id}. {e}")
+        by_channel = {}
+        for row in rows:
+            by_channel.setdefault(row["channel_id"], []).append(row)
+        for channel_id, batch in by_channel.items():
+            try:
+                self._index_rows(channel_id, batch)
+            except Exception as e:
+                # dropped rather than retried; the next catch-up after a restart picks them up from chat_mem
+                print(f"unable to embed {len(batch)} messages for recall. {e}")
+
+    def forget(self, expired):
+        # retention on_expired hook: expired is [(channel_id, thread_ts)]
+        by_channel = {}
+        for channel_id, thread_ts in expired:
+            by_channel.setdefault(channel_id, set()).add(thread_ts)
+        for channel_id, thread_ids in by_channel.items():
+            self.index(channel_id).forget(thread_ids)
+        self.save()
+
+    def save(self):
+        with self.lock:
+            indexes = list(self.indexes.items())
+        for channel_id, index in indexes:
+            path = self._file(channel_id)
+            if not path:
+                continue
+            try:
+                index.save(path)
+            except Exception as e:
+                print(f"unable to save the recall index for {channel_id}. {e}")
+
+    def _loop(self):
+        next_save = time.monotonic() + self.save_interval
+        while not self.stopping.is_set():
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self._drain()
+            if time.monotonic() >= next_save:
+                self.save()
+                next_save = time.monotonic() + self.save_interval
+
+    def close(self, timeout=10.0):
+        self.stopping.set()
+        self.wake.set()
+        self.thread.join(timeout)
+        self._drain()
+        self.save()
+
+    def _query_vector(self, vector):
+        query = np.asarray(vector, dtype=np.float32)
+        return query / max(float(np.linalg.norm(query)), 1e-12)
+
+    def query(self, channel_id, text):
+        # prefetch step: loads the channel's index and embeds the message; None when there is nothing to search
+        if not text or not text.strip():
+            return None
+        if not len(self.index(channel_id)):
+            return None
+        cached = self.queries.get(text)
+        if cached is not None:
+            return cached
+        try:
+            with span("embed", op="query"):
+                vector = self._query_vector(self.embed([text])[0])
+        except Exception as e:
+            print(f"unable to embed the message for recall, going without. {e}")
+            return None
+        self.queries.set(text, vector)
+        return vector
+
+    def search(self, channel_id, vector, history=(), thread_ts=None):
+        # snippets worth injecting: from other threads, close enough, not already in the prompt,
+        # inside the token budget
+        if vector is None:
+            return []
+        seen = {turn.get("content") for turn in history}
+        picked, used = [], 0
+        for score, meta in self.index(channel_id).search(vector, self.top_k + len(seen), exclude=thread_ts):
+            if score < self.min_score or len(picked) >= self.top_k:
+                break
+            if meta["text"] in seen or any(meta["text"] in (content or "") for content in seen):
+                continue
+            tokens = count_tokens(meta["text"])
+            if used + tokens > self.max_tokens:
+                continue
+            picked.append(dict(meta, score=round(score, 3)))
+            used += tokens
+        registry.inc("symphony_recall_total", outcome="hit" if picked else "miss")
+        return picked
+
+    def gauges(self):
+        with self.lock:
+            indexes = list(self.indexes.items())
+        return [("symphony_recall_index_rows", {"channel": channel_id}, len(index)) for channel_id, index in indexes]
+
+
+# asyncio flavour: the message is embedded with the async client and the index is read from
+# disk on the executor; indexing itself stays on the background thread with the sync clients.
+
+class AsyncMemoryRecall(MemoryRecall):
+    def __init__(self, store, embed, aembed, model, **kwargs):
+        self.aembed = aembed
+        super().__init__(store, embed, model, **kwargs)
+
+    async def query(self, channel_id, text):
+        if not text or not text.strip():
+            return None
+        with self.lock:
+            index = self.indexes.get(channel_id)
+        if index is None:
+            index = await asyncio.get_running_loop().run_in_executor(None, self.index, channel_id)
+        if not len(index):
+            return None
+        cached = self.queries.get(text)
+        if cached is not None:
+            return cached
+        try:
+            async with aspan("embed", op="query"):
+                vector = self._query_vector((await self.aembed([text]))[0])
+        except Exception as e:
+            print(f"unable to embed the message for recall, going without. {e}")
+            return None
+        self.queries.set(text, vector)
+        return vector
+
+
+def create_recall(enabled, store, embed, model, **kwargs):
+    if not enabled:
+        return None
+    if np is None:
+        print("RECALL_ENABLED is on but numpy isn't installed (pip install .[recall]), going without recall")
+        return None
+    recall = MemoryRecall(store, embed, model, **kwargs)
+    atexit.register(recall.close)
+    return recall
+
+
+def create_async_recall(enabled, store, embed, aembed, model, **kwargs):
+    # store is a sync conversation store: catching up and indexing happen on the background thread
+    if not enabled:
+        return None
+    if np is None:
+        print("RECALL_ENABLED is on but numpy isn't installed (pip install .[recall]), going without recall")
+        return None
+    recall = AsyncMemoryRecall(store, embed, aembed, model, **kwargs)
+    atexit.register(recall.close)
+    return recall
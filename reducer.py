@@ -0,0 +1,220 @@
+import re
+import json
+import math
+import hashlib
+from metrics import registry, span
+from tokens import count_tokens
+
+
+# trims tool output (search results, scraped pages, deep research) before it goes into the
+# prompt. the raw text is parsed into passages (JSON search results become one passage per
+# hit, markdown is split on headings/paragraphs), boilerplate lines (nav bars, cookie
+# banners, image-only lines) and repeated passages are dropped, and if what's left is still
+# over the tool's token budget the passages are ranked against the user's question with
+# BM25 and the best ones are kept, in their original order. links from passages that didn't
+# make it are listed at the end so the model can still cite them.
+
+registry.describe("symphony_tool_output_tokens_total", "Tool output tokens before (raw) and after (reduced) trimming.")
+
+LINK = re.compile(r"\[([^\]]*)\]\((https?://[^)\s]+)\)|(https?://[^\s)\]>]+)")
+WORD = re.compile(r"\w+", re.UNICODE)
+BOILERPLATE = re.compile(
+    r"^(skip to (main )?content|accept( all)? cookies|we use cookies|cookie (policy|settings)|sign (in|up)|log ?in|"
+    r"subscribe( now)?|share( this)?( on \w+)?|menu|search|advertisement|back to top|all rights reserved.*|"
+    r"privacy policy|terms of (use|service)|follow us.*|related (posts|articles)|read more|loading\W*)$",
+    re.IGNORECASE
+)
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do for from how i in is it me my of on or so tell that the this to "
+    "was what when where which who why will with you your please about".split()
+)
+RESULT_LISTS = ("results", "items", "organic", "organic_results", "web", "data", "hits")
+
+
+def words(text):
+    return [w for w in WORD.findall(text.lower()) if w not in STOPWORDS and len(w) > 1]
+
+
+def _fingerprint(text):
+    return hashlib.sha1(" ".join(WORD.findall(text.lower())).encode("utf-8")).hexdigest()
+
+
+def _is_boilerplate(line):
+    stripped = line.strip().strip("*_#>|-• ").strip()
+    if not stripped:
+        return False
+    if BOILERPLATE.match(stripped):
+        return True
+    # a line that is only images / only links (nav bars, share buttons, logo strips)
+    without = LINK.sub("", re.sub(r"!\[[^\]]*\]\([^)]*\)", "", stripped))
+    return not WORD.search(without) and ("](" in stripped or "http" in stripped)
+
+
+def _search_hits(data):
+    # common search API shapes: {"results": [{"title", "url", "content"}]}, a bare list, ...
+    if isinstance(data, dict):
+        for key in RESULT_LISTS:
+            value = data.get(key)
+            if isinstance(value, dict):
+                value = _search_hits(value)
+            if isinstance(value, list):
+                return value
+        return None
+    return data if isinstance(data, list) else None
+
+
+def _hit_passage(hit):
+    if not isinstance(hit, dict):
+        return str(hit)
+    title = hit.get("title") or hit.get("name") or ""
+    url = hit.get("url") or hit.get("link") or hit.get("href") or ""
+    body = hit.get("content") or hit.get("snippet") or hit.get("description") or hit.get("text") or ""
+    return "\n".join(part for part in (f"{title} ({url})" if url else title, str(body).strip()) if part)
+
+
+def _split_long(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    pieces, current = [], ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        if current and count_tokens(current) + count_tokens(sentence) > max_tokens:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def passages(text, max_tokens=300):
+    # text -> list of passages (strings), boilerplate and duplicates removed
+    text = (text or "").strip()
+    raw = None
+    if text[:1] in "[{":
+        try:
+            hits = _search_hits(json.loads(text))
+        except ValueError:
+            hits = None
+        if hits is not None:
+            raw = [_hit_passage(hit) for hit in hits]
+    if raw is None:
+        raw, current, heading = [], [], ""
+
+        def flush():
+            # a heading with nothing under it isn't a passage
+            if [line for line in current if line != heading]:
+                raw.append("\n".join(current))
+
+        for line in text.splitlines():
+            if line.lstrip().startswith("#"):
+                flush()
+                heading = line.strip()
+                current = [heading]
+            elif not line.strip():
+                flush()
+                # the heading rides along with every paragraph under it, it's what the ranking keys on
+                current = [heading] if heading else []
+            elif not _is_boilerplate(line):
+                current.append(line.rstrip())
+        flush()
+
+    out, seen = [], set()
+    for passage in raw:
+        for piece in _split_long(passage.strip(), max_tokens):
+            key = _fingerprint(piece)
+            if not piece or key in seen:
+                continue
+            seen.add(key)
+            out.append(piece)
+    return out
+
+
+def bm25(query, docs, k1=1.5, b=0.75):
+    terms = set(words(query))
+    tokenized = [words(doc) for doc in docs]
+    if not terms or not docs:
+        return [0.0] * len(docs)
+    avg = sum(len(t) for t in tokenized) / len(tokenized) or 1.0
+    df = {term: sum(1 for t in tokenized if term in t) for term in terms}
+    scores = []
+    for tokens in tokenized:
+        counts = {}
+        for token in tokens:
+            if token in terms:
+                counts[token] = counts.get(token, 0) + 1
+        score = 0.0
+        for term, tf in counts.items():
+            idf = math.log(1 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / avg))
+        scores.append(score)
+    return scores
+
+
+def links(text):
+    found = []
+    for match in LINK.finditer(text):
+        label, url, bare = match.groups()
+        url = (url or bare).rstrip(".,;:")
+        found.append((label or "", url))
+    return found
+
+
+class ToolOutputReducer:
+    def __init__(self, budgets, default_budget=2000, passage_tokens=300, max_links=10):
+        # budgets: {tool: max tokens}; 0 leaves that tool's output alone
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.passage_tokens = passage_tokens
+        self.max_links = max_links
+
+    def budget_for(self, tool):
+        return self.budgets.get(tool, self.default_budget)
+
+    def reduce(self, tool, output, query=""):
+        budget = self.budget_for(tool)
+        if not budget or not isinstance(output, str) or not output:
+            return output
+        with span("reduce", tool=tool):
+            raw_tokens = count_tokens(output)
+            reduced = self._reduce(output, query, budget, raw_tokens)
+        registry.inc("symphony_tool_output_tokens_total", raw_tokens, tool=tool, kind="raw")
+        registry.inc("symphony_tool_output_tokens_total", count_tokens(reduced), tool=tool, kind="reduced")
+        return reduced
+
+    def _reduce(self, output, query, budget, raw_tokens):
+        if raw_tokens <= budget // 2:
+            # short answers and error messages aren't worth touching
+            return output
+        # passages stay well under the budget so a few of them always fit
+        found = passages(output, min(self.passage_tokens, max(50, budget // 4)))
+        if not found:
+            return output
+        sizes = [count_tokens(p) for p in found]
+        if sum(sizes) + 2 * len(found) <= budget:
+            return "\n\n".join(found)
+
+        scores = bm25(query, found)
+        # ties (or a question with no matching words) fall back to document order, lead first
+        order = sorted(range(len(found)), key=lambda i: (-scores[i], i))
+        # leave room for the trailer (what got cut + links)
+        room = max(budget // 2, budget - 60 - self.max_links * 25)
+        kept, used = set(), 0
+        for i in order:
+            if used + sizes[i] + 2 > room:
+                continue
+            kept.add(i)
+            used += sizes[i] + 2
+
+        body = "\n\n".join(found[i] for i in sorted(kept))
+        kept_urls = {url for _, url in links(body)}
+        others, seen = [], set()
+        for i in sorted(set(range(len(found))) - kept):
+            for label, url in links(found[i]):
+                if url in kept_urls or url in seen:
+                    continue
+                seen.add(url)
+                others.append(f"- {label}: {url}" if label else f"- {url}")
+        trailer = f"[trimmed to the {len(kept)} most relevant of {len(found)} passages]"
+        if others:
+            trailer += "\nOther sources:\n" + "\n".join(others[:self.max_links])
+        return f"{body}\n\n{trailer}"
@@ -0,0 +1,119 @@
+import time
+import threading
+from store import iso_before
+from metrics import registry, span
+
+
+# keeps chat_mem from growing forever. every `interval` seconds the job:
+#   1. archives cold threads: a thread with no turn for archive_after seconds is moved out of
+#      chat_mem into chat_archive as one compressed row (reading it later puts it back, see store.py,
+#      and counts as activity, so the next pass leaves it alone)
+#   2. expires threads (live or archived) past their channel's TTL, and tells on_expired so the
+#      recall index and the thread summary forget them too
+#   3. maintains storage: creates/drops chat_mem partitions (Supabase, partitioned layout) or
+#      hands freed pages back to the filesystem (sqlite)
+# every run reports the rows and bytes it took out of chat_mem.
+
+registry.describe("symphony_retention_rows_total", "chat_mem rows moved to the archive (archived) or deleted (expired).")
+registry.describe("symphony_retention_bytes_total", "Bytes reclaimed by archiving (content minus its compressed size) and expiring.")
+
+DAY = 86400
+
+
+class RetentionJob:
+    def __init__(self, store, archive_after=0, ttl=0, ttls=None, interval=3600, batch=200, on_expired=None):
+        # archive_after / ttl in seconds (0 = never); ttls: {channel_id: seconds} overriding ttl, 0 keeps that channel forever
+        # on_expired(pairs) gets the (channel_id, thread_ts) pairs that were deleted
+        self.store = store
+        self.archive_after = archive_after
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.interval = interval
+        self.batch = batch
+        self.on_expired = on_expired
+        self.stopping = threading.Event()
+        self.thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.archive_after or self.ttl or any(self.ttls.values()))
+
+    def _archive(self):
+        moved = {"threads": 0, "rows": 0, "bytes": 0}
+        if not self.archive_after:
+            return moved
+        before = iso_before(self.archive_after)
+        # batches keep each transaction short; a short batch means nothing cold is left
+        while not self.stopping.is_set():
+            batch = self.store.archive_cold(before, self.batch)
+            for key in moved:
+                moved[key] += batch[key]
+            if batch["threads"] < self.batch:
+                break
+        return moved
+
+    def _expire(self):
+        if not self.ttl and not any(self.ttls.values()):
+            return {"threads": 0, "rows": 0, "bytes": 0, "expired": []}
+        overrides = {channel: iso_before(ttl) if ttl else None for channel, ttl in self.ttls.items()}
+        gone = self.store.expire(iso_before(self.ttl) if self.ttl else None, overrides)
+        if gone["expired"] and self.on_expired:
+            try:
+                self.on_expired(gone["expired"])
+            except Exception as e:
+                print(f"unable to forget expired threads everywhere. {e}")
+        return gone
+
+    def run_once(self):
+        with span("retention", op="run"):
+            with span("retention", op="archive"):
+                moved = self._archive()
+            with span("retention", op="expire"):
+                gone = self._expire()
+            with span("retention", op="maintain"):
+                # partitions older than anything kept live should be empty by now (only empty ones are dropped)
+                live_for = self.archive_after or self.ttl
+                dropped = self.store.maintain(iso_before(live_for) if live_for else None)
+        registry.inc("symphony_retention_rows_total", moved["rows"], action="archived")
+        registry.inc("symphony_retention_rows_total", gone["rows"], action="expired")
+        registry.inc("symphony_retention_bytes_total", moved["bytes"], action="archived")
+        registry.inc("symphony_retention_bytes_total", gone["bytes"], action="expired")
+        if moved["threads"] or gone["threads"] or dropped:
+            print(
+                f"retention: archived {moved['threads']} threads ({moved['rows']} rows, {moved['bytes'] / 1024:.0f} KiB saved), "
+                f"expired {gone['threads']} threads ({gone['rows']} rows, {gone['bytes'] / 1024:.0f} KiB)"
+                + (f", dropped {dropped} empty partitions" if dropped else "") + " :3"
+            )
+        return {"archived": moved, "expired": gone, "partitions_dropped": dropped}
+
+    def _loop(self):
+        # first pass shortly after startup, not right away: the bot has better things to do while it warms up
+        delay = min(self.interval, 300)
+        while not self.stopping.wait(delay):
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"waah, retention run failed, trying again next interval. {e}")
+            delay = max(0.0, self.interval - (time.monotonic() - started))
+
+    def start(self):
+        if not self.enabled or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._loop, name="chat-retention", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10.0):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+def create_retention(store, archive_after_days=0, ttl_days=0, ttls_days=None, **kwargs):
+    return RetentionJob(
+        store,
+        archive_after=archive_after_days * DAY,
+        ttl=ttl_days * DAY,
+        ttls={channel: days * DAY for channel, days in (ttls_days or {}).items()},
+        **kwargs
+    )
@@ -0,0 +1,232 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import registry, span, aspan, bind
+
+
+# picks which model actually answers a turn. every call is timed per model over a rolling
+# window; a model whose error rate or p95 latency breaches the SLO is taken out of rotation
+# for a cooldown and its turns fail over to the next fallback. a call that is still running
+# after hedge_after seconds gets a second, hedged request on a fallback model and whichever
+# answers first wins. the model that answered the first round is used for the rest of the turn.
+
+registry.describe("symphony_route_total", "Model routing decisions (primary, failover, hedge).")
+registry.describe("symphony_hedge_total", "Hedged LLM requests and whether the hedge won.")
+
+
+class ModelStats:
+    def __init__(self, window=300.0, max_samples=200):
+        self.window = window
+        self.samples = deque(maxlen=max_samples)
+        self.tripped_until = 0.0
+
+    def add(self, seconds, ok):
+        self.samples.append((time.monotonic(), seconds, ok))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        return self.samples
+
+    def count(self):
+        return len(self._recent())
+
+    def error_rate(self):
+        samples = self._recent()
+        if not samples:
+            return 0.0
+        return sum(1 for _, _, ok in samples if not ok) / len(samples)
+
+    def p95(self):
+        latencies = sorted(seconds for _, seconds, ok in self._recent() if ok)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def healthy(self):
+        return time.monotonic() >= self.tripped_until
+
+
+class ModelRouter:
+    def __init__(self, fallbacks=(), hedge_after=0.0, slo_seconds=30.0, max_error_rate=0.5,
+                 min_samples=5, window=300.0, cooldown=60.0, workers=16):
+        self.fallbacks = [m for m in fallbacks if m]
+        self.hedge_after = hedge_after
+        self.slo_seconds = slo_seconds
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.window = window
+        self.cooldown = cooldown
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.pool = self._make_pool(workers)
+        registry.add_collector(self.gauges)
+
+    def _make_pool(self, workers):
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="symphony-hedge")
+
+    def _stats(self, model):
+        with self.lock:
+            stats = self.stats.get(model)
+            if stats is None:
+                stats = self.stats[model] = ModelStats(self.window)
+            return stats
+
+    def candidates(self, model):
+        # requested model first, then the fallbacks; models out of rotation go to the back
+        ordered = [model] + [m for m in self.fallbacks if m != model]
+        healthy = [m for m in ordered if self._stats(m).healthy()]
+        return healthy + [m for m in ordered if m not in healthy]
+
+    def observe(self, model, seconds, ok):
+        stats = self._stats(model)
+        with self.lock:
+            stats.add(seconds, ok)
+            if stats.count() < self.min_samples or not stats.healthy():
+                return
+            error_rate, p95 = stats.error_rate(), stats.p95()
+            if error_rate <= self.max_error_rate and p95 <= self.slo_seconds:
+                return
+            # out of rotation for a while; start from a clean slate when it comes back
+            stats.tripped_until = time.monotonic() + self.cooldown
+            stats.samples.clear()
+        registry.inc("symphony_model_tripped_total", model=model)
+        print(f"waah, {model} is over its SLO (errors {error_rate:.0%}, p95 {p95:.1f}s), routing around it for {self.cooldown:.0f}s")
+
+    def _attempt(self, model, fn, round):
+        start = time.monotonic()
+        try:
+            with span("llm", model=model, round=round):
+                result = fn(model)
+        except Exception:
+            self.observe(model, time.monotonic() - start, False)
+            raise
+        self.observe(model, time.monotonic() - start, True)
+        return result
+
+    def _count(self, requested, model, reason, round):
+        registry.inc("symphony_route_total", requested=requested, model=model, reason=reason, round=round)
+
+    def _plan(self, model, hedge, failed):
+        # yields (candidate, backup to hedge with or None, reason) until one of them answers.
+        # a backup that was fired as a hedge and failed lands in `failed` and is skipped
+        candidates = self.candidates(model)
+        for i, candidate in enumerate(candidates):
+            if candidate in failed:
+                continue
+            rest = [m for m in candidates[i + 1:] if m not in failed]
+            backup = rest[0] if hedge and self.hedge_after and rest else None
+            yield candidate, backup, "primary" if candidate == model else "failover"
+
+    def call(self, model, fn, round="first", hedge=True, on_failover=None):
+        # fn(model) makes the request; returns (result, model that produced it).
+        # pass hedge=False when fn has side effects that can't run twice (streaming into Slack)
+        last_error = None
+        failed = set()
+        for candidate, backup, reason in self._plan(model, hedge, failed):
+            if last_error is not None and on_failover:
+                on_failover(candidate)
+            try:
+                if backup:
+                    result, used = self._hedged(candidate, backup, fn, round, failed)
+                else:
+                    result, used = self._attempt(candidate, fn, round), candidate
+                self._count(model, used, reason if used == candidate else "hedge", round)
+                return result, used
+            except Exception as e:
+                print(f"{candidate} failed, trying the next model. {e}")
+                failed.add(candidate)
+                last_error = e
+        raise last_error
+
+    def _hedged(self, primary, backup, fn, round, failed):
+        first = self.pool.submit(bind(self._attempt), primary, fn, round)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result(), primary
+        second = self.pool.submit(bind(self._attempt), backup, fn, round)
+        pending = {first: primary, second: backup}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                used = pending.pop(future)
+                if future.exception() is None:
+                    # the slower request keeps running in the pool, its answer is dropped
+                    registry.inc("symphony_hedge_total", model=backup, outcome="won" if used == backup else "lost")
+                    return future.result(), used
+                failed.add(used)
+                if not pending:
+                    raise future.exception()
+
+    def gauges(self):
+        rows = []
+        with self.lock:
+            for model, s in self.stats.items():
+                rows.append(("symphony_model_healthy", {"model": model}, int(s.healthy())))
+                rows.append(("symphony_model_error_rate", {"model": model}, round(s.error_rate(), 3)))
+                rows.append(("symphony_model_p95_seconds", {"model": model}, round(s.p95(), 3)))
+        return rows
+
+
+# asyncio flavour: fn(model) is a coroutine function, and the losing hedge gets cancelled
+
+class AsyncModelRouter(ModelRouter):
+    def _make_pool(self, workers):
+        return None
+
+    async def _attempt(self, model, fn, round):
+        start = time.monotonic()
+        try:
+            async with aspan("llm", model=model, round=round):
+                result = await fn(model)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.observe(model, time.monotonic() - start, False)
+            raise
+        self.observe(model, time.monotonic() - start, True)
+        return result
+
+    async def call(self, model, fn, round="first", hedge=True, on_failover=None):
+        last_error = None
+        failed = set()
+        for candidate, backup, reason in self._plan(model, hedge, failed):
+            if last_error is not None and on_failover:
+                await on_failover(candidate)
+            try:
+                if backup:
+                    result, used = await self._hedged(candidate, backup, fn, round, failed)
+                else:
+                    result, used = await self._attempt(candidate, fn, round), candidate
+                self._count(model, used, reason if used == candidate else "hedge", round)
+                return result, used
+            except Exception as e:
+                print(f"{candidate} failed, trying the next model. {e}")
+                failed.add(candidate)
+                last_error = e
+        raise last_error
+
+    async def _hedged(self, primary, backup, fn, round, failed):
+        first = asyncio.ensure_future(self._attempt(primary, fn, round))
+        done, _ = await asyncio.wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result(), primary
+        second = asyncio.ensure_future(self._attempt(backup, fn, round))
+        pending = {first: primary, second: backup}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    used = pending.pop(task)
+                    if task.exception() is None:
+                        registry.inc("symphony_hedge_total", model=backup, outcome="won" if used == backup else "lost")
+                        return task.result(), used
+                    failed.add(used)
+                    if not pending:
+                        raise task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
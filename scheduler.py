@@ -0,0 +1,207 @@
+import time
+import asyncio
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import registry, record, current_trace
+
+
+# admission control in front of ai_msg. every turn waits in one bounded queue and is
+# started as soon as the chat lane has room and its user and channel are under their caps
+# (a user who is over their cap is skipped, so everybody behind them still moves).
+# a turn that reaches the slow tools (deep research, image generation) hands its chat
+# slot back and moves to the long lane, so a handful of those can't starve normal replies.
+# background jobs doing the same slow work take their slots from that lane too (see
+# background_lane), so LONG_SLOTS bounds it however it runs.
+# when the queue is full the turn is shed and the caller tells the user to try later.
+# turns that share a key (the thread) never run at the same time, and start in arrival order.
+
+
+class Ticket:
+    def __init__(self, scheduler, user, channel, fn, key=None):
+        self.scheduler = scheduler
+        self.user = user
+        self.channel = channel
+        self.fn = fn
+        self.key = key
+        self.lane = None
+        self.queued_at = time.monotonic()
+        self.trace = current_trace.get()
+
+    def long_lane(self):
+        return self.scheduler.long_lane(self)
+
+
+class Scheduler:
+    def __init__(self, chat_slots=16, long_slots=4, long_backlog=None, max_queue=100, per_user=2, per_channel=12):
+        self.chat_slots = chat_slots
+        self.long_slots = long_slots
+        self.per_user = per_user
+        self.per_channel = per_channel
+        self.max_queue = max_queue
+        # turns parked waiting for a long slot still hold a worker, this bounds them
+        self.max_admitted = chat_slots + long_slots + (long_slots if long_backlog is None else long_backlog)
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.running = {"chat": 0, "long": 0}
+        self.admitted = 0
+        self.users = {}
+        self.channels = {}
+        self.keys = set()
+        self.long_gate = self._make_gate(long_slots)
+        self.pool = self._make_pool()
+        registry.add_collector(self.gauges)
+
+    def _make_gate(self, slots):
+        return threading.BoundedSemaphore(slots)
+
+    def _make_pool(self):
+        return ThreadPoolExecutor(max_workers=self.max_admitted, thread_name_prefix="symphony-turn")
+
+    def submit(self, user, channel, fn, key=None):
+        # fn(ticket) runs once admitted; returns None when the turn was shed
+        ticket = Ticket(self, user, channel, fn, key)
+        with self.lock:
+            if len(self.queue) >= self.max_queue:
+                registry.inc("symphony_shed_total", reason="queue_full")
+                return None
+            self.queue.append(ticket)
+            self._dispatch_locked()
+        return ticket
+
+    def _eligible(self, ticket):
+        return (
+            self.users.get(ticket.user, 0) < self.per_user
+            and self.channels.get(ticket.channel, 0) < self.per_channel
+            and (ticket.key is None or ticket.key not in self.keys)
+        )
+
+    def _dispatch_locked(self):
+        if not self.queue:
+            return
+        kept = deque()
+        while self.queue:
+            ticket = self.queue.popleft()
+            if self.running["chat"] >= self.chat_slots or self.admitted >= self.max_admitted or not self._eligible(ticket):
+                kept.append(ticket)
+                continue
+            ticket.lane = "chat"
+            self.running["chat"] += 1
+            self.admitted += 1
+            self.users[ticket.user] = self.users.get(ticket.user, 0) + 1
+            self.channels[ticket.channel] = self.channels.get(ticket.channel, 0) + 1
+            if ticket.key is not None:
+                self.keys.add(ticket.key)
+            self._start(ticket)
+        self.queue = kept
+
+    def _start(self, ticket):
+        self.pool.submit(self._run, ticket)
+
+    def _begin(self, ticket):
+        current_trace.set(ticket.trace)
+        record("queue_wait", time.monotonic() - ticket.queued_at)
+
+    def _run(self, ticket):
+        self._begin(ticket)
+        try:
+            ticket.fn(ticket)
+        except Exception as e:
+            print(f"scheduled turn blew up. {e}")
+        finally:
+            self._done(ticket)
+
+    def _done(self, ticket):
+        with self.lock:
+            self.running[ticket.lane] -= 1
+            self.admitted -= 1
+            for counts, key in ((self.users, ticket.user), (self.channels, ticket.channel)):
+                counts[key] -= 1
+                if not counts[key]:
+                    del counts[key]
+            self.keys.discard(ticket.key)
+            self._dispatch_locked()
+
+    def _leave_chat(self, ticket):
+        with self.lock:
+            if ticket.lane != "chat":
+                return False
+            self.running["chat"] -= 1
+            ticket.lane = "long"
+            self.running["long"] += 1
+            self._dispatch_locked()
+            return True
+
+    @contextlib.contextmanager
+    def long_lane(self, ticket):
+        if not self._leave_chat(ticket):
+            yield
+            return
+        start = time.monotonic()
+        with self.long_gate:
+            record("long_lane_wait", time.monotonic() - start)
+            yield
+
+    @contextlib.contextmanager
+    def background_lane(self):
+        # for work outside any turn (background jobs): a long slot, no chat slot to give back
+        start = time.monotonic()
+        with self.long_gate:
+            record("long_lane_wait", time.monotonic() - start)
+            yield
+
+    def gauges(self):
+        with self.lock:
+            return [
+                ("symphony_queue_depth", {}, len(self.queue)),
+                ("symphony_turns_running", {"lane": "chat"}, self.running["chat"]),
+                ("symphony_turns_running", {"lane": "long"}, self.running["long"]),
+                ("symphony_oldest_queued_seconds", {}, round(time.monotonic() - self.queue[0].queued_at, 3) if self.queue else 0),
+            ]
+
+
+# asyncio flavour: admitted turns become tasks instead of pool jobs. the bookkeeping is
+# all synchronous, so the plain lock above is never contended and works as-is.
+
+class AsyncScheduler(Scheduler):
+    def __init__(self, *args, **kwargs):
+        self.tasks = set()
+        super().__init__(*args, **kwargs)
+
+    def _make_gate(self, slots):
+        return asyncio.Semaphore(slots)
+
+    def _make_pool(self):
+        return None
+
+    def _start(self, ticket):
+        task = asyncio.get_running_loop().create_task(self._arun(ticket))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _arun(self, ticket):
+        self._begin(ticket)
+        try:
+            await ticket.fn(ticket)
+        except Exception as e:
+            print(f"scheduled turn blew up. {e}")
+        finally:
+            self._done(ticket)
+
+    @contextlib.asynccontextmanager
+    async def long_lane(self, ticket):
+        if not self._leave_chat(ticket):
+            yield
+            return
+        start = time.monotonic()
+        async with self.long_gate:
+            record("long_lane_wait", time.monotonic() - start)
+            yield
+
+    @contextlib.asynccontextmanager
+    async def background_lane(self):
+        start = time.monotonic()
+        async with self.long_gate:
+            record("long_lane_wait", time.monotonic() - start)
+            yield
@@ -0,0 +1,165 @@
+import time
+import asyncio
+import threading
+from slack_sdk.errors import SlackApiError
+from metrics import registry, record
+
+
+# every Slack Web API call goes through one token bucket per method (per method + channel for
+# chat.postMessage, which Slack limits per channel), shared by all the clients in the process.
+# a call that would go over the method's tier waits for a token instead of getting a 429;
+# if Slack answers 429 anyway (another replica, a burst we didn't see) the whole bucket is
+# held until Retry-After and the call is retried.
+#
+# rates are calls per minute, roughly Slack's published tiers; SLACK_RATE_LIMITS overrides them.
+
+registry.describe("symphony_slack_throttled_total", "Slack calls held back by the local token bucket (bucket) or a 429 (retry_after).")
+
+TIER_1, TIER_2, TIER_3, TIER_4 = 1, 20, 50, 100
+RATES = {
+    "chat_postMessage": 60,
+    "chat_update": TIER_3,
+    "chat_delete": TIER_3,
+    "reactions_add": TIER_3,
+    "reactions_remove": TIER_2,
+    "users_info": TIER_4,
+    "files_upload_v2": TIER_2,
+    "conversations_leave": TIER_3,
+    "conversations_info": TIER_3,
+    "auth_test": TIER_4,
+}
+# buckets keyed by method + channel instead of just method
+PER_CHANNEL = frozenset({"chat_postMessage"})
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        # rate: tokens per second, burst: bucket size
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        # seconds until a call could go out, without taking a token
+        self._refill(now)
+        return max(self.blocked_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0, 0.0)
+
+    def reserve(self, now):
+        # takes a token (possibly one that only exists in the future) and says how long to wait for it
+        wait = self.delay(now)
+        self.tokens -= 1
+        return wait
+
+
+class SlackRateLimiter:
+    def __init__(self, rates=None, default_rate=TIER_3, burst_seconds=30.0, max_retries=3, max_retry_wait=60.0, enabled=True):
+        # enabled=False only turns off the local buckets; 429s are still retried
+        self.enabled = enabled
+        self.rates = dict(RATES, **(rates or {}))
+        self.default_rate = default_rate
+        self.burst_seconds = burst_seconds
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _key(self, method, kwargs):
+        return (method, kwargs.get("channel")) if method in PER_CHANNEL else (method, None)
+
+    def _bucket(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            per_minute = self.rates.get(key[0], self.default_rate)
+            bucket = self.buckets[key] = TokenBucket(per_minute / 60.0, max(1.0, per_minute * self.burst_seconds / 60.0))
+        return bucket
+
+    def delay(self, method, **kwargs):
+        with self.lock:
+            bucket = self._bucket(self._key(method, kwargs))
+            now = time.monotonic()
+            return bucket.delay(now) if self.enabled else max(0.0, bucket.blocked_until - now)
+
+    def reserve(self, method, kwargs):
+        with self.lock:
+            bucket = self._bucket(self._key(method, kwargs))
+            now = time.monotonic()
+            wait = bucket.reserve(now) if self.enabled else max(0.0, bucket.blocked_until - now)
+        if wait > 0:
+            registry.inc("symphony_slack_throttled_total", method=method, reason="bucket")
+            record("slack_rate_wait", wait, method=method)
+        return wait
+
+    def retry_after(self, method, kwargs, error, attempt):
+        # seconds to wait before retrying a 429, None when it shouldn't be retried
+        response = getattr(error, "response", None)
+        if response is None or response.status_code != 429 or attempt >= self.max_retries:
+            return None
+        wait = float(response.headers.get("Retry-After", 1) or 1)
+        if wait > self.max_retry_wait:
+            return None
+        with self.lock:
+            bucket = self._bucket(self._key(method, kwargs))
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + wait)
+            bucket.tokens = min(bucket.tokens, 0.0)
+        registry.inc("symphony_slack_throttled_total", method=method, reason="retry_after")
+        print(f"slack rate limited {method}, retrying in {wait:.0f}s")
+        return wait
+
+
+class RateLimitedWebClient:
+    # wraps a (traced) WebClient; every API method call waits for its bucket and retries 429s
+    def __init__(self, client, limiter):
+        self._client = client
+        self._limiter = limiter
+
+    def delay(self, method, **kwargs):
+        # how long a call to this method would wait right now (lets the streamer skip an edit instead)
+        return self._limiter.delay(method, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        def call(*args, **kwargs):
+            attempt = 0
+            while True:
+                wait = self._limiter.reserve(name, kwargs)
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    return attr(*args, **kwargs)
+                except SlackApiError as e:
+                    retry = self._limiter.retry_after(name, kwargs, e, attempt)
+                    if retry is None:
+                        raise
+                    attempt += 1
+        return call
+
+
+class AsyncRateLimitedWebClient(RateLimitedWebClient):
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        async def call(*args, **kwargs):
+            attempt = 0
+            while True:
+                wait = self._limiter.reserve(name, kwargs)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    return await attr(*args, **kwargs)
+                except SlackApiError as e:
+                    retry = self._limiter.retry_after(name, kwargs, e, attempt)
+                    if retry is None:
+                        raise
+                    attempt += 1
+        return call
@@ -0,0 +1,281 @@
+import time
+from slack_sdk.errors import SlackApiError
+from metrics import record_usage
+
+
+# posts a placeholder in the thread and keeps editing it in place as tokens come in.
+# edits are coalesced so one message gets at most one chat_update per interval,
+# which keeps us well inside Slack's chat.update rate limits. the same message is the
+# turn's status line (tool progress goes through show()) and ends up holding the answer,
+# streamed or not. without streaming nothing is posted until there's something to show,
+# so a plain reply is a single chat_postMessage and one with tools a post plus one edit.
+
+class SlackStreamer:
+    def __init__(self, client, channel_id, thread_ts, min_interval=1.0, placeholder="Thinking..."):
+        self.client = client
+        self.channel_id = channel_id
+        self.thread_ts = thread_ts
+        self.min_interval = min_interval
+        self.placeholder = placeholder
+        self.ts = None
+        self.buffer = ""
+        self.shown = ""
+        self.next_update = 0.0
+        self.started_at = None
+        self.first_token_at = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        try:
+            res = self.client.chat_postMessage(
+                channel=self.channel_id,
+                thread_ts=self.thread_ts,
+                text=self.placeholder
+            )
+            self.ts = res["ts"]
+        except Exception as e:
+            print(f"Unable to post stream placeholder. {e}")
+        return self.ts
+
+    def append(self, text):
+        if not text:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.buffer += text
+        self.flush()
+
+    def reset(self, placeholder=None):
+        # throw away whatever was streamed so far (e.g. a preamble before tool calls)
+        self.buffer = ""
+        if placeholder and self._update(text=placeholder):
+            self.shown = placeholder
+
+    def show(self, text):
+        # status line (what the tools are doing); posts the message if there isn't one yet
+        if self.ts:
+            return self.reset(text)
+        self.buffer = ""
+        if self._post(text):
+            self.next_update = time.monotonic() + self.min_interval
+
+    def flush(self):
+        if not self.ts or not self.buffer or self.buffer == self.shown:
+            return
+        if time.monotonic() < self.next_update or self._throttled():
+            return
+        if self._update(text=self.buffer):
+            self.shown = self.buffer
+
+    def _throttled(self):
+        # chat_update is out of tokens (see slack_client.py): skip this edit, the text goes out with the next one
+        delay = getattr(self.client, "delay", None)
+        return delay is not None and delay("chat_update") > 0
+
+    def finish(self, text, blocks=None):
+        # final edit carries the full answer (and footer blocks) in the same message,
+        # or posts it when nothing was posted yet. it goes out right away (the interval only
+        # coalesces streaming edits, slack_client.py paces the real calls) and is skipped when
+        # the streamed text already on screen is the whole answer
+        if not self.ts:
+            return self._post(text, blocks)
+        if text == self.shown and not blocks:
+            return True
+        if self._update(text=text, blocks=blocks):
+            self.shown = text
+            return True
+        return False
+
+    def _post(self, text, blocks=None):
+        try:
+            self.ts = self.client.chat_postMessage(channel=self.channel_id, thread_ts=self.thread_ts, text=text, blocks=blocks)["ts"]
+            self.shown = text
+            return True
+        except Exception as e:
+            print(f"Unable to post reply. {e}")
+            return False
+
+    def time_to_first_token(self):
+        if self.first_token_at is None or self.started_at is None:
+            return None
+        return round(self.first_token_at - self.started_at, 2)
+
+    def _update(self, text, blocks=None):
+        # a 429 has already been retried by the rate-limited client (slack_client.py); here it
+        # only pushes the next streaming edit back, and finish() falls back to posting
+        if not self.ts:
+            return False
+        try:
+            kwargs = {"channel": self.channel_id, "ts": self.ts, "text": text}
+            if blocks:
+                kwargs["blocks"] = blocks
+            self.client.chat_update(**kwargs)
+            self.next_update = time.monotonic() + self.min_interval
+            return True
+        except SlackApiError as e:
+            if e.response.status_code == 429:
+                retry_after = float(e.response.headers.get("Retry-After", 1))
+                print(f"chat_update got rate limited, backing off {retry_after}s")
+                self.next_update = time.monotonic() + retry_after
+                return False
+            print(f"Unable to update streamed message. {e}")
+            return False
+        except Exception as e:
+            print(f"Unable to update streamed message. {e}")
+            return False
+
+
+# async twin of SlackStreamer for the asyncio runtime (AsyncWebClient, no blocking sleeps)
+
+class AsyncSlackStreamer(SlackStreamer):
+    async def start(self):
+        self.started_at = time.monotonic()
+        try:
+            res = await self.client.chat_postMessage(
+                channel=self.channel_id,
+                thread_ts=self.thread_ts,
+                text=self.placeholder
+            )
+            self.ts = res["ts"]
+        except Exception as e:
+            print(f"Unable to post stream placeholder. {e}")
+        return self.ts
+
+    async def append(self, text):
+        if not text:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.buffer += text
+        await self.flush()
+
+    async def reset(self, placeholder=None):
+        self.buffer = ""
+        if placeholder and await self._update(text=placeholder):
+            self.shown = placeholder
+
+    async def show(self, text):
+        if self.ts:
+            return await self.reset(text)
+        self.buffer = ""
+        if await self._post(text):
+            self.next_update = time.monotonic() + self.min_interval
+
+    async def flush(self):
+        if not self.ts or not self.buffer or self.buffer == self.shown:
+            return
+        if time.monotonic() < self.next_update or self._throttled():
+            return
+        if await self._update(text=self.buffer):
+            self.shown = self.buffer
+
+    async def finish(self, text, blocks=None):
+        if not self.ts:
+            return await self._post(text, blocks)
+        if text == self.shown and not blocks:
+            return True
+        if await self._update(text=text, blocks=blocks):
+            self.shown = text
+            return True
+        return False
+
+    async def _post(self, text, blocks=None):
+        try:
+            self.ts = (await self.client.chat_postMessage(channel=self.channel_id, thread_ts=self.thread_ts, text=text, blocks=blocks))["ts"]
+            self.shown = text
+            return True
+        except Exception as e:
+            print(f"Unable to post reply. {e}")
+            return False
+
+    async def _update(self, text, blocks=None):
+        if not self.ts:
+            return False
+        try:
+            kwargs = {"channel": self.channel_id, "ts": self.ts, "text": text}
+            if blocks:
+                kwargs["blocks"] = blocks
+            await self.client.chat_update(**kwargs)
+            self.next_update = time.monotonic() + self.min_interval
+            return True
+        except SlackApiError as e:
+            if e.response.status_code == 429:
+                retry_after = float(e.response.headers.get("Retry-After", 1))
+                print(f"chat_update got rate limited, backing off {retry_after}s")
+                self.next_update = time.monotonic() + retry_after
+                return False
+            print(f"Unable to update streamed message. {e}")
+            return False
+        except Exception as e:
+            print(f"Unable to update streamed message. {e}")
+            return False
+
+
+def _new_tool_call():
+    return {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+
+
+def _merge_delta(tool_calls, delta):
+    # folds one chunk's tool call deltas into the calls collected so far, returns any text
+    for tc in delta.tool_calls or []:
+        call = tool_calls.setdefault(tc.index, _new_tool_call())
+        if tc.id:
+            call["id"] = tc.id
+        if tc.function:
+            if tc.function.name:
+                call["function"]["name"] += tc.function.name
+            if tc.function.arguments:
+                call["function"]["arguments"] += tc.function.arguments
+    return delta.content or ""
+
+
+def _ordered_calls(tool_calls):
+    ordered = [tool_calls[i] for i in sorted(tool_calls)]
+    for n, call in enumerate(ordered):
+        if not call["id"]:
+            call["id"] = f"call_{n}"
+    return ordered
+
+
+def stream_completion(openai_client, streamer, **kwargs):
+    # returns (content, tool_calls) with tool call deltas stitched back together by index
+    content = ""
+    tool_calls = {}
+
+    # the usage chunk comes last, with no choices
+    kwargs.setdefault("stream_options", {"include_usage": True})
+    stream = openai_client.chat.completions.create(stream=True, **kwargs)
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            record_usage(kwargs.get("model"), chunk.usage)
+        if not chunk.choices or chunk.choices[0].delta is None:
+            continue
+        text = _merge_delta(tool_calls, chunk.choices[0].delta)
+        if text:
+            content += text
+            if streamer:
+                streamer.append(text)
+
+    # no final flush: the caller either finish()es with the whole answer or resets for tool calls
+    return content, _ordered_calls(tool_calls)
+
+
+async def astream_completion(openai_client, streamer, **kwargs):
+    content = ""
+    tool_calls = {}
+
+    # the usage chunk comes last, with no choices
+    kwargs.setdefault("stream_options", {"include_usage": True})
+    stream = await openai_client.chat.completions.create(stream=True, **kwargs)
+    async for chunk in stream:
+        if getattr(chunk, "usage", None):
+            record_usage(kwargs.get("model"), chunk.usage)
+        if not chunk.choices or chunk.choices[0].delta is None:
+            continue
+        text = _merge_delta(tool_calls, chunk.choices[0].delta)
+        if text:
+            content += text
+            if streamer:
+                await streamer.append(text)
+
+    return content, _ordered_calls(tool_calls)
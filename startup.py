@@ -0,0 +1,215 @@
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from metrics import registry, span, add_route
+
+
+# cold start. the heavy SDKs (openai, supabase) are imported and their clients built the first
+# time something uses them instead of at import, so a slow or misconfigured backend can't
+# stall or crash the process before it's even connected to Slack. warm_up() then runs every
+# dependency's check in parallel, which opens a pooled connection to each backend so the
+# first mention doesn't pay for cold TLS handshakes, and Health keeps the results for
+#   /healthz  the process is up (liveness)
+#   /readyz   connected to Slack and no required dependency failing (readiness), per-dependency
+#             status as JSON; results older than `recheck` seconds are refreshed in the background
+
+
+class Lazy:
+    # stands in for a client until something touches it; a factory that fails is tried again next time
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    with span("startup", op=self._name):
+                        self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def status_code(thing):
+    # HTTP status of a response or of the error a failed call raised, whichever SDK it came from
+    code = getattr(thing, "status_code", None)
+    response = getattr(thing, "response", None)
+    if code is None and response is not None:
+        code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def reachable(status, missing=(404, 405, 501)):
+    # a backend that answers at all has a warm connection now; only auth errors and 5xx are failures.
+    # some endpoints (moderation, search) don't have the route the check hits, that's fine too
+    if status is not None and status >= 400 and status not in missing:
+        raise RuntimeError(f"HTTP {status}")
+    return f"HTTP {status}" if status else "ok"
+
+
+def touch(call):
+    # runs a cheap request against a backend; connection errors and timeouts raise
+    try:
+        response = call()
+    except Exception as e:
+        if status_code(e) is None:
+            raise
+        return reachable(status_code(e))
+    return reachable(status_code(response))
+
+
+async def atouch(call):
+    try:
+        response = await call()
+    except Exception as e:
+        if status_code(e) is None:
+            raise
+        return reachable(status_code(e))
+    return reachable(status_code(response))
+
+
+class Health:
+    def __init__(self, timeout=10.0, recheck=30.0):
+        self.timeout = timeout
+        self.recheck = recheck
+        self.checks = {}
+        self.status = {}
+        self.serving = False
+        self.draining = False
+        self.started = time.monotonic()
+        # set for the async runtime, whose checks are coroutines that have to run on its loop
+        self.loop = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+        registry.add_collector(self.gauges)
+
+    def add(self, name, check, required=True, clients=()):
+        # check() raises when the dependency isn't usable, may return a short detail string;
+        # clients are Lazy objects built (off the loop) before the check runs
+        self.checks[name] = (check, required, clients)
+
+    def run(self, name):
+        check, required, clients = self.checks[name]
+        started = time.monotonic()
+        try:
+            for client in clients:
+                client.get()
+            if asyncio.iscoroutinefunction(check):
+                detail = asyncio.run_coroutine_threadsafe(asyncio.wait_for(check(), self.timeout), self.loop).result()
+            else:
+                detail = check()
+            status = {"ok": True, "detail": detail or "ok"}
+        except Exception as e:
+            status = {"ok": False, "detail": f"{type(e).__name__}: {e}"[:300]}
+        status.update(required=required, seconds=round(time.monotonic() - started, 3), checked_at=time.time())
+        with self.lock:
+            was = self.status.get(name)
+            self.status[name] = status
+        if was is not None and was["ok"] != status["ok"]:
+            print(f"{name} is {'back' if status['ok'] else 'failing'}: {status['detail']}")
+        return status
+
+    def run_all(self):
+        # every check at once; one that hangs past the timeout is reported as such, not waited for
+        if not self.checks:
+            return {}
+        pool = ThreadPoolExecutor(max_workers=len(self.checks), thread_name_prefix="symphony-health")
+        futures = {pool.submit(self.run, name): name for name in self.checks}
+        done, pending = wait(futures, timeout=self.timeout + 1)
+        for future in pending:
+            name = futures[future]
+            with self.lock:
+                self.status[name] = {
+                    "ok": False,
+                    "detail": f"no answer in {self.timeout:g}s",
+                    "required": self.checks[name][1],
+                    "seconds": self.timeout,
+                    "checked_at": time.time()
+                }
+        pool.shutdown(wait=False)
+        return dict(self.status)
+
+    def warm_up(self):
+        # a probe arriving meanwhile shouldn't start a second round of checks
+        self.refreshing = True
+        try:
+            with span("startup", op="warm_up"):
+                results = self.run_all()
+        finally:
+            self.refreshing = False
+        took = time.monotonic() - self.started
+        failing = [name for name, status in results.items() if not status["ok"]]
+        if failing:
+            print(f"waah, warm-up done in {took:.1f}s but {', '.join(failing)} failed: " + "; ".join(results[name]["detail"] for name in failing))
+        else:
+            print(f"warmed up {len(results)} dependencies in {took:.1f}s :3")
+        return results
+
+    async def awarm_up(self):
+        self.loop = asyncio.get_running_loop()
+        return await self.loop.run_in_executor(None, self.warm_up)
+
+    def drain(self):
+        # shutting down: stop reporting ready so traffic moves to the next replica
+        self.draining = True
+
+    def ready(self):
+        with self.lock:
+            failing = any(not s["ok"] and s["required"] for s in self.status.values())
+        return self.serving and not self.draining and not failing
+
+    def _refresh(self):
+        try:
+            self.run_all()
+        finally:
+            self.refreshing = False
+
+    def _maybe_refresh(self):
+        # probes are frequent, the checks hit real backends: refresh at most every `recheck` seconds
+        now = time.time()
+        with self.lock:
+            stale = not self.status or any(now - s["checked_at"] > self.recheck for s in self.status.values())
+            if not stale or self.refreshing or not self.checks:
+                return
+            self.refreshing = True
+        threading.Thread(target=self._refresh, name="symphony-health-refresh", daemon=True).start()
+
+    def report(self):
+        self._maybe_refresh()
+        with self.lock:
+            dependencies = {name: dict(status) for name, status in self.status.items()}
+        for name in self.checks:
+            dependencies.setdefault(name, {"ok": None, "detail": "not checked yet", "required": self.checks[name][1]})
+        return {
+            "ready": self.ready(),
+            "serving": self.serving,
+            "draining": self.draining,
+            "uptime": round(time.monotonic() - self.started, 1),
+            "dependencies": dependencies
+        }
+
+    def gauges(self):
+        with self.lock:
+            return [("symphony_dependency_up", {"dependency": name}, 1 if status["ok"] else 0) for name, status in self.status.items()]
+
+    def healthz(self):
+        body = {"status": "draining" if self.draining else "ok", "uptime": round(time.monotonic() - self.started, 1)}
+        return 200, "application/json", json.dumps(body)
+
+    def readyz(self):
+        report = self.report()
+        return (200 if report["ready"] else 503), "application/json", json.dumps(report)
+
+    def expose(self):
+        add_route("/healthz", self.healthz)
+        add_route("/readyz", self.readyz)
@@ -0,0 +1,498 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import datetime
+import threading
+from metrics import span, aspan
+
+
+# where conversations live: chat_mem (the turns of every thread), chat_summaries (the rolling
+# summary of long threads, see summaries.py) and bot_settings (the model picked per channel).
+# both handlers go through one of these instead of building PostgREST queries themselves.
+#
+# SupabaseConversationStore is the shared one. appending a turn to a thread that isn't in
+# memory yet goes through the append_chat_turn() function from the README, which inserts the
+# row and returns the thread's latest window in the same round trip; history reads are served
+# by the (thread_ts, created_at) index. SqliteConversationStore keeps the same tables in a
+# local WAL-mode file for single-node setups (and the bench), where storage is effectively free.
+#
+# rows are dicts with channel_id, thread_ts, user_name, role, content, created_at (ISO text);
+# windows come back oldest first.
+#
+# cold threads can be moved out of chat_mem into chat_archive, one compressed row per thread
+# (see retention.py). reading a thread that was archived puts it back first and notes it in
+# chat_restored, which keeps it live for another archive period even if nobody replies. history reads
+# are bounded below by the thread's start time (a Slack ts is epoch seconds), which is what
+# lets a chat_mem partitioned by created_at skip every partition older than the thread.
+
+WINDOW_COLUMNS = "role, content, created_at"
+# clock skew allowance between Slack's ts and our created_at
+THREAD_START_SLACK = 3600
+
+
+def thread_started(thread_ts):
+    # ISO lower bound for the created_at of any row in this thread, None if the ts isn't a Slack ts
+    try:
+        started = float(thread_ts) - THREAD_START_SLACK
+    except (TypeError, ValueError):
+        return None
+    return datetime.datetime.fromtimestamp(started, datetime.timezone.utc).isoformat()
+
+
+def may_be_archived(thread_ts, horizon):
+    # threads younger than the archive horizon can't have gone cold yet, so a miss means "new thread"
+    if horizon is None:
+        return False
+    try:
+        return float(thread_ts) < time.time() - horizon
+    except (TypeError, ValueError):
+        return True
+
+
+def iso_before(seconds):
+    return (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=seconds)).isoformat()
+
+
+def pack_turns(rows):
+    return zlib.compress(json.dumps(rows, ensure_ascii=False).encode("utf-8"), 9)
+
+
+def unpack_turns(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SupabaseConversationStore:
+    shared = True
+
+    def __init__(self, supabase, table="chat_mem", settings_table="bot_settings", summaries_table="chat_summaries",
+                 append_function="append_chat_turn", archive_horizon=None, partitioned=False):
+        # archive_horizon: seconds of inactivity after which threads may be archived (None = never)
+        # partitioned: chat_mem is the range-partitioned table from the README
+        self.supabase = supabase
+        self.table = table
+        self.settings_table = settings_table
+        self.summaries_table = summaries_table
+        self.append_function = append_function
+        self.archive_horizon = archive_horizon
+        self.partitioned = partitioned
+
+    def _recent_query(self, thread_ts, limit):
+        query = self.supabase.table(self.table) \
+            .select(WINDOW_COLUMNS) \
+            .eq("thread_ts", thread_ts)
+        started = thread_started(thread_ts)
+        if started:
+            query = query.gte("created_at", started)
+        return query.order("created_at", desc=True).limit(limit)
+
+    def _restore_query(self, thread_ts):
+        return self.supabase.rpc("restore_chat_thread", {"p_thread_ts": thread_ts})
+
+    def _append_query(self, row, limit):
+        return self.supabase.rpc(self.append_function, {
+            "p_channel_id": row["channel_id"],
+            "p_thread_ts": row["thread_ts"],
+            "p_user_name": row.get("user_name"),
+            "p_role": row["role"],
+            "p_content": row["content"],
+            "p_created_at": row.get("created_at"),
+            "p_limit": limit,
+        })
+
+    def _channel_query(self, channel_id, since, limit):
+        query = self.supabase.table(self.table) \
+            .select("thread_ts, role, content, created_at") \
+            .eq("channel_id", channel_id)
+        if since:
+            query = query.gt("created_at", since)
+        return query.order("created_at", desc=True).limit(limit)
+
+    def _model_query(self, channel_id):
+        return self.supabase.table(self.settings_table) \
+            .select("selected_model") \
+            .eq("channel_id", channel_id)
+
+    def _set_model_query(self, channel_id, model):
+        return self.supabase.table(self.settings_table).upsert({
+            "channel_id": channel_id,
+            "selected_model": model
+        })
+
+    def _summary_query(self, thread_ts):
+        return self.supabase.table(self.summaries_table) \
+            .select("summary, covered_until") \
+            .eq("thread_ts", thread_ts) \
+            .limit(1)
+
+    def recent(self, thread_ts, limit):
+        with span("supabase", op=f"{self.table}.select"):
+            data = self._recent_query(thread_ts, limit).execute().data
+        if not data and may_be_archived(thread_ts, self.archive_horizon) and self.restore(thread_ts):
+            with span("supabase", op=f"{self.table}.select"):
+                data = self._recent_query(thread_ts, limit).execute().data
+        return list(reversed(data or []))
+
+    def restore(self, thread_ts):
+        # puts an archived thread back into chat_mem; returns how many turns came back
+        with span("supabase", op="restore_chat_thread.rpc"):
+            restored = self._restore_query(thread_ts).execute().data or 0
+        if restored:
+            print(f"rehydrated {restored} archived turns of thread {thread_ts} :3")
+        return restored
+
+    def archive_cold(self, before, limit):
+        # moves threads with no turns since `before` into chat_archive; one batch of up to `limit` threads
+        with span("supabase", op="archive_chat_threads.rpc"):
+            data = self.supabase.rpc("archive_chat_threads", {"p_idle_before": before, "p_limit": limit}).execute().data
+        row = (data or [{}])[0]
+        return {"threads": row.get("threads") or 0, "rows": row.get("turns") or 0,
+                "bytes": max(0, (row.get("raw_bytes") or 0) - (row.get("archived_bytes") or 0))}
+
+    def expire(self, before, overrides):
+        # deletes threads (live or archived) idle since `before`, or since their channel's own cutoff in
+        # overrides (None keeps that channel forever). returns the (channel_id, thread_ts) pairs it removed
+        with span("supabase", op="expire_chat_threads.rpc"):
+            data = self.supabase.rpc("expire_chat_threads", {"p_default_before": before, "p_overrides": overrides}).execute().data
+        expired = [(row["channel_id"], row["thread_ts"]) for row in data or []]
+        return {"threads": len({thread_ts for _, thread_ts in expired}), "rows": sum(row["turns"] for row in data or []),
+                "bytes": sum(row["bytes"] for row in data or []), "expired": expired}
+
+    def maintain(self, drop_before):
+        # partitioned chat_mem only: create the coming months' partitions, drop empty ones older than drop_before
+        if not self.partitioned:
+            return 0
+        with span("supabase", op="maintain_chat_mem_partitions.rpc"):
+            return self.supabase.rpc("maintain_chat_mem_partitions", {"p_drop_before": drop_before}).execute().data or 0
+
+    def append_recent(self, row, limit):
+        # inserts the turn and returns the window that ends with it, in one round trip
+        with span("supabase", op=f"{self.append_function}.rpc"):
+            data = self._append_query(row, limit).execute().data
+        return list(reversed(data or []))
+
+    def insert(self, rows):
+        with span("supabase", op=f"{self.table}.insert"):
+            self.supabase.table(self.table).insert(rows).execute()
+
+    def channel_rows(self, channel_id, since=None, limit=2000):
+        # the channel's latest rows (newer than `since`), for the recall index
+        with span("supabase", op=f"{self.table}.select"):
+            data = self._channel_query(channel_id, since, limit).execute().data
+        return list(reversed(data or []))
+
+    def get_model(self, channel_id):
+        with span("supabase", op=f"{self.settings_table}.select"):
+            data = self._model_query(channel_id).execute().data
+        return data[0]["selected_model"] if data else None
+
+    def set_model(self, channel_id, model):
+        with span("supabase", op=f"{self.settings_table}.upsert"):
+            self._set_model_query(channel_id, model).execute()
+
+    def get_summary(self, thread_ts):
+        # {"summary", "covered_until"} of the thread, None when it has no summary yet
+        with span("supabase", op=f"{self.summaries_table}.select"):
+            data = self._summary_query(thread_ts).execute().data
+        return dict(data[0]) if data else None
+
+    def set_summary(self, row):
+        with span("supabase", op=f"{self.summaries_table}.upsert"):
+            self.supabase.table(self.summaries_table).upsert(row).execute()
+
+    def forget_summaries(self, thread_ids):
+        thread_ids = list(thread_ids)
+        for start in range(0, len(thread_ids), 100):
+            with span("supabase", op=f"{self.summaries_table}.delete"):
+                self.supabase.table(self.summaries_table).delete().in_("thread_ts", thread_ids[start:start + 100]).execute()
+
+
+class AsyncSupabaseConversationStore(SupabaseConversationStore):
+    # reads and model settings with the async client. the write-behind writer runs on its
+    # own thread and keeps a sync store, so insert() isn't awaited anywhere
+    async def recent(self, thread_ts, limit):
+        async with aspan("supabase", op=f"{self.table}.select"):
+            res = await self._recent_query(thread_ts, limit).execute()
+        if not res.data and may_be_archived(thread_ts, self.archive_horizon):
+            async with aspan("supabase", op="restore_chat_thread.rpc"):
+                restored = (await self._restore_query(thread_ts).execute()).data or 0
+            if restored:
+                print(f"rehydrated {restored} archived turns of thread {thread_ts} :3")
+                async with aspan("supabase", op=f"{self.table}.select"):
+                    res = await self._recent_query(thread_ts, limit).execute()
+        return list(reversed(res.data or []))
+
+    async def append_recent(self, row, limit):
+        async with aspan("supabase", op=f"{self.append_function}.rpc"):
+            res = await self._append_query(row, limit).execute()
+        return list(reversed(res.data or []))
+
+    async def get_model(self, channel_id):
+        async with aspan("supabase", op=f"{self.settings_table}.select"):
+            res = await self._model_query(channel_id).execute()
+        return res.data[0]["selected_model"] if res.data else None
+
+    async def set_model(self, channel_id, model):
+        async with aspan("supabase", op=f"{self.settings_table}.upsert"):
+            await self._set_model_query(channel_id, model).execute()
+
+    async def get_summary(self, thread_ts):
+        async with aspan("supabase", op=f"{self.summaries_table}.select"):
+            res = await self._summary_query(thread_ts).execute()
+        return dict(res.data[0]) if res.data else None
+
+    async def set_summary(self, row):
+        async with aspan("supabase", op=f"{self.summaries_table}.upsert"):
+            await self.supabase.table(self.summaries_table).upsert(row).execute()
+
+
+class SqliteConversationStore:
+    shared = False
+
+    def __init__(self, path="symphony.db", table="chat_mem", settings_table="bot_settings", summaries_table="chat_summaries",
+                 archive_table="chat_archive", restored_table="chat_restored", archive_horizon=None):
+        self.path = path
+        self.table = table
+        self.settings_table = settings_table
+        self.summaries_table = summaries_table
+        self.archive_table = archive_table
+        self.restored_table = restored_table
+        self.archive_horizon = archive_horizon
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            # (only takes effect on a new file) lets maintain() hand freed pages back to the filesystem
+            self.conn.execute("pragma auto_vacuum=incremental")
+            self.conn.execute("pragma journal_mode=wal")
+            self.conn.execute("pragma synchronous=normal")
+            self.conn.execute(
+                f"create table if not exists {table} ("
+                " id integer primary key autoincrement, channel_id text not null, thread_ts text not null,"
+                " user_name text, role text not null, content text not null, created_at text not null)"
+            )
+            self.conn.execute(f"create index if not exists {table}_thread_created_idx on {table} (thread_ts, created_at)")
+            self.conn.execute(f"create index if not exists {table}_channel_created_idx on {table} (channel_id, created_at)")
+            self.conn.execute(
+                f"create table if not exists {settings_table} ("
+                " channel_id text primary key, selected_model text not null, updated_at text default current_timestamp)"
+            )
+            self.conn.execute(
+                f"create table if not exists {summaries_table} ("
+                " thread_ts text primary key, summary text not null, covered_until text, updated_at text not null)"
+            )
+            self.conn.execute(
+                f"create table if not exists {archive_table} ("
+                " thread_ts text primary key, channel_id text not null, turns blob not null, turn_count integer not null,"
+                " raw_bytes integer not null, stored_bytes integer not null, last_activity text not null, archived_at text not null)"
+            )
+            self.conn.execute(f"create index if not exists {archive_table}_channel_activity_idx on {archive_table} (channel_id, last_activity)")
+            self.conn.execute(f"create table if not exists {restored_table} (thread_ts text primary key, restored_at text not null)")
+            self.conn.commit()
+
+    def _window(self, thread_ts, limit):
+        rows = self.conn.execute(
+            f"select role, content, created_at from {self.table} where thread_ts = ? and created_at >= ?"
+            " order by created_at desc limit ?",
+            (thread_ts, thread_started(thread_ts) or "", limit)
+        ).fetchall()
+        if not rows and may_be_archived(thread_ts, self.archive_horizon) and self._restore(thread_ts):
+            return self._window(thread_ts, limit)
+        return [dict(row) for row in reversed(rows)]
+
+    def _restore(self, thread_ts):
+        row = self.conn.execute(f"select turns from {self.archive_table} where thread_ts = ?", (thread_ts,)).fetchone()
+        if not row:
+            return 0
+        turns = unpack_turns(row["turns"])
+        self._insert(turns)
+        self.conn.execute(f"delete from {self.archive_table} where thread_ts = ?", (thread_ts,))
+        self.conn.execute(
+            f"insert or replace into {self.restored_table} (thread_ts, restored_at) values (?, ?)",
+            (thread_ts, datetime.datetime.now(datetime.timezone.utc).isoformat())
+        )
+        self.conn.commit()
+        print(f"rehydrated {len(turns)} archived turns of thread {thread_ts} :3")
+        return len(turns)
+
+    def restore(self, thread_ts):
+        with span("sqlite", op=f"{self.archive_table}.restore"), self.lock:
+            return self._restore(thread_ts)
+
+    def archive_cold(self, before, limit):
+        moved = {"threads": 0, "rows": 0, "bytes": 0}
+        with span("sqlite", op=f"{self.archive_table}.archive"), self.lock:
+            self.conn.execute(f"delete from {self.restored_table} where restored_at < ?", (before,))
+            cold = self.conn.execute(
+                f"select thread_ts from {self.table} where thread_ts not in (select thread_ts from {self.restored_table})"
+                " group by thread_ts having max(created_at) < ? limit ?",
+                (before, limit)
+            ).fetchall()
+            for (thread_ts,) in cold:
+                rows = [dict(r) for r in self.conn.execute(
+                    f"select channel_id, thread_ts, user_name, role, content, created_at from {self.table}"
+                    " where thread_ts = ? order by created_at", (thread_ts,)
+                ).fetchall()]
+                previous = self.conn.execute(f"select turns from {self.archive_table} where thread_ts = ?", (thread_ts,)).fetchone()
+                turns = (unpack_turns(previous["turns"]) if previous else []) + rows
+                blob = pack_turns(turns)
+                raw = sum(len((r["content"] or "").encode("utf-8")) for r in rows)
+                self.conn.execute(
+                    f"insert or replace into {self.archive_table}"
+                    " (thread_ts, channel_id, turns, turn_count, raw_bytes, stored_bytes, last_activity, archived_at)"
+                    " values (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_ts, rows[0]["channel_id"], blob, len(turns),
+                     sum(len((r["content"] or "").encode("utf-8")) for r in turns), len(blob),
+                     rows[-1]["created_at"], datetime.datetime.now(datetime.timezone.utc).isoformat())
+                )
+                self.conn.execute(f"delete from {self.table} where thread_ts = ? and created_at <= ?", (thread_ts, rows[-1]["created_at"]))
+                moved["threads"] += 1
+                moved["rows"] += len(rows)
+                moved["bytes"] += max(0, raw - (len(blob) - (len(previous["turns"]) if previous else 0)))
+            self.conn.commit()
+        return moved
+
+    def expire(self, before, overrides):
+        # deletes threads (live or archived) idle since `before`, or since their channel's own cutoff in
+        # overrides (None keeps that channel forever). returns the (channel_id, thread_ts) pairs it removed
+        gone = {"threads": 0, "rows": 0, "bytes": 0, "expired": []}
+        cutoffs = [c for c in [before, *overrides.values()] if c]
+        if not cutoffs:
+            return gone
+        loosest = max(cutoffs)
+        with span("sqlite", op=f"{self.table}.expire"), self.lock:
+            live = self.conn.execute(
+                f"select thread_ts, channel_id, count(*) as turns, sum(length(cast(content as blob))) as size,"
+                f" max(created_at) as last_activity from {self.table} group by thread_ts having last_activity < ?",
+                (loosest,)
+            ).fetchall()
+            archived = self.conn.execute(
+                f"select thread_ts, channel_id, turn_count as turns, stored_bytes as size, last_activity"
+                f" from {self.archive_table} where last_activity < ?",
+                (loosest,)
+            ).fetchall()
+            for table, found in ((self.table, live), (self.archive_table, archived)):
+                doomed = []
+                for row in found:
+                    cutoff = overrides.get(row["channel_id"], before)
+                    if cutoff and row["last_activity"] < cutoff:
+                        doomed.append((row["thread_ts"],))
+                        gone["rows"] += row["turns"]
+                        gone["bytes"] += row["size"] or 0
+                        gone["expired"].append((row["channel_id"], row["thread_ts"]))
+                self.conn.executemany(f"delete from {table} where thread_ts = ?", doomed)
+            self.conn.commit()
+        gone["threads"] = len({thread_ts for _, thread_ts in gone["expired"]})
+        return gone
+
+    def maintain(self, drop_before):
+        # no partitions in sqlite; the freed pages go back to the filesystem instead
+        with span("sqlite", op="incremental_vacuum"), self.lock:
+            self.conn.execute("pragma incremental_vacuum")
+            self.conn.commit()
+        return 0
+
+    def _insert(self, rows):
+        self.conn.executemany(
+            f"insert into {self.table} (channel_id, thread_ts, user_name, role, content, created_at) values (?, ?, ?, ?, ?, ?)",
+            [(r["channel_id"], r["thread_ts"], r.get("user_name"), r["role"], r["content"], r["created_at"]) for r in rows]
+        )
+
+    def recent(self, thread_ts, limit):
+        with span("sqlite", op=f"{self.table}.select"), self.lock:
+            return self._window(thread_ts, limit)
+
+    def append_recent(self, row, limit):
+        with span("sqlite", op=f"{self.table}.append"), self.lock:
+            self._insert([row])
+            self.conn.commit()
+            return self._window(row["thread_ts"], limit)
+
+    def insert(self, rows):
+        with span("sqlite", op=f"{self.table}.insert"), self.lock:
+            self._insert(rows)
+            self.conn.commit()
+
+    def channel_rows(self, channel_id, since=None, limit=2000):
+        with span("sqlite", op=f"{self.table}.select"), self.lock:
+            rows = self.conn.execute(
+                f"select thread_ts, role, content, created_at from {self.table}"
+                " where channel_id = ? and created_at > ? order by created_at desc limit ?",
+                (channel_id, since or "", limit)
+            ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def get_model(self, channel_id):
+        with span("sqlite", op=f"{self.settings_table}.select"), self.lock:
+            row = self.conn.execute(
+                f"select selected_model from {self.settings_table} where channel_id = ?", (channel_id,)
+            ).fetchone()
+        return row["selected_model"] if row else None
+
+    def set_model(self, channel_id, model):
+        with span("sqlite", op=f"{self.settings_table}.upsert"), self.lock:
+            self.conn.execute(
+                f"insert into {self.settings_table} (channel_id, selected_model, updated_at) values (?, ?, current_timestamp)"
+                " on conflict (channel_id) do update set selected_model = excluded.selected_model, updated_at = excluded.updated_at",
+                (channel_id, model)
+            )
+            self.conn.commit()
+
+    def get_summary(self, thread_ts):
+        with span("sqlite", op=f"{self.summaries_table}.select"), self.lock:
+            row = self.conn.execute(
+                f"select summary, covered_until from {self.summaries_table} where thread_ts = ?", (thread_ts,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def set_summary(self, row):
+        with span("sqlite", op=f"{self.summaries_table}.upsert"), self.lock:
+            self.conn.execute(
+                f"insert or replace into {self.summaries_table} (thread_ts, summary, covered_until, updated_at) values (?, ?, ?, ?)",
+                (row["thread_ts"], row["summary"], row.get("covered_until"), row["updated_at"])
+            )
+            self.conn.commit()
+
+    def forget_summaries(self, thread_ids):
+        with span("sqlite", op=f"{self.summaries_table}.delete"), self.lock:
+            self.conn.executemany(f"delete from {self.summaries_table} where thread_ts = ?", [(t,) for t in thread_ids])
+            self.conn.commit()
+
+
+class AsyncSqliteConversationStore(SqliteConversationStore):
+    # local file, microseconds per call: awaited only so the handlers look the same
+    async def recent(self, thread_ts, limit):
+        return super().recent(thread_ts, limit)
+
+    async def restore(self, thread_ts):
+        return super().restore(thread_ts)
+
+    async def append_recent(self, row, limit):
+        return super().append_recent(row, limit)
+
+    async def get_model(self, channel_id):
+        return super().get_model(channel_id)
+
+    async def set_model(self, channel_id, model):
+        super().set_model(channel_id, model)
+
+    async def get_summary(self, thread_ts):
+        return super().get_summary(thread_ts)
+
+    async def set_summary(self, row):
+        super().set_summary(row)
+
+
+def create_conversation_store(kind, supabase, path="symphony.db", archive_horizon=None, partitioned=False):
+    if kind == "sqlite":
+        return SqliteConversationStore(path, archive_horizon=archive_horizon)
+    return SupabaseConversationStore(supabase, archive_horizon=archive_horizon, partitioned=partitioned)
+
+
+def create_async_conversation_store(kind, async_supabase, path="symphony.db", archive_horizon=None):
+    if kind == "sqlite":
+        return AsyncSqliteConversationStore(path, archive_horizon=archive_horizon)
+    return AsyncSupabaseConversationStore(async_supabase, archive_horizon=archive_horizon)
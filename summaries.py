@@ -0,0 +1,159 @@
+import threading
+from cache import TTLCache
+from history import utc_now_iso, _parse_ts
+from tokens import count_tokens, message_tokens
+
+
+# rolling per-thread summaries so long threads don't resend every verbatim research dump.
+# the prompt gets the summary plus the turns it doesn't cover yet, trimmed to the model's
+# token budget. after the reply, turns that no longer fit (or are about to fall out of the
+# history window) are folded into the summary in the background: one small LLM call that
+# updates the previous summary instead of re-reading the whole thread. the summary rows live
+# in the conversation store (store.py), next to the turns they summarize.
+
+EMPTY = {"summary": "", "covered_until": None}
+
+
+class ThreadSummaries:
+    def __init__(self, store, summarize, budget=8000, budgets=None,
+                 keep_recent=4, window=10, ttl=1800, maxsize=2000):
+        # store: conversation store, summarize(previous_summary, turns) -> new summary text
+        self.store = store
+        self.summarize = summarize
+        self.budget = budget
+        self.budgets = budgets or {}
+        self.keep_recent = keep_recent
+        self.window = window
+        self.cache = TTLCache("thread_summaries", maxsize=maxsize, ttl=ttl)
+        self.folding = set()
+        self.lock = threading.Lock()
+
+    def budget_for(self, model):
+        return self.budgets.get(model, self.budget)
+
+    def _loaded(self, thread_ts, record):
+        record = record or dict(EMPTY)
+        self.cache.set(thread_ts, record)
+        return record
+
+    def get(self, thread_ts):
+        record = self.cache.get(thread_ts)
+        if record is not None:
+            return record
+        try:
+            return self._loaded(thread_ts, self.store.get_summary(thread_ts))
+        except Exception as e:
+            print(f"unable to load thread summary, going without. {e}")
+            return dict(EMPTY)
+
+    def _uncovered(self, record, turns):
+        covered_until = _parse_ts(record.get("covered_until")) if record.get("covered_until") else None
+        if covered_until is None:
+            return list(turns)
+        return [t for t in turns if (_parse_ts(t.get("created_at")) or covered_until) > covered_until]
+
+    def _select(self, record, turns, model):
+        fresh = self._uncovered(record, turns)
+        budget = self.budget_for(model)
+        used = count_tokens(record["summary"]) + sum(message_tokens(t) for t in fresh)
+        while used > budget and len(fresh) > self.keep_recent:
+            # over budget before the fold caught up: the oldest turns sit this one out
+            used -= message_tokens(fresh.pop(0))
+        return record["summary"], fresh
+
+    def _to_fold(self, record, turns, model):
+        fresh = self._uncovered(record, turns)
+        if len(fresh) <= self.keep_recent:
+            return []
+        used = count_tokens(record["summary"]) + sum(message_tokens(t) for t in fresh)
+        if used > self.budget_for(model):
+            return fresh[:-self.keep_recent]
+        if len(fresh) >= self.window:
+            # the oldest of these are about to drop out of the history window, summarize them first
+            return fresh[:len(fresh) // 2]
+        return []
+
+    def prepare(self, thread_ts, turns, model):
+        # returns (summary, turns to send), together within the model's history budget
+        return self._select(self.get(thread_ts), turns, model)
+
+    def _claim(self, thread_ts):
+        with self.lock:
+            if thread_ts in self.folding:
+                return False
+            self.folding.add(thread_ts)
+            return True
+
+    def _release(self, thread_ts):
+        with self.lock:
+            self.folding.discard(thread_ts)
+
+    def _row(self, thread_ts, folded, summary):
+        return {
+            "thread_ts": thread_ts,
+            "summary": summary,
+            "covered_until": folded[-1].get("created_at") or utc_now_iso(),
+            "updated_at": utc_now_iso(),
+        }
+
+    def fold(self, thread_ts, turns, model):
+        # call after a reply with the thread's current turns; cheap no-op when nothing needs folding
+        record = self.get(thread_ts)
+        folded = self._to_fold(record, turns, model)
+        if not folded or not self._claim(thread_ts):
+            return
+        try:
+            summary = self.summarize(record["summary"], folded)
+            if not summary:
+                return
+            row = self._row(thread_ts, folded, summary)
+            self.cache.set(thread_ts, {"summary": row["summary"], "covered_until": row["covered_until"]})
+            self.store.set_summary(row)
+            print(f"folded {len(folded)} turns of {thread_ts} into its summary :3")
+        except Exception as e:
+            print(f"unable to update thread summary. {e}")
+        finally:
+            self._release(thread_ts)
+
+    def forget(self, thread_ids, store=None):
+        # retention drops expired threads' summaries too. runs on the retention thread, so the
+        # asyncio flavour passes its sync store here
+        thread_ids = list(thread_ids)
+        for thread_ts in thread_ids:
+            self.cache.invalidate(thread_ts)
+        (store or self.store).forget_summaries(thread_ids)
+
+
+# asyncio flavour: async conversation store for the summary row, summarize is a coroutine function
+
+class AsyncThreadSummaries(ThreadSummaries):
+    async def get(self, thread_ts):
+        record = self.cache.get(thread_ts)
+        if record is not None:
+            return record
+        try:
+            return self._loaded(thread_ts, await self.store.get_summary(thread_ts))
+        except Exception as e:
+            print(f"unable to load thread summary, going without. {e}")
+            return dict(EMPTY)
+
+    async def prepare(self, thread_ts, turns, model):
+        return self._select(await self.get(thread_ts), turns, model)
+
+    async def fold(self, thread_ts, turns, model):
+        record = await self.get(thread_ts)
+        folded = self._to_fold(record, turns, model)
+        if not folded or not self._claim(thread_ts):
+            return
+        try:
+            summary = await self.summarize(record["summary"], folded)
+            if not summary:
+                return
+            row = self._row(thread_ts, folded, summary)
+            self.cache.set(thread_ts, {"summary": row["summary"], "covered_until": row["covered_until"]})
+            await self.store.set_summary(row)
+            print(f"folded {len(folded)} turns of {thread_ts} into its summary :3")
+        except Exception as e:
+            print(f"unable to update thread summary. {e}")
+        finally:
+            self._release(thread_ts)
@@ -0,0 +1,76 @@
+from history import WriteBehindWriter, ThreadHistoryCache
+
+
+class FlushingStore:
+    # flushes the writer while a read is in flight, like the background thread could
+    def __init__(self):
+        self.rows = []
+        self.writer = None
+
+    def insert(self, rows):
+        self.rows.extend(rows)
+
+    def recent(self, thread_ts, limit):
+        rows = [row for row in self.rows if row["thread_ts"] == thread_ts][-limit:]
+        self.writer.flush()
+        return rows
+
+
+def test_row_flushed_during_a_read_is_not_lost():
+    store = FlushingStore()
+    writer = WriteBehindWriter(store, journal_path=None, flush_interval=3600)
+    store.writer = writer
+    try:
+        writer.enqueue({"thread_ts": "1.0", "role": "user", "content": "hi", "created_at": "2026-01-01T00:00:00+00:00"})
+        memory = ThreadHistoryCache(store, writer)
+        assert [turn["content"] for turn in memory.recent("1.0")] == ["hi"]
+    finally:
+        writer.close()
+
+
+class PickyStore:
+    # refuses rows without content, like the not null column does
+    def __init__(self):
+        self.rows = []
+        self.down = False
+
+    def insert(self, rows):
+        if self.down or any(row["content"] is None for row in rows):
+            raise RuntimeError("refused")
+        self.rows.extend(rows)
+
+
+def turn(content, n):
+    return {"thread_ts": "1.0", "role": "assistant", "content": content, "created_at": f"2026-01-01T00:00:0{n}+00:00"}
+
+
+def test_bad_row_is_set_aside_instead_of_blocking_the_queue(tmp_path):
+    store = PickyStore()
+    journal = str(tmp_path / "journal.jsonl")
+    writer = WriteBehindWriter(store, journal_path=journal, flush_interval=3600)
+    try:
+        writer.enqueue(turn(None, 0))
+        writer.enqueue(turn("fine", 1))
+        assert writer.flush()
+        assert [row["content"] for row in store.rows] == ["fine"]
+        assert writer.pending == [] and writer.rejected_rows == 1
+        with open(journal + ".rejected") as f:
+            assert '"content": null' in f.read()
+    finally:
+        writer.close()
+
+
+def test_rows_are_kept_while_the_store_is_down(tmp_path):
+    store = PickyStore()
+    store.down = True
+    writer = WriteBehindWriter(store, journal_path=None, flush_interval=3600)
+    try:
+        writer.enqueue(turn("a", 0))
+        writer.enqueue(turn("b", 1))
+        assert not writer.flush()
+        assert len(writer.pending) == 2 and writer.rejected_rows == 0
+        store.down = False
+        assert writer.flush()
+        assert [row["content"] for row in store.rows] == ["a", "b"]
+    finally:
+        writer.close()
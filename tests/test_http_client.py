@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+import requests
+from http_client import CircuitBreaker, CircuitOpenError, Endpoint, HttpLayer, AsyncHttpLayer
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_and_fails_fast():
+    breaker = CircuitBreaker("search", threshold=2, reset_timeout=60)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker("search", threshold=1, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.before_call() is None
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("search", threshold=3, reset_timeout=0)
+    open_breaker(breaker)
+    breaker.before_call()
+    breaker.record_failure()
+    assert not breaker.probing
+    assert breaker.opened_at is not None
+
+
+def test_sync_probe_released_on_unexpected_error():
+    layer = HttpLayer([Endpoint("search")], breaker_threshold=1, breaker_reset=0)
+    breaker = layer.breakers["search"]
+    open_breaker(breaker)
+
+    def explode(*args, **kwargs):
+        raise ValueError("not an HTTP error")
+
+    layer.session.request = explode
+    with pytest.raises(ValueError):
+        layer.get("search", "http://example.invalid")
+    assert not breaker.probing
+
+    layer.session.request = lambda *args, **kwargs: FakeResponse(200)
+    assert layer.get("search", "http://example.invalid").status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_sync_request_errors_count_as_failures():
+    layer = HttpLayer([Endpoint("search")], breaker_threshold=1, breaker_reset=60)
+
+    def refuse(*args, **kwargs):
+        raise requests.ConnectionError("refused")
+
+    layer.session.request = refuse
+    with pytest.raises(requests.ConnectionError):
+        layer.get("search", "http://example.invalid")
+    assert layer.breakers["search"].state == "open"
+
+
+class SlowClient:
+    def __init__(self):
+        self.status = None
+
+    async def request(self, method, url, **kwargs):
+        if self.status is None:
+            await asyncio.sleep(10)
+        return FakeResponse(self.status)
+
+
+def test_async_probe_released_when_cancelled():
+    async def run():
+        client = SlowClient()
+        layer = AsyncHttpLayer(client, [Endpoint("search")], breaker_threshold=1, breaker_reset=0)
+        breaker = layer.breakers["search"]
+        open_breaker(breaker)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.get("search", "http://example.invalid"), 0.05)
+        assert not breaker.probing
+        client.status = 200
+        await layer.get("search", "http://example.invalid")
+        return breaker.state
+
+    assert asyncio.run(run()) == "closed"
+
+
+def test_async_server_errors_count_as_failures():
+    async def run():
+        client = SlowClient()
+        client.status = 503
+        layer = AsyncHttpLayer(client, [Endpoint("search")], breaker_threshold=2, breaker_reset=60)
+        await layer.get("search", "http://example.invalid")
+        await layer.get("search", "http://example.invalid")
+        with pytest.raises(CircuitOpenError):
+            await layer.get("search", "http://example.invalid")
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+from jobs import JobRunner, SqliteJobStore
+from coordination import Coordinator, MemoryStore
+
+
+def test_retry_sees_the_checkpoint(tmp_path):
+    store = SqliteJobStore(str(tmp_path / "jobs.db"))
+    seen = []
+
+    def handler(job, progress):
+        seen.append(dict(job["args"]))
+        if not job["args"].get("uploaded"):
+            runner.checkpoint(job, uploaded=2)
+        if len(seen) == 1:
+            raise RuntimeError("finishing up failed")
+
+    runner = JobRunner(store, {"image_generate": handler}, Coordinator(MemoryStore()), retry_delay=0)
+    job = runner.new_job("image_generate", {"prompt": "a cat"}, "C1", "1.0")
+    store.insert(job)
+    runner._attempt(job)
+    [retry] = store.unfinished()
+    assert retry["args"] == {"prompt": "a cat", "uploaded": 2}
+    runner._attempt(retry)
+    assert seen[1]["uploaded"] == 2
+    assert store.unfinished() == []
+
+
+def test_progress_renews_the_lease(tmp_path):
+    store = SqliteJobStore(str(tmp_path / "jobs.db"))
+    coordinator = Coordinator(MemoryStore())
+    expiries = []
+
+    def handler(job, progress):
+        key = f"job:{job['id']}"
+        expiries.append(coordinator.store.leases[key][1])
+        runner.lease_ttl = 1000
+        progress("halfway there")
+        expiries.append(coordinator.store.leases[key][1])
+
+    runner = JobRunner(store, {"deep_research": handler}, coordinator, lease_ttl=5)
+    job = runner.new_job("deep_research", {"prompt": "cats"}, "C1", "1.0")
+    store.insert(job)
+    runner._run(job)
+    assert expiries[1] - expiries[0] > 900
+    assert not coordinator.store.renew(f"job:{job['id']}", "someone else", 10)
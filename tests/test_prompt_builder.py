@@ -0,0 +1,51 @@
+from prompt_builder import PromptBuilder
+
+
+def builder():
+    return PromptBuilder(
+        "be nice",
+        [{"type": "function", "function": {"name": "web_search"}}],
+        lambda user_name, current_time: f"{user_name} at {current_time}",
+        summary=lambda summary: f"summary: {summary}",
+        recall=lambda snippets: "recall: " + ", ".join(s["text"] for s in snippets),
+    )
+
+
+def history():
+    return [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hello"},
+        {"role": "user", "content": "what's new?"},
+    ]
+
+
+def test_only_the_first_message_is_a_system_message():
+    prompt = builder().build("m", history(), summary="older stuff", recalled=[{"text": "a snippet"}],
+                             result="job output", user_name="orpheus", current_time="now")
+    assert [m["role"] for m in prompt.messages] == ["system", "user", "assistant", "user"]
+    last = prompt.messages[-1]["content"]
+    for text in ("summary: older stuff", "recall: a snippet", "job output", "orpheus at now"):
+        assert text in last
+    assert last.endswith("what's new?")
+    assert all(prompt.sections[s] for s in ("summary", "recall", "result", "context"))
+
+
+def test_history_and_prefix_stay_untouched():
+    b = builder()
+    rows = history()
+    prompt = b.build("m", rows, summary="older stuff", user_name="orpheus", current_time="now")
+    assert rows[-1]["content"] == "what's new?"
+    assert prompt.messages[1:3] == rows[:2]
+    assert b.build("m", rows).messages[0] is prompt.messages[0]
+
+
+def test_context_goes_in_front_of_images_and_after_the_bots_reply():
+    image = {"type": "image_url", "image_url": {"url": "data:"}}
+    prompt = builder().build("m", history(), images=[image], user_name="orpheus", current_time="now")
+    parts = prompt.messages[-1]["content"]
+    assert "orpheus at now" in parts[0]["text"] and parts[1]["text"] == "what's new?" and parts[2] == image
+
+    rows = history() + [{"role": "assistant", "content": "it's on its way"}]
+    prompt = builder().build("m", rows, result="job output")
+    assert [m["role"] for m in prompt.messages] == ["system", "user", "assistant", "user", "assistant", "user"]
+    assert "job output" in prompt.messages[-1]["content"]
@@ -0,0 +1,18 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+from recall import VectorIndex
+
+
+def meta(thread_ts, n):
+    return {"key": f"{thread_ts}:{n}", "thread_ts": thread_ts, "text": f"{thread_ts} {n}"}
+
+
+def test_search_skips_the_current_thread():
+    index = VectorIndex("test-embedding")
+    # the current thread has the closest rows; they must not take the other thread's place
+    index.add([[1, 0], [1, 0.01], [1, 0.02], [1, 0.5]], [meta("1.0", 0), meta("1.0", 1), meta("1.0", 2), meta("2.0", 0)])
+    query = np.array([1, 0], dtype=np.float32)
+    assert index.search(query, 1)[0][1]["thread_ts"] == "1.0"
+    assert [m["thread_ts"] for _, m in index.search(query, 1, exclude="1.0")] == ["2.0"]
+    assert all(m["thread_ts"] != "1.0" for score, m in index.search(query, 4, exclude="1.0") if score > -np.inf)
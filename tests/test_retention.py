@@ -0,0 +1,23 @@
+from retention import create_retention, DAY
+from store import SqliteConversationStore
+
+
+def test_off_by_default(tmp_path):
+    job = create_retention(SqliteConversationStore(str(tmp_path / "symphony.db")))
+    assert not job.enabled
+    job.start()
+    assert job.thread is None
+
+
+def test_archives_cold_threads_and_expires_per_channel(tmp_path):
+    store = SqliteConversationStore(str(tmp_path / "symphony.db"), archive_horizon=DAY)
+    old = "2020-01-01T00:00:00+00:00"
+    store.insert([
+        {"channel_id": "C1", "thread_ts": "1.0", "user_name": "ana", "role": "user", "content": "hi", "created_at": old},
+        {"channel_id": "C2", "thread_ts": "2.0", "user_name": "ana", "role": "user", "content": "hi", "created_at": old},
+    ])
+    expired = []
+    job = create_retention(store, archive_after_days=1, ttls_days={"C2": 7}, on_expired=expired.extend)
+    result = job.run_once()
+    assert result["archived"]["threads"] == 2
+    assert expired == [("C2", "2.0")]
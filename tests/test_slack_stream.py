@@ -0,0 +1,108 @@
+import time
+import asyncio
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.slack_response import SlackResponse
+from slack_stream import SlackStreamer, AsyncSlackStreamer
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def chat_postMessage(self, **kwargs):
+        self.calls.append(("post", kwargs["text"]))
+        return {"ts": "1.0"}
+
+    def chat_update(self, **kwargs):
+        self.calls.append(("update", kwargs["text"]))
+        return {"ok": True}
+
+
+class AsyncFakeClient(FakeClient):
+    async def chat_postMessage(self, **kwargs):
+        return FakeClient.chat_postMessage(self, **kwargs)
+
+    async def chat_update(self, **kwargs):
+        return FakeClient.chat_update(self, **kwargs)
+
+
+def test_edits_are_coalesced_per_interval():
+    client = FakeClient()
+    streamer = SlackStreamer(client, "C1", "1.0", min_interval=60)
+    streamer.start()
+    for token in ["a", "b", "c", "d"]:
+        streamer.append(token)
+    # first token edits right away, the rest wait for the interval
+    assert client.calls == [("post", "Thinking..."), ("update", "a")]
+
+
+def test_finish_skips_text_already_on_screen():
+    client = FakeClient()
+    streamer = SlackStreamer(client, "C1", "1.0", min_interval=60)
+    streamer.start()
+    streamer.append("hello")
+    started = time.monotonic()
+    assert streamer.finish("hello")
+    assert time.monotonic() - started < 0.5
+    assert client.calls == [("post", "Thinking..."), ("update", "hello")]
+
+
+def test_finish_sends_once_without_waiting_for_interval():
+    client = FakeClient()
+    streamer = SlackStreamer(client, "C1", "1.0", min_interval=60)
+    streamer.start()
+    streamer.append("hel")
+    streamer.append("lo")
+    started = time.monotonic()
+    assert streamer.finish("hello", blocks=[{"type": "context"}])
+    assert time.monotonic() - started < 0.5
+    assert client.calls == [("post", "Thinking..."), ("update", "hel"), ("update", "hello")]
+
+
+def test_finish_after_reset_resends():
+    client = FakeClient()
+    streamer = SlackStreamer(client, "C1", "1.0", min_interval=0)
+    streamer.start()
+    streamer.append("preamble")
+    streamer.reset("Searching...")
+    streamer.finish("preamble")
+    assert client.calls[-1] == ("update", "preamble")
+
+
+def test_finish_posts_when_nothing_was_posted():
+    client = FakeClient()
+    streamer = SlackStreamer(client, "C1", "1.0")
+    assert streamer.finish("hi")
+    assert client.calls == [("post", "hi")]
+
+
+def test_async_finish_skips_text_already_on_screen():
+    async def run():
+        client = AsyncFakeClient()
+        streamer = AsyncSlackStreamer(client, "C1", "1.0", min_interval=60)
+        await streamer.start()
+        await streamer.append("hel")
+        await streamer.append("lo")
+        assert await streamer.finish("hel")
+        assert await streamer.finish("hello")
+        return client.calls
+
+    assert asyncio.run(run()) == [("post", "Thinking..."), ("update", "hel"), ("update", "hello")]
+
+
+class RateLimitedClient(FakeClient):
+    def chat_update(self, **kwargs):
+        self.calls.append(("update", kwargs["text"]))
+        response = SlackResponse(client=None, http_verb="POST", api_url="", req_args={}, data={"ok": False, "error": "ratelimited"},
+                                 headers={"Retry-After": "30"}, status_code=429)
+        raise SlackApiError("ratelimited", response)
+
+
+def test_finish_gives_up_on_429_instead_of_waiting():
+    client = RateLimitedClient()
+    streamer = SlackStreamer(client, "C1", "1.0", min_interval=0)
+    streamer.start()
+    started = time.monotonic()
+    assert not streamer.finish("hello", blocks=[{"type": "context"}])
+    assert time.monotonic() - started < 0.5
+    assert client.calls == [("post", "Thinking..."), ("update", "hello")]
@@ -0,0 +1,76 @@
+import time
+import datetime
+from store import SqliteConversationStore, iso_before
+from summaries import ThreadSummaries
+
+
+def row(thread_ts, n, created_at=None, channel_id="C1"):
+    return {"channel_id": channel_id, "thread_ts": thread_ts, "user_name": "ana", "role": "user",
+            "content": f"turn {n}", "created_at": created_at or f"2026-01-01T00:00:{n:02d}+00:00"}
+
+
+def store(tmp_path, **kwargs):
+    return SqliteConversationStore(str(tmp_path / "symphony.db"), **kwargs)
+
+
+def test_recent_returns_the_latest_window_oldest_first(tmp_path):
+    s = store(tmp_path)
+    s.insert([row("1.0", n) for n in range(5)] + [row("2.0", 9)])
+    assert [r["content"] for r in s.recent("1.0", 3)] == ["turn 2", "turn 3", "turn 4"]
+
+
+def test_append_recent_writes_and_reads_back(tmp_path):
+    s = store(tmp_path)
+    s.insert([row("1.0", 0)])
+    assert [r["content"] for r in s.append_recent(row("1.0", 1), 10)] == ["turn 0", "turn 1"]
+
+
+def test_model_settings(tmp_path):
+    s = store(tmp_path)
+    assert s.get_model("C1") is None
+    s.set_model("C1", "a")
+    s.set_model("C1", "b")
+    assert s.get_model("C1") == "b"
+
+
+def test_summaries_round_trip_and_forget(tmp_path):
+    s = store(tmp_path)
+    assert s.get_summary("1.0") is None
+    s.set_summary({"thread_ts": "1.0", "summary": "old", "covered_until": "2026-01-01T00:00:00+00:00", "updated_at": "x"})
+    s.set_summary({"thread_ts": "1.0", "summary": "new", "covered_until": "2026-01-02T00:00:00+00:00", "updated_at": "y"})
+    assert s.get_summary("1.0") == {"summary": "new", "covered_until": "2026-01-02T00:00:00+00:00"}
+    s.forget_summaries(["1.0"])
+    assert s.get_summary("1.0") is None
+
+
+def test_thread_summaries_use_the_store(tmp_path):
+    s = store(tmp_path)
+    summaries = ThreadSummaries(s, lambda previous, turns: "folded", keep_recent=1, window=2)
+    turns = [{"role": "user", "content": f"turn {n}", "created_at": f"2026-01-01T00:00:0{n}+00:00"} for n in range(3)]
+    summaries.fold("1.0", turns, "m")
+    assert s.get_summary("1.0")["summary"] == "folded"
+    summaries.forget(["1.0"])
+    assert s.get_summary("1.0") is None
+    assert summaries.get("1.0")["summary"] == ""
+
+
+def test_archive_and_restore_on_read(tmp_path):
+    s = store(tmp_path, archive_horizon=60)
+    # a Slack ts from two days ago, last turn a day old
+    thread_ts = f"{time.time() - 2 * 86400:.6f}"
+    old = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)).isoformat()
+    s.insert([row(thread_ts, 0, old)])
+    moved = s.archive_cold(iso_before(3600), 10)
+    assert moved["threads"] == 1 and moved["rows"] == 1
+    assert [r["content"] for r in s.recent(thread_ts, 10)] == ["turn 0"]
+    # reading it counts as activity: the next pass leaves it live
+    assert s.archive_cold(iso_before(3600), 10)["threads"] == 0
+    assert s.recent(thread_ts, 10)
+
+
+def test_expire_honours_channel_overrides(tmp_path):
+    s = store(tmp_path)
+    s.insert([row("1.0", 0, channel_id="C1"), row("2.0", 0, channel_id="C2")])
+    gone = s.expire("2026-06-01T00:00:00+00:00", {"C2": None})
+    assert gone["expired"] == [("C1", "1.0")]
+    assert s.recent("2.0", 10)
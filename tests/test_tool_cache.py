@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import pytest
+from tool_cache import ToolResultCache
+
+
+def cache():
+    return ToolResultCache({"web_search": 60}, path=None)
+
+
+def test_async_followers_share_the_leaders_result():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "found"
+
+    async def run():
+        c = cache()
+        return await asyncio.gather(*(c.aget_or_compute("web_search", {"query": "x"}, compute) for _ in range(3)))
+
+    assert asyncio.run(run()) == ["found"] * 3
+    assert len(calls) == 1
+
+
+def test_async_follower_survives_leader_cancellation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "found"
+
+    async def run():
+        c = cache()
+        leader = asyncio.create_task(c.aget_or_compute("web_search", {"query": "x"}, compute))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(c.aget_or_compute("web_search", {"query": "x"}, compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, follower.cancelled()
+
+    assert asyncio.run(run()) == ("found", False)
+    assert len(calls) == 2
+
+
+def test_async_errors_are_shared():
+    async def compute():
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream down")
+
+    async def run():
+        c = cache()
+        return await asyncio.gather(*(c.aget_or_compute("web_search", {"query": "x"}, compute) for _ in range(2)), return_exceptions=True)
+
+    assert [type(r) for r in asyncio.run(run())] == [ValueError, ValueError]
+
+
+def test_sync_followers_share_the_leaders_result():
+    c = cache()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "found"
+
+    leader = threading.Thread(target=lambda: results.append(c.get_or_compute("web_search", {"query": "x"}, compute)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(c.get_or_compute("web_search", {"query": "x"}, compute)))
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+    assert results == ["found", "found"]
+    assert len(calls) == 1
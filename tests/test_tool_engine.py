@@ -0,0 +1,84 @@
+import time
+import asyncio
+from tool_engine import ToolEngine, AsyncToolEngine, ToolJob
+
+
+def sleeper(seconds, result):
+    def fn(cancel):
+        cancel.wait(seconds)
+        return result
+    return fn
+
+
+def asleeper(seconds, result):
+    async def fn(cancel):
+        await asyncio.sleep(seconds)
+        return result
+    return fn
+
+
+def test_results_keep_submission_order():
+    engine = ToolEngine(max_workers=3)
+    jobs = [ToolJob(f"call_{n}", "t", sleeper(delay, n), 5) for n, delay in enumerate([0.2, 0.0, 0.1])]
+    assert [result for _, result in engine.run_all(jobs)] == [0, 1, 2]
+
+
+def test_duplicate_and_empty_ids_dont_overwrite():
+    engine = ToolEngine(max_workers=4)
+    jobs = [ToolJob(call_id, "t", sleeper(0, n), 5) for n, call_id in enumerate(["a", "a", "", ""])]
+    results = engine.run_all(jobs)
+    assert [job for job, _ in results] == jobs
+    assert [result for _, result in results] == [0, 1, 2, 3]
+
+
+def test_slow_call_times_out_without_holding_others():
+    engine = ToolEngine(max_workers=2)
+    jobs = [ToolJob("slow", "slow", sleeper(5, "late"), 0.2), ToolJob("fast", "fast", sleeper(0, "ok"), 5)]
+    started = time.monotonic()
+    results = engine.run_all(jobs)
+    assert time.monotonic() - started < 1
+    assert results[0][1] == "The slow tool timed out after 0.2 seconds."
+    assert jobs[0].outcome == "timeout" and jobs[0].cancel.is_set()
+    assert results[1][1] == "ok"
+
+
+def test_deadline_counts_time_spent_queued():
+    engine = ToolEngine(max_workers=1)
+    jobs = [ToolJob("first", "t", sleeper(0.4, "first"), 5), ToolJob("queued", "t", sleeper(0, "queued"), 0.2)]
+    started = time.monotonic()
+    results = engine.run_all(jobs)
+    assert results[1][1] == "The t tool timed out after 0.2 seconds."
+    assert results[0][1] == "first"
+    assert time.monotonic() - started < 1
+
+
+def test_async_results_keep_submission_order():
+    engine = AsyncToolEngine(max_workers=3)
+    jobs = [ToolJob("", "t", asleeper(delay, n), 5) for n, delay in enumerate([0.2, 0.0, 0.1])]
+    assert [result for _, result in asyncio.run(engine.run_all(jobs))] == [0, 1, 2]
+
+
+def test_async_deadline_counts_time_spent_queued():
+    async def run():
+        engine = AsyncToolEngine(max_workers=1)
+        jobs = [ToolJob("first", "t", asleeper(0.4, "first"), 5), ToolJob("queued", "t", asleeper(0, "queued"), 0.2)]
+        started = time.monotonic()
+        results = await engine.run_all(jobs)
+        return results, time.monotonic() - started, jobs
+
+    results, took, jobs = asyncio.run(run())
+    assert results[0][1] == "first"
+    assert results[1][1] == "The t tool timed out after 0.2 seconds."
+    assert jobs[1].started is None and jobs[1].outcome == "timeout"
+    assert took < 1
+
+
+def test_async_errors_become_results():
+    async def broken(cancel):
+        raise ValueError("nope")
+
+    engine = AsyncToolEngine()
+    job = ToolJob("x", "t", broken, 5)
+    [(_, result)] = asyncio.run(engine.run_all([job]))
+    assert result == "The t tool failed. nope"
+    assert job.outcome == "error"
@@ -0,0 +1,42 @@
+import turn
+from cache import TTLCache
+
+
+def call(call_id, name, arguments):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+
+
+def test_tool_jobs_survive_broken_arguments():
+    ran = []
+    jobs, queries = turn.tool_jobs(
+        [call("a", "web_search", '{"query": "cats"}'), call("b", "url_scrape", "{not json")],
+        "tell me",
+        lambda name, args: lambda cancel: ran.append((name, args)),
+    )
+    assert [(job.call_id, job.name) for job in jobs] == [("a", "web_search"), ("b", "url_scrape")]
+    assert queries == ["tell me cats", "tell me"]
+    for job in jobs:
+        job.fn(None)
+    assert ran == [("web_search", {"query": "cats"}), ("url_scrape", {})]
+
+
+def test_tool_status_leaves_out_background_jobs(monkeypatch):
+    calls = [call("a", "web_search", "{}"), call("b", "deep_research", "{}")]
+    monkeypatch.setattr(turn, "BACKGROUND_JOBS", True)
+    monkeypatch.setattr(turn, "LONG_TOOLS", {"deep_research"})
+    assert turn.tool_status(calls) == turn.tools_status_text(["web_search"])
+    jobs, _ = turn.tool_jobs(calls, "", lambda name, args: None)
+    assert not turn.needs_long_lane(jobs)
+    monkeypatch.setattr(turn, "BACKGROUND_JOBS", False)
+    assert turn.needs_long_lane(jobs)
+
+
+class Breakers:
+    def breaker_states(self):
+        return {"search": "open"}
+
+
+def test_gauges_without_chat_memory():
+    samples = turn.gauges([TTLCache("names", maxsize=4, ttl=60)], None, Breakers())
+    assert ("symphony_breaker_open", {"endpoint": "search"}, 1) in samples
+    assert {name for name, labels, value in samples} == {"symphony_cache_hit_rate", "symphony_cache_size", "symphony_breaker_open"}
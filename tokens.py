@@ -0,0 +1,45 @@
+import json
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # tiktoken is optional (`pip install .[tokens]`); without it we estimate ~4 chars per token
+    _encoding = None
+
+
+# token counting for prompt budgets. exact for OpenAI-style tokenizers when tiktoken is
+# installed, a close enough estimate for everything else (and for other providers anyway).
+
+IMAGE_TOKENS = 765
+MESSAGE_OVERHEAD = 4
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def message_tokens(msg):
+    total = MESSAGE_OVERHEAD
+    content = msg.get("content")
+    if isinstance(content, list):
+        for part in content:
+            if part.get("type") == "text":
+                total += count_tokens(part.get("text"))
+            else:
+                total += IMAGE_TOKENS
+    else:
+        total += count_tokens(content)
+    if msg.get("tool_calls"):
+        total += count_tokens(msg["tool_calls"])
+    return total
+
+
+def messages_tokens(msgs):
+    return sum(message_tokens(m) for m in msgs)
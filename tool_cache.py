@@ -0,0 +1,206 @@
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from urllib.parse import urlsplit, urlunsplit
+from cache import TTLCache
+
+
+# caches tool results (web_search, url_scrape, deep_research) under a hash of the
+# normalized (tool, arguments) pair. memory LRU in front, a local sqlite file behind it
+# so paid lookups survive restarts, and single-flight so identical calls that land at
+# the same time share one upstream request. only successful results get stored:
+# if the compute function raises, nothing is cached and every waiter sees the error.
+# a leader that never finished (cancelled at its tool deadline) shares nothing: a
+# waiter that is still within its own deadline takes over and computes it itself.
+
+
+def normalize_arg(key, value):
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if key == "url":
+        try:
+            parts = urlsplit(value)
+            path = parts.path.rstrip("/") or "/"
+            return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+        except ValueError:
+            return value
+    return re.sub(r"\s+", " ", value).lower()
+
+
+def cache_key(tool, arguments):
+    normalized = {k: normalize_arg(k, v) for k, v in sorted(arguments.items()) if k != "fresh" and v is not None}
+    raw = json.dumps({"tool": tool, "args": normalized}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DiskStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("pragma journal_mode=wal")
+            self.conn.execute(
+                "create table if not exists tool_cache ("
+                " key text primary key, tool text not null, value text not null, expires_at real not null)"
+            )
+            self.conn.execute("delete from tool_cache where expires_at < ?", (time.time(),))
+            self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "select value, expires_at from tool_cache where key = ?", (key,)
+            ).fetchone()
+        if not row:
+            return None
+        value, expires_at = row
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            return None
+        return json.loads(value), remaining
+
+    def set(self, key, tool, value, ttl):
+        with self.lock:
+            self.conn.execute(
+                "insert or replace into tool_cache (key, tool, value, expires_at) values (?, ?, ?, ?)",
+                (key, tool, json.dumps(value), time.time() + ttl)
+            )
+            self.conn.commit()
+
+
+class ToolResultCache:
+    def __init__(self, ttls, path="tool_cache.db", maxsize=500):
+        self.ttls = ttls
+        self.memory = TTLCache("tool_results", maxsize=maxsize)
+        self.disk = DiskStore(path) if path else None
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "shared": 0, "bypassed": 0, "errors": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def _lookup(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.disk:
+            try:
+                found = self.disk.get(key)
+            except Exception as e:
+                print(f"tool cache disk read failed. {e}")
+                found = None
+            if found:
+                value, remaining = found
+                self.memory.set(key, value, ttl=remaining)
+                self._count("disk_hits")
+                return value
+        return None
+
+    def _store(self, key, tool, value):
+        ttl = self.ttls.get(tool, 0)
+        if ttl <= 0:
+            return
+        self.memory.set(key, value, ttl=ttl)
+        if self.disk:
+            try:
+                self.disk.set(key, tool, value, ttl)
+            except Exception as e:
+                print(f"tool cache disk write failed. {e}")
+
+    def get_or_compute(self, tool, arguments, compute, fresh=False):
+        key = cache_key(tool, arguments)
+        if fresh:
+            self._count("bypassed")
+        else:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+        while True:
+            with self.lock:
+                flight = self.inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = {"done": threading.Event(), "value": None, "error": None, "finished": False}
+                    self.inflight[key] = flight
+            if leader:
+                break
+            self._count("shared")
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            if flight["finished"]:
+                return flight["value"]
+
+        self._count("misses")
+        try:
+            value = compute()
+            flight["value"] = value
+            flight["finished"] = True
+            self._store(key, tool, value)
+            return value
+        except Exception as e:
+            self._count("errors")
+            flight["error"] = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight["done"].set()
+
+    async def aget_or_compute(self, tool, arguments, compute, fresh=False):
+        # asyncio flavour, compute is a coroutine function. the event loop is single
+        # threaded so an asyncio future per key is all the single-flight we need.
+        key = cache_key(tool, arguments)
+        if fresh:
+            self._count("bypassed")
+        else:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+        while (flight := self.inflight.get(key)) is not None:
+            self._count("shared")
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                # the leader was cancelled, not us: go again (and most likely lead this time)
+                if not flight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        flight = asyncio.get_running_loop().create_future()
+        self.inflight[key] = flight
+        self._count("misses")
+        try:
+            value = await compute()
+            self._store(key, tool, value)
+            flight.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            self._count("errors")
+            flight.set_exception(e)
+            # nobody may be waiting, don't let asyncio complain about it
+            flight.exception()
+            raise
+        finally:
+            self.inflight.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        lookups = counts["memory_hits"] + counts["disk_hits"] + counts["misses"] + counts["shared"]
+        counts["hit_rate"] = round((counts["memory_hits"] + counts["disk_hits"]) / lookups, 4) if lookups else 0.0
+        counts["memory"] = self.memory.stats()
+        return counts
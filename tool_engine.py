@@ -0,0 +1,148 @@
+import time
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import record
+
+
+# runs the tool calls from one model turn side by side on a shared, bounded pool.
+# every call gets its own deadline (counted from when it was submitted, so time spent
+# queued behind other calls counts too) and a cancel event the tool can check before
+# doing anything visible. results come back by position, not by tool_call_id, since
+# the model is free to repeat or leave out ids.
+# slow tools (long_tools) get a pool of their own so they never queue up fast ones.
+
+class ToolJob:
+    def __init__(self, call_id, name, fn, timeout):
+        self.call_id = call_id
+        self.name = name
+        self.fn = fn
+        self.timeout = timeout
+        self.cancel = threading.Event()
+        self.submitted = None
+        self.started = None
+        self.finished = None
+        self.outcome = "ok"
+
+
+def timed_out(job):
+    return f"The {job.name} tool timed out after {job.timeout:g} seconds."
+
+
+def record_job(job):
+    # called from run_all, i.e. on the request's own thread/task, so it lands in its trace
+    if job.started is None:
+        return
+    record("tool", (job.finished or time.monotonic()) - job.started, tool=job.name, outcome=job.outcome)
+
+
+class ToolEngine:
+    def __init__(self, max_workers=4, timeout_result=None, long_tools=(), long_workers=2):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="symphony-tool")
+        self.long_tools = set(long_tools)
+        self.long_pool = ThreadPoolExecutor(max_workers=long_workers, thread_name_prefix="symphony-long-tool") if self.long_tools else None
+        self.timeout_result = timeout_result or timed_out
+
+    def _pool_for(self, job):
+        return self.long_pool if job.name in self.long_tools else self.pool
+
+    def _run(self, job):
+        job.started = time.monotonic()
+        try:
+            if job.cancel.is_set():
+                return self.timeout_result(job)
+            return job.fn(job.cancel)
+        except Exception as e:
+            job.outcome = "error"
+            print(f"tool {job.name} blew up. {e}")
+            traceback.print_exc()
+            return f"The {job.name} tool failed. {e}"
+        finally:
+            job.finished = time.monotonic()
+
+    def run_all(self, jobs):
+        # returns [(job, result)] in the same order the jobs came in
+        futures = {}
+        for n, job in enumerate(jobs):
+            job.submitted = time.monotonic()
+            futures[self._pool_for(job).submit(self._run, job)] = n
+        results = [None] * len(jobs)
+        pending = set(futures)
+
+        while pending:
+            now = time.monotonic()
+            next_deadline = None
+
+            for fut in list(pending):
+                n = futures[fut]
+                job = jobs[n]
+                if fut.done():
+                    results[n] = fut.result()
+                    pending.discard(fut)
+                    continue
+                deadline = job.submitted + job.timeout
+                if now >= deadline:
+                    print(f"tool {job.name} ({job.call_id}) hit its {job.timeout:g}s deadline, cancelling")
+                    job.cancel.set()
+                    job.outcome = "timeout"
+                    fut.cancel()
+                    results[n] = self.timeout_result(job)
+                    pending.discard(fut)
+                elif next_deadline is None or deadline < next_deadline:
+                    next_deadline = deadline
+
+            if pending:
+                # wake up on the next finished call or the next deadline
+                wait(pending, timeout=max(0.0, next_deadline - now), return_when=FIRST_COMPLETED)
+
+        for job in jobs:
+            record_job(job)
+        return list(zip(jobs, results))
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.long_pool:
+            self.long_pool.shutdown(wait=False, cancel_futures=True)
+
+
+# same contract as ToolEngine for the asyncio runtime: job.fn is a coroutine function,
+# a semaphore bounds how many run at once, and a timed out call really gets cancelled.
+
+class AsyncToolEngine:
+    def __init__(self, max_workers=4, timeout_result=None, long_tools=(), long_workers=2):
+        self.slots = asyncio.Semaphore(max_workers)
+        self.long_tools = set(long_tools)
+        self.long_slots = asyncio.Semaphore(long_workers)
+        self.timeout_result = timeout_result or timed_out
+
+    async def _call(self, job):
+        async with (self.long_slots if job.name in self.long_tools else self.slots):
+            job.started = time.monotonic()
+            try:
+                return await job.fn(job.cancel)
+            finally:
+                job.finished = time.monotonic()
+
+    async def _run(self, job):
+        # the deadline covers waiting for a slot as well as the call itself
+        try:
+            return await asyncio.wait_for(self._call(job), job.timeout)
+        except asyncio.TimeoutError:
+            print(f"tool {job.name} ({job.call_id}) hit its {job.timeout:g}s deadline, cancelling")
+            job.cancel.set()
+            job.outcome = "timeout"
+            return self.timeout_result(job)
+        except Exception as e:
+            job.outcome = "error"
+            print(f"tool {job.name} blew up. {e}")
+            traceback.print_exc()
+            return f"The {job.name} tool failed. {e}"
+
+    async def run_all(self, jobs):
+        for job in jobs:
+            job.submitted = time.monotonic()
+        results = await asyncio.gather(*(self._run(job) for job in jobs))
+        for job in jobs:
+            record_job(job)
+        return list(zip(jobs, results))
@@ -0,0 +1,144 @@
+import json
+import time
+import datetime
+from tool_engine import ToolJob
+from metrics import record_usage
+from media import image_filename
+from prompts import tools_status_text
+from config import *
+
+
+# the parts of a turn that app.py (threads) and async_app.py (asyncio) share: putting the
+# prompt together, reading the model's answer and its tool calls, the footer, the rows that
+# go into chat memory and the gauges. nothing in here waits on anything, so each runtime only
+# keeps the code that talks to Slack, the LLM and the stores.
+
+def current_time():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def memory_row(channel_id, thread_ts, role, content, user_name=None):
+    row = {"channel_id": channel_id, "thread_ts": thread_ts, "role": role, "content": content or ""}
+    if user_name:
+        row["user_name"] = user_name
+    return row
+
+def build_prompt(builder, model, history, user_name, summary=None, images=None, recalled=None, result=None):
+    return builder.build(
+        model,
+        history,
+        summary=summary,
+        images=images,
+        recalled=recalled,
+        result=result,
+        user_name=user_name,
+        current_time=current_time()
+    )
+
+def completion(create, msgs, tools, tool_choice):
+    # fn(model) for the router; create is the client's completions.create or a bound stream_completion
+    return lambda model: create(model=model, messages=msgs, tools=tools, tool_choice=tool_choice)
+
+def read_response(model, response):
+    # (content, tool calls as dicts) of a non-streamed completion
+    record_usage(model, response.usage)
+    message = response.choices[0].message
+    return message.content, [tool_call.model_dump() for tool_call in message.tool_calls or []]
+
+
+# --------- TOOL CALLS ---------
+def in_background(function_name):
+    return BACKGROUND_JOBS and function_name in LONG_TOOLS
+
+def tool_status(tool_calls):
+    # one edit for the whole round instead of a status message per tool; jobs post their own
+    return tools_status_text([
+        call["function"]["name"] for call in tool_calls
+        if not in_background(call["function"]["name"])
+    ])
+
+def tool_arguments(tool_call):
+    try:
+        return json.loads(tool_call["function"]["arguments"] or "{}")
+    except Exception as e:
+        print(f"model sent broken tool args for {tool_call['function']['name']}. {e}")
+        return {}
+
+def tool_jobs(tool_calls, user_message, run):
+    # run(name, arguments) -> fn(cancel) for the tool engine. also returns, per job, what its
+    # output gets ranked against when it has to be trimmed
+    jobs = []
+    queries = []
+    for tool_call in tool_calls:
+        function_name = tool_call["function"]["name"]
+        arguments = tool_arguments(tool_call)
+        queries.append(" ".join([user_message] + [str(v) for v in arguments.values() if isinstance(v, str)]))
+        jobs.append(ToolJob(tool_call["id"], function_name, run(function_name, arguments), TOOL_TIMEOUTS.get(function_name, 60)))
+    return jobs, queries
+
+def needs_long_lane(jobs):
+    # slow tools move the turn to the long lane so it stops holding a chat slot
+    # (with background jobs on they only get queued, so the turn stays put)
+    return not BACKGROUND_JOBS and any(job.name in LONG_TOOLS for job in jobs)
+
+def tool_messages(results, queries, reducer):
+    return [{
+        "role": "tool",
+        "tool_call_id": job.call_id,
+        "name": job.name,
+        "content": reducer.reduce(job.name, the_result, query)
+    } for (job, the_result), query in zip(results, queries)]
+
+
+# --------- REPLIES ---------
+def reply_footer(model, start_time, streamer, trace):
+    footer = f"Model: {model} | Latency: {round(time.time() - start_time, 2)}"
+    if streamer and streamer.time_to_first_token() is not None:
+        footer += f" | First token: {streamer.time_to_first_token()}"
+    if METRICS_FOOTER_BREAKDOWN:
+        footer += f" | {trace.summary()}"
+    return footer
+
+def error_text(error):
+    return f"Unable to call AI service. : {error}"
+
+def image_uploads(images, prompt):
+    return [
+        {"file": data, "filename": image_filename(n if len(images) > 1 else 0, mimetype), "title": prompt}
+        for n, (data, mimetype) in enumerate(images, start=1)
+    ]
+
+def images_uploaded_text(images):
+    return f"{len(images)} image(s) generated and uploaded to Slack." if len(images) > 1 else "Image generated and uploaded to Slack."
+
+
+# --------- JOBS ---------
+def job_failure_text(job, error):
+    return f"Sorry, I couldn't finish that ({job['kind']}) after {job['attempts']} tries. :( {error}"
+
+def research_footer(model, job):
+    return f"Model: {model} | Deep research: {round(time.time() - job['created_at'])}s"
+
+
+# --------- METRICS ---------
+def gauges(caches, chat_memory, http):
+    # chat_memory is None until the async runtime has set it up
+    samples = []
+    if chat_memory is not None:
+        caches = caches + [chat_memory.threads]
+        samples.append(("symphony_chat_mem_pending_rows", {}, len(chat_memory.writer.pending)))
+    for cache in caches:
+        stats = cache.stats()
+        samples.append(("symphony_cache_hit_rate", {"cache": stats["name"]}, stats["hit_rate"]))
+        samples.append(("symphony_cache_size", {"cache": stats["name"]}, stats["size"]))
+    for name, state in http.breaker_states().items():
+        samples.append(("symphony_breaker_open", {"endpoint": name}, 0 if state == "closed" else 1))
+    return samples
+
+
+# --------- STARTUP ---------
+# the tables the configured stores keep in Supabase; with everything local there's nothing to check
+SUPABASE_TABLES = [(table, column) for kind, table, column in (
+    (CONVERSATION_STORE, "chat_summaries", "thread_ts"),
+    (COORDINATION_STORE, "bot_leases", "key"),
+    (JOB_STORE, "bot_jobs", "id"),
+) if kind == "supabase"]
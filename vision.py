@@ -0,0 +1,159 @@
+import io
+import base64
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cache import TTLCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # pillow is optional; without it images are sent as-is (still fetched once and cached)
+    Image = None
+
+
+# turns the image attachments of a message into image_url parts for the model.
+# every Slack file is downloaded once (all of them at the same time), shrunk to
+# max_dim / max_bytes, base64'd, and cached by file id. images posted earlier in a
+# thread are remembered so follow-up questions can still see them without a re-download.
+
+
+def image_files(files):
+    return [f for f in files or [] if f.get("mimetype", "").startswith("image/") and f.get("url_private")]
+
+
+def shrink_image(data, mimetype, max_dim=1568, max_bytes=1_500_000, quality=85):
+    # returns (bytes, mimetype). small images pass straight through.
+    if Image is None:
+        return data, mimetype
+    try:
+        img = Image.open(io.BytesIO(data))
+        if len(data) <= max_bytes and max(img.size) <= max_dim and img.format in ("JPEG", "PNG", "WEBP", "GIF"):
+            return data, Image.MIME.get(img.format, mimetype)
+
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dim, max_dim))
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        out = io.BytesIO()
+        while True:
+            out.seek(0)
+            out.truncate()
+            img.save(out, format="JPEG", quality=quality, optimize=True)
+            if out.tell() <= max_bytes or quality <= 40:
+                break
+            quality -= 15
+        return out.getvalue(), "image/jpeg"
+    except Exception as e:
+        print(f"couldn't shrink image, sending it as is. {e}")
+        return data, mimetype
+
+
+def to_part(data, mimetype):
+    return {
+        "type": "image_url",
+        "image_url": {"url": f"data:{mimetype};base64,{base64.b64encode(data).decode('ascii')}"}
+    }
+
+
+def attach_images(msgs, parts):
+    # puts the images on the newest user turn (the message being answered)
+    if not parts:
+        return msgs
+    for msg in reversed(msgs):
+        if msg["role"] == "user":
+            text = msg["content"] if isinstance(msg["content"], str) else ""
+            msg["content"] = [{"type": "text", "text": text}] + parts
+            break
+    return msgs
+
+
+class VisionPipeline:
+    def __init__(self, download, max_dim=1568, max_bytes=1_500_000, quality=85, max_images=4,
+                 cache_size=128, cache_ttl=3600, workers=4):
+        self.download = download
+        self.max_dim = max_dim
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.max_images = max_images
+        self.parts = TTLCache("vision_images", maxsize=cache_size, ttl=cache_ttl)
+        self.thread_files = TTLCache("vision_thread_files", maxsize=2000, ttl=cache_ttl)
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="symphony-vision")
+
+    def _files_for(self, thread_ts, files):
+        # this message's images first, then ones posted earlier in the thread
+        current = image_files(files)
+        earlier = self.thread_files.get(thread_ts) or []
+        ids = {f.get("id") or f["url_private"] for f in current}
+        merged = current + [f for f in earlier if f["id"] not in ids]
+        return merged[:self.max_images]
+
+    def remember(self, thread_ts, files):
+        # called once the message has passed moderation, so flagged uploads never carry over
+        current = image_files(files)
+        if not current:
+            return
+        with self.lock:
+            merged = self._files_for(thread_ts, current)
+            self.thread_files.set(thread_ts, [
+                {"id": f.get("id") or f["url_private"], "url_private": f["url_private"], "mimetype": f["mimetype"], "name": f.get("name")}
+                for f in merged
+            ])
+
+    def _process(self, file):
+        key = file.get("id") or file["url_private"]
+        part = self.parts.get(key)
+        if part is not None:
+            return part
+        print(f"Got img :3 {file.get('name')}")
+        data = self.download(file["url_private"])
+        if not data:
+            return None
+        data, mimetype = shrink_image(data, file["mimetype"], self.max_dim, self.max_bytes, self.quality)
+        part = to_part(data, mimetype)
+        self.parts.set(key, part)
+        return part
+
+    def prepare(self, thread_ts, files, remember=True):
+        if remember:
+            self.remember(thread_ts, files)
+        wanted = self._files_for(thread_ts, files)
+        if not wanted:
+            return []
+        parts = list(self.pool.map(self._process, wanted))
+        return [p for p in parts if p]
+
+    async def aprepare(self, thread_ts, files, adownload, remember=True):
+        # asyncio flavour: downloads on the loop, resizing (cpu work) on the pool
+        if remember:
+            self.remember(thread_ts, files)
+        wanted = self._files_for(thread_ts, files)
+        if not wanted:
+            return []
+
+        async def one(file):
+            key = file.get("id") or file["url_private"]
+            part = self.parts.get(key)
+            if part is not None:
+                return part
+            print(f"Got img :3 {file.get('name')}")
+            data = await adownload(file["url_private"])
+            if not data:
+                return None
+            loop = asyncio.get_running_loop()
+            data, mimetype = await loop.run_in_executor(
+                self.pool, shrink_image, data, file["mimetype"], self.max_dim, self.max_bytes, self.quality
+            )
+            part = to_part(data, mimetype)
+            self.parts.set(key, part)
+            return part
+
+        parts = await asyncio.gather(*(one(f) for f in wanted))
+        return [p for p in parts if p]